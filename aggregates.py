@@ -0,0 +1,317 @@
+"""Per-location and per-home rollups, kept current as readings arrive.
+
+Live: every tracked device feeds the rollup of its location and of its
+owner's whole home. A sensor reading replaces that device's value in a
+running total, a switch or liveness change moves it in or out of a set,
+so each update is O(1) and a dashboard header reads its numbers without
+touching the devices or readings. A minimum or maximum that loses its
+holder is recomputed on the next read, from that location's devices only.
+
+History: MQTTClient.store_batch adds every stored sensor reading to an
+hourly row of location_rollups (count, total, min, max per user,
+location, sensor type and hour) in the same transaction as the reading,
+so the rollups stay exact through retries and spool replays. Writes that
+bypass it (bulk loads, the demo history) call rebuild() for the hours
+they touched, and migration 6 uses it for readings stored before the
+table existed.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import LocationRollup
+
+rollups = LocationRollup.__table__
+
+# Types whose readings are numbers; the others are switches with an on/off state
+NUMERIC_TYPES = ("temperature", "humidity")
+# Wording of the switch counts in a summary: "2/3 cameras active"
+SWITCH_LABELS = {
+    "camera": ("cameras", "active"),
+    "light": ("lights", "on"),
+    "curtain": ("curtains", "open"),
+    "door": ("doors", "unlocked"),
+}
+
+# Adds one batch's hourly rows to what is stored; merged per key
+_insert = sqlite_insert(rollups)
+upsert_rollups = _insert.on_conflict_do_update(
+    index_elements=["user_id", "location", "type", "hour"],
+    set_={
+        "count": rollups.c.count + _insert.excluded.count,
+        "total": rollups.c.total + _insert.excluded.total,
+        "min_value": func.min(rollups.c.min_value, _insert.excluded.min_value),
+        "max_value": func.max(rollups.c.max_value, _insert.excluded.max_value),
+    },
+)
+
+
+def hourly_rows(readings):
+    """location_rollups rows for a batch of records.Reading, one per key and hour"""
+    rows = {}
+    for reading in readings:
+        device = reading.device
+        if device.type not in NUMERIC_TYPES or reading.value is None:
+            continue
+        hour = reading.timestamp.replace(minute=0, second=0, microsecond=0)
+        key = (device.user_id, device.location or "", device.type, hour)
+        row = rows.get(key)
+        if row is None:
+            rows[key] = {"user_id": key[0], "location": key[1], "type": key[2], "hour": hour,
+                         "count": 1, "total": reading.value,
+                         "min_value": reading.value, "max_value": reading.value}
+        else:
+            row["count"] += 1
+            row["total"] += reading.value
+            row["min_value"] = min(row["min_value"], reading.value)
+            row["max_value"] = max(row["max_value"], reading.value)
+    return list(rows.values())
+
+
+def rebuild(conn, since=None, until=None):
+    """Recompute the location_rollups rows of hours in [since, until) from the readings
+
+    since and until are whole hours; None leaves that end open. Runs in
+    the caller's transaction; returns the number of rows built.
+    """
+    bounds = []  # conditions on a timestamp column, filled in per query
+    params = []
+    if since is not None:
+        bounds.append("{} >= ?")
+        params.append(since.isoformat(" ", "microseconds"))
+    if until is not None:
+        bounds.append("{} < ?")
+        params.append(until.isoformat(" ", "microseconds"))
+
+    def within(column):
+        return "".join(" AND " + bound.format(column) for bound in bounds)
+
+    conn.exec_driver_sql("DELETE FROM location_rollups WHERE 1" + within("hour"), tuple(params))
+    hour = "strftime('%Y-%m-%d %H:00:00.000000', r.timestamp)"
+    return conn.exec_driver_sql(
+        "INSERT INTO location_rollups (user_id, location, type, hour, count, total, min_value, max_value) "
+        f"SELECT d.user_id, coalesce(d.location, ''), d.type, {hour}, "
+        "count(r.value), sum(r.value), min(r.value), max(r.value) "
+        "FROM sensor_readings AS r JOIN devices AS d ON d.id = r.device_id "
+        "WHERE d.type IN ('temperature', 'humidity') AND d.user_id IS NOT NULL AND r.value IS NOT NULL"
+        f"{within('r.timestamp')} GROUP BY d.user_id, coalesce(d.location, ''), d.type, {hour}",
+        tuple(params),
+    ).rowcount
+
+
+def history(session, user_id, device_type, hours=24, location=None):
+    """Hourly (hour, mean, min, max, count) of a sensor type, oldest first
+
+    location=None covers the whole home. Reads location_rollups only.
+    """
+    since = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    query = (
+        session.query(
+            LocationRollup.hour,
+            func.sum(LocationRollup.total) / func.sum(LocationRollup.count),
+            func.min(LocationRollup.min_value),
+            func.max(LocationRollup.max_value),
+            func.sum(LocationRollup.count),
+        )
+        .filter(
+            LocationRollup.user_id == user_id,
+            LocationRollup.type == device_type,
+            LocationRollup.hour >= since,
+        )
+    )
+    if location is not None:
+        query = query.filter(LocationRollup.location == location)
+    return query.group_by(LocationRollup.hour).order_by(LocationRollup.hour).all()
+
+
+class SensorRollup:
+    """Latest value of every sensor of one type, with running total and extremes"""
+
+    __slots__ = ("values", "total", "min", "max", "stale")
+
+    def __init__(self):
+        self.values = {}  # device id -> latest value
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.stale = False  # min/max lost their holder; recomputed on read
+
+    def set(self, device_id, value):
+        old = self.values.get(device_id)
+        self.values[device_id] = value
+        self.total += value - (old or 0.0)
+        if self.stale:
+            return
+        if self.max is None or value >= self.max:
+            self.max = value
+        elif old == self.max:
+            self.stale = True
+        if self.min is None or value <= self.min:
+            self.min = value
+        elif old == self.min:
+            self.stale = True
+
+    def remove(self, device_id):
+        old = self.values.pop(device_id, None)
+        if old is not None:
+            self.total -= old
+            self.stale = self.stale or old in (self.min, self.max)
+
+    def summary(self):
+        """(mean, min, max), or None when no sensor has reported"""
+        if not self.values:
+            return None
+        if self.stale:
+            self.min = min(self.values.values())
+            self.max = max(self.values.values())
+            self.stale = False
+        return self.total / len(self.values), self.min, self.max
+
+
+class Rollup:
+    """Live aggregate of the devices in one location, or in a whole home"""
+
+    __slots__ = ("counts", "sensors", "on", "online")
+
+    def __init__(self):
+        self.counts = {}   # device type -> devices
+        self.sensors = {}  # numeric type -> SensorRollup
+        self.on = {}       # switch type -> ids of devices switched on
+        self.online = set()
+
+    def add(self, device_type):
+        self.counts[device_type] = self.counts.get(device_type, 0) + 1
+
+    def discard(self, device_id, device_type):
+        self.counts[device_type] -= 1
+        if not self.counts[device_type]:
+            del self.counts[device_type]
+        if device_type in self.sensors:
+            self.sensors[device_type].remove(device_id)
+        self.on.get(device_type, set()).discard(device_id)
+        self.online.discard(device_id)
+
+    def set_value(self, device_id, device_type, value):
+        sensor = self.sensors.get(device_type)
+        if sensor is None:
+            sensor = self.sensors[device_type] = SensorRollup()
+        sensor.set(device_id, value)
+
+    def set_state(self, device_id, device_type, state):
+        on = self.on.setdefault(device_type, set())
+        if state:
+            on.add(device_id)
+        else:
+            on.discard(device_id)
+
+    def set_online(self, device_id, online):
+        if online:
+            self.online.add(device_id)
+        else:
+            self.online.discard(device_id)
+
+
+class LocationAggregates:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}  # device id -> (user id, location, type)
+        # (user id, location) -> Rollup; location None is the whole home, '' no location
+        self.rollups = {}
+
+    def _rollups(self, device_id):
+        user_id, location, _ = self.devices[device_id]
+        return self.rollups[(user_id, location)], self.rollups[(user_id, None)]
+
+    def track(self, device):
+        """Start following a device, or take its location and switch state from the row
+
+        Safe to repeat; a sensor's value is only seeded from the row the
+        first time, after that readings keep it current.
+        """
+        key = (device.user_id, device.location or "", device.type)
+        with self.lock:
+            known = self.devices.get(device.id)
+            if known != key:
+                if known is not None:
+                    self._untrack(device.id)
+                self.devices[device.id] = key
+                for rollup in self._new_rollups(device.user_id, key[1]):
+                    rollup.add(device.type)
+                    if device.type in NUMERIC_TYPES:
+                        try:
+                            rollup.set_value(device.id, device.type, float(device.value))
+                        except (TypeError, ValueError):
+                            pass
+            for rollup in self._rollups(device.id):
+                if device.type not in NUMERIC_TYPES:
+                    rollup.set_state(device.id, device.type, device.state)
+                rollup.set_online(device.id, device.is_online)
+
+    def _new_rollups(self, user_id, location):
+        return [self.rollups.setdefault((user_id, location), Rollup()),
+                self.rollups.setdefault((user_id, None), Rollup())]
+
+    def untrack(self, device_id):
+        with self.lock:
+            if device_id in self.devices:
+                self._untrack(device_id)
+
+    def _untrack(self, device_id):
+        for rollup in self._rollups(device_id):
+            rollup.discard(device_id, self.devices[device_id][2])
+        del self.devices[device_id]
+
+    def reading(self, device_id, value):
+        """A sensor's newest value; ignored for devices not tracked"""
+        with self.lock:
+            known = self.devices.get(device_id)
+            if known is None or known[2] not in NUMERIC_TYPES or value is None:
+                return
+            for rollup in self._rollups(device_id):
+                rollup.set_value(device_id, known[2], value)
+
+    def set_online(self, device_id, online):
+        with self.lock:
+            if device_id in self.devices:
+                for rollup in self._rollups(device_id):
+                    rollup.set_online(device_id, online)
+
+    def summary(self, user_id, location=None):
+        """Current numbers of a location (None: the whole home) as a dict"""
+        key = (user_id, None if location is None else location or "")
+        with self.lock:
+            rollup = self.rollups.get(key)
+            if rollup is None:
+                return {}
+            summary = {"devices": sum(rollup.counts.values()), "online": len(rollup.online)}
+            for device_type, sensor in rollup.sensors.items():
+                values = sensor.summary()
+                if values is not None:
+                    summary[device_type] = dict(zip(("mean", "min", "max"), values))
+            for device_type in SWITCH_LABELS:
+                if device_type in rollup.counts:
+                    summary[device_type] = (len(rollup.on.get(device_type, ())), rollup.counts[device_type])
+            return summary
+
+    def describe(self, user_id, location=None):
+        """One-line summary for a dashboard header"""
+        summary = self.summary(user_id, location)
+        parts = []
+        if "temperature" in summary:
+            parts.append(f"{summary['temperature']['mean']:.1f}°C avg")
+        if "humidity" in summary:
+            parts.append(f"{summary['humidity']['max']:.0f}% max humidity")
+        for device_type, (plural, word) in SWITCH_LABELS.items():
+            if device_type in summary:
+                on, total = summary[device_type]
+                parts.append(f"{on}/{total} {plural} {word}")
+        offline = summary.get("devices", 0) - summary.get("online", 0)
+        if offline:
+            parts.append(f"{offline} offline")
+        return " · ".join(parts)
+
+
+# Shared by the ingest hub and every dashboard session
+aggregates = LocationAggregates()
@@ -0,0 +1,193 @@
+"""Online anomaly detection on sensor streams.
+
+Catches the failures static thresholds miss:
+
+- spike:    reading far from the device's EWMA mean (z-score)
+- jump:     value changed faster than the device type physically can
+- flatline: the same value reported many times in a row (stuck sensor)
+- drift:    a persistent shift away from the trend mean (CUSUM)
+
+State is a fixed set of NumPy arrays with one slot per device, so memory
+is bounded and whole ingest batches are processed with array operations.
+"""
+import numpy as np
+
+# Per device type: (max rate of change per second, stddev floor for z-scores)
+TYPE_LIMITS = {
+    "temperature": (0.05, 0.2),
+    "humidity": (0.2, 0.5),
+}
+DEFAULT_LIMITS = (np.inf, 0.2)
+
+# Time constants (seconds) of the exponentially weighted averages; weights
+# depend on the time between readings, not on the sampling rate
+FAST_TAU = 20 * 60      # mean/variance used for spike z-scores
+SLOW_TAU = 50 * 60      # trend mean that drift is measured against
+Z_THRESHOLD = 5.0
+JUMP_MIN_STDS = 3.0     # a jump must also be larger than normal noise
+WARMUP_READINGS = 20    # readings before spike/drift detection starts
+FLATLINE_READINGS = 60  # identical readings in a row that count as stuck
+FLAT_EPSILON = 1e-9
+DRIFT_SLACK = 1.0       # CUSUM allowance, in stddevs
+DRIFT_LIMIT = 30.0      # CUSUM alarm level, in stddevs
+
+KINDS = ("spike", "jump", "flatline", "drift")
+
+
+class Anomaly:
+    __slots__ = ("device_id", "kind", "value", "timestamp", "score")
+
+    def __init__(self, device_id, kind, value, timestamp, score):
+        self.device_id = device_id
+        self.kind = kind
+        self.value = value
+        self.timestamp = timestamp
+        self.score = score
+
+    def describe(self):
+        if self.kind == "spike":
+            return f"spike to {self.value:.1f} ({self.score:.1f} stddevs from normal)"
+        if self.kind == "jump":
+            return f"sudden jump to {self.value:.1f} ({self.score:.2f} per second)"
+        if self.kind == "flatline":
+            return f"stuck at {self.value:.1f} for {self.score:.0f} readings"
+        return f"drifting, now {self.value:.1f} ({self.score:.0f} stddevs accumulated)"
+
+
+class AnomalyDetector:
+    ARRAYS = {
+        "count": np.int64,
+        "mean": np.float64,
+        "var": np.float64,
+        "slow_mean": np.float64,
+        "last": np.float64,
+        "last_ts": np.float64,
+        "flat_run": np.int64,
+        "cusum_pos": np.float64,
+        "cusum_neg": np.float64,
+        "max_rate": np.float64,
+        "min_std": np.float64,
+    }
+
+    def __init__(self, capacity=1024):
+        self.slots = {}  # device_id -> slot index
+        self.device_ids = []
+        for name, dtype in self.ARRAYS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def register(self, device_id, device_type=None):
+        """Slot of a device, allocating one (with its type's limits) if needed"""
+        slot = self.slots.get(device_id)
+        if slot is not None:
+            return slot
+        slot = len(self.device_ids)
+        if slot == len(self.count):
+            for name in self.ARRAYS:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.slots[device_id] = slot
+        self.device_ids.append(device_id)
+        self.max_rate[slot], self.min_std[slot] = TYPE_LIMITS.get(device_type, DEFAULT_LIMITS)
+        return slot
+
+    def forget(self, device_id):
+        """Reset a device's state, e.g. after it was repaired or recalibrated"""
+        slot = self.slots.get(device_id)
+        if slot is None:
+            return
+        for name in self.ARRAYS:
+            if name not in ("max_rate", "min_std"):
+                getattr(self, name)[slot] = 0
+
+    def process_batch(self, device_ids, timestamps, values):
+        """Feed a batch of readings and return the anomalies found in it
+
+        timestamps are epoch seconds. A batch may hold several readings of
+        the same device; they are applied in timestamp order.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        slots = np.fromiter(
+            (self.slots.get(i, -1) for i in device_ids), dtype=np.int64, count=len(values)
+        )
+        if (slots < 0).any():
+            for i, slot in enumerate(slots):
+                if slot < 0:
+                    slots[i] = self.register(device_ids[i])
+        if not len(values):
+            return []
+
+        # Order by device then time, and apply the n-th reading of every
+        # device in the n-th vectorized step
+        order = np.lexsort((timestamps, slots))
+        sorted_slots = slots[order]
+        positions = np.arange(len(order))
+        group_start = np.maximum.accumulate(
+            np.where(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]], positions, 0)
+        )
+        rank = positions - group_start
+
+        anomalies = []
+        for step in range(rank.max() + 1):
+            rows = order[rank == step]
+            anomalies.extend(self._step(slots[rows], timestamps[rows], values[rows]))
+        return anomalies
+
+    def _step(self, slot, ts, x):
+        """Update the given (distinct) slots with one reading each"""
+        count = self.count[slot]
+        seen = count > 0
+        ready = count >= WARMUP_READINGS
+        mean = np.where(seen, self.mean[slot], x)
+        slow_mean = np.where(seen, self.slow_mean[slot], x)
+        std = np.maximum(np.sqrt(self.var[slot]), self.min_std[slot])
+
+        # Spike: distance from the fast mean
+        z = (x - mean) / std
+        spike = ready & (np.abs(z) > Z_THRESHOLD)
+
+        # Jump: rate of change since the previous reading
+        elapsed = np.maximum(ts - self.last_ts[slot], 0.0)
+        diff = np.abs(x - self.last[slot])
+        rate = diff / np.maximum(elapsed, 1.0)
+        jump = seen & (rate > self.max_rate[slot]) & (diff > JUMP_MIN_STDS * std)
+
+        # Flatline: identical readings in a row, reported once per run
+        flat_run = np.where(seen & (diff <= FLAT_EPSILON), self.flat_run[slot] + 1, 0)
+        flatline = flat_run == FLATLINE_READINGS
+
+        # Drift: two-sided CUSUM of deviations from the trend mean
+        drift_z = np.where(ready, (x - slow_mean) / std, 0.0)
+        pos = np.maximum(0.0, self.cusum_pos[slot] + drift_z - DRIFT_SLACK)
+        neg = np.maximum(0.0, self.cusum_neg[slot] - drift_z - DRIFT_SLACK)
+        drift = (pos > DRIFT_LIMIT) | (neg > DRIFT_LIMIT)
+        drift_score = np.maximum(pos, neg)
+        pos[drift] = 0.0
+        neg[drift] = 0.0
+
+        # Fold the reading into the state
+        alpha = -np.expm1(-elapsed / FAST_TAU)
+        slow_alpha = -np.expm1(-elapsed / SLOW_TAU)
+        delta = x - mean
+        self.mean[slot] = mean + alpha * delta
+        self.var[slot] = np.where(seen, (1 - alpha) * (self.var[slot] + alpha * delta * delta), 0.0)
+        self.slow_mean[slot] = slow_mean + slow_alpha * (x - slow_mean)
+        self.count[slot] = count + 1
+        self.last[slot] = x
+        self.last_ts[slot] = ts
+        self.flat_run[slot] = flat_run
+        self.cusum_pos[slot] = pos
+        self.cusum_neg[slot] = neg
+
+        anomalies = []
+        for kind, flags, scores in (
+            ("spike", spike, np.abs(z)),
+            ("jump", jump, rate),
+            ("flatline", flatline, flat_run),
+            ("drift", drift, drift_score),
+        ):
+            for i in np.flatnonzero(flags):
+                anomalies.append(
+                    Anomaly(self.device_ids[slot[i]], kind, float(x[i]), float(ts[i]), float(scores[i]))
+                )
+        return anomalies
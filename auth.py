@@ -0,0 +1,173 @@
+"""Password checks and registration off the UI thread.
+
+bcrypt is deliberately slow, so logins and registrations run on a small,
+bounded thread pool (bcrypt releases the GIL, so workers hash in
+parallel) with their own database sessions. A successful login issues a
+short-lived session token; a reconnecting dashboard presents the token
+instead of the password and skips bcrypt entirely.
+"""
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+
+from models import get_session, User
+
+load_dotenv()
+
+# bcrypt work factor for new password hashes (each +1 doubles the cost)
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+# bcrypt is CPU bound, more workers than cores only adds queueing
+AUTH_WORKERS = int(os.getenv('AUTH_WORKERS', min(4, os.cpu_count() or 1)))
+# Requests allowed to wait for a worker before new ones are turned away
+AUTH_MAX_PENDING = int(os.getenv('AUTH_MAX_PENDING', 64))
+# Seconds a session token stays valid after its last use
+SESSION_TTL = int(os.getenv('SESSION_TTL', 15 * 60))
+
+
+def hash_password(password, rounds=None):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
+
+
+def check_password(password, password_hash):
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode('utf-8')
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+
+
+_dummy = []
+
+
+def _dummy_hash():
+    if not _dummy:
+        _dummy.append(hash_password(secrets.token_hex(8)))
+    return _dummy[0]
+
+
+class SessionTokens:
+    """Short-lived tokens for users whose password was verified"""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.tokens = {}  # token -> (user_id, expires at)
+        self.lock = threading.Lock()
+
+    def issue(self, user_id):
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self._expire(time.monotonic())
+            self.tokens[token] = (user_id, time.monotonic() + self.ttl)
+        return token
+
+    def verify(self, token):
+        """User id of a valid token, extending its lifetime; None otherwise"""
+        if not token:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry is None or entry[1] <= now:
+                self.tokens.pop(token, None)
+                return None
+            self.tokens[token] = (entry[0], now + self.ttl)
+            return entry[0]
+
+    def revoke(self, token):
+        with self.lock:
+            self.tokens.pop(token, None)
+
+    def _expire(self, now):
+        expired = [token for token, (_, expires) in self.tokens.items() if expires <= now]
+        for token in expired:
+            del self.tokens[token]
+
+
+class AuthResult:
+    __slots__ = ("user_id", "token", "error")
+
+    def __init__(self, user_id=None, token=None, error=None):
+        self.user_id = user_id
+        self.token = token
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class AuthService:
+    def __init__(self, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING, tokens=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.tokens = tokens or SessionTokens()
+
+    def _submit(self, work, on_done, *args):
+        """Run work(*args) on the pool and pass its AuthResult to on_done"""
+        if not self.slots.acquire(blocking=False):
+            on_done(AuthResult(error="Too many sign-ins right now, please try again"))
+            return None
+
+        def run():
+            try:
+                result = work(*args)
+            except Exception as err:
+                print(f"Error during authentication: {err}")
+                result = AuthResult(error="Sign-in failed, please try again")
+            finally:
+                self.slots.release()
+            on_done(result)
+
+        return self.executor.submit(run)
+
+    def login(self, username, password, on_done):
+        return self._submit(self._login, on_done, username, password)
+
+    def register(self, username, password, on_done):
+        return self._submit(self._register, on_done, username, password)
+
+    def _login(self, username, password):
+        session = get_session()
+        try:
+            row = session.query(User.id, User.password_hash).filter_by(username=username).first()
+        finally:
+            session.close()
+        if row is None:
+            # Spend the same time as a real check so unknown usernames do not stand out
+            check_password(password, _dummy_hash())
+            return AuthResult(error="Invalid username or password")
+        if not check_password(password, row.password_hash):
+            return AuthResult(error="Invalid username or password")
+        return AuthResult(row.id, self.tokens.issue(row.id))
+
+    def _register(self, username, password):
+        password_hash = hash_password(password)
+        session = get_session()
+        try:
+            if session.query(User.id).filter_by(username=username).first():
+                return AuthResult(error="Username already exists")
+            user = User(username=username, password_hash=password_hash)
+            session.add(user)
+            session.commit()
+            user_id = user.id
+        except IntegrityError:
+            session.rollback()
+            return AuthResult(error="Username already exists")
+        finally:
+            session.close()
+        return AuthResult(user_id, self.tokens.issue(user_id))
+
+    def resume(self, token):
+        """User id for a still-valid session token, without touching bcrypt"""
+        return self.tokens.verify(token)
+
+    def logout(self, token):
+        self.tokens.revoke(token)
+
+
+# Shared by every dashboard session in the process
+auth_service = AuthService()
@@ -0,0 +1,165 @@
+"""Rule engine evaluated on the stream of incoming readings.
+
+Rules are written as plain sentences, for example
+
+    if Living Room temperature > 26 for 5 min, close curtain
+    if Kitchen humidity >= 70, turn on Kitchen light
+
+and compiled into an index keyed by the source device, so a reading only
+evaluates the rules that reference its device. "for" clauses are kept as
+incremental per-rule state (when the condition became true), and a rule
+fires once each time its condition holds for the required duration.
+"""
+import operator
+import re
+
+from models import AutomationRule
+from scenes import Scene, TYPE_ACTIONS
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+}
+
+# Action verb -> switch state
+VERBS = {
+    "turn on": True,
+    "turn off": False,
+    "open": True,
+    "close": False,
+    "unlock": True,
+    "lock": False,
+    "start": True,
+    "stop": False,
+}
+
+DURATION_UNITS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60, "h": 3600, "hour": 3600}
+
+RULE_RE = re.compile(
+    r"^\s*if\s+(?P<source>.+?)\s*(?P<op>>=|<=|==|>|<)\s*(?P<value>-?\d+(?:\.\d+)?)"
+    r"(?:\s+for\s+(?P<duration>\d+(?:\.\d+)?)\s*(?P<unit>[a-z]+?)s?)?"
+    r"\s*,\s*(?P<verb>" + "|".join(VERBS) + r")\s+(?P<target>.+?)\s*$",
+    re.IGNORECASE,
+)
+
+
+def _resolve_source(text, devices):
+    """Find the device a rule reads from, by name or by '<location> <type>'"""
+    wanted = text.strip().lower()
+    for device in devices:
+        if (device.name or "").lower() == wanted:
+            return device
+    location, _, device_type = wanted.rpartition(" ")
+    for device in devices:
+        if device.type == device_type and (device.location or "").lower() == location:
+            return device
+    raise ValueError(f"Unknown device '{text.strip()}'")
+
+
+def _resolve_target(text, source, devices):
+    """Resolve '<type>' or '<location> <type>' to (location, type)"""
+    wanted = text.strip().lower()
+    location, _, device_type = wanted.rpartition(" ")
+    if device_type.endswith("s") and device_type[:-1] in TYPE_ACTIONS:
+        device_type = device_type[:-1]  # "close curtains"
+    if device_type not in TYPE_ACTIONS:
+        raise ValueError(f"Cannot control '{text.strip()}'")
+    if not location:
+        return source.location, device_type
+    for device in devices:
+        if (device.location or "").lower() == location:
+            return device.location, device_type
+    raise ValueError(f"Unknown location '{location}'")
+
+
+class CompiledRule:
+    __slots__ = ("id", "text", "source_id", "compare", "threshold", "duration",
+                 "action", "true_since", "fired")
+
+    def __init__(self, rule_id, text, source_id, compare, threshold, duration, action):
+        self.id = rule_id
+        self.text = text
+        self.source_id = source_id
+        self.compare = compare
+        self.threshold = threshold
+        self.duration = duration
+        self.action = action
+        # Incremental window state
+        self.true_since = None
+        self.fired = False
+
+
+def compile_rule(text, devices, rule_id=None):
+    """Compile rule text against a user's devices; raises ValueError if invalid"""
+    match = RULE_RE.match(text)
+    if not match:
+        raise ValueError("Rules look like: if <device> > <value> [for <n> min], <action> <device>")
+
+    source = _resolve_source(match["source"], devices)
+    duration = 0.0
+    if match["duration"]:
+        unit = match["unit"].lower()
+        if unit not in DURATION_UNITS:
+            raise ValueError(f"Unknown time unit '{match['unit']}'")
+        duration = float(match["duration"]) * DURATION_UNITS[unit]
+
+    location, device_type = _resolve_target(match["target"], source, devices)
+    action = Scene(text.strip(), device_type, VERBS[match["verb"].lower()], location)
+    return CompiledRule(
+        rule_id,
+        text.strip(),
+        source.id,
+        OPERATORS[match["op"]],
+        float(match["value"]),
+        duration,
+        action,
+    )
+
+
+class AutomationEngine:
+    def __init__(self):
+        self.by_source = {}  # source device id -> list of CompiledRule
+        self.rules = {}      # rule id -> CompiledRule
+
+    def load(self, session, user_id, devices):
+        """Compile every enabled rule stored for a user"""
+        self.by_source.clear()
+        self.rules.clear()
+        for row in session.query(AutomationRule).filter_by(user_id=user_id, enabled=True):
+            try:
+                self.add(compile_rule(row.text, devices, row.id))
+            except ValueError as err:
+                print(f"Skipping automation rule {row.id}: {err}")
+
+    def add(self, rule):
+        self.rules[rule.id] = rule
+        self.by_source.setdefault(rule.source_id, []).append(rule)
+
+    def remove(self, rule_id):
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return
+        rules = self.by_source[rule.source_id]
+        rules.remove(rule)
+        if not rules:
+            del self.by_source[rule.source_id]
+
+    def evaluate(self, device_id, value, timestamp):
+        """Feed a reading to the rules that read this device; return rules that fired"""
+        fired = []
+        now = timestamp.timestamp()
+        for rule in self.by_source.get(device_id, ()):
+            if rule.compare(value, rule.threshold):
+                if rule.true_since is None:
+                    rule.true_since = now
+                if not rule.fired and now - rule.true_since >= rule.duration:
+                    rule.fired = True
+                    fired.append(rule)
+            else:
+                # Condition broken, the rule can fire again next time
+                rule.true_since = None
+                rule.fired = False
+        return fired
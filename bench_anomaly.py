@@ -0,0 +1,80 @@
+"""Benchmark anomaly detection throughput across many devices.
+
+Generates synthetic history, injects stuck, jumping and drifting sensors,
+and feeds it to AnomalyDetector one ingest batch (one timestamp across all
+devices) at a time.
+
+    python bench_anomaly.py --devices 10000 --hours 6
+"""
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from anomaly import AnomalyDetector, KINDS
+from synthetic_data import generate_history
+
+
+def inject_faults(ids, ts, values, device_ids, rng, per_kind):
+    """Corrupt a few devices per fault kind, from the middle of the history on"""
+    faulty = rng.choice(device_ids, size=per_kind * 3, replace=False)
+    stuck, jumping, drifting = np.split(faulty, 3)
+    start = ts.min() + (ts.max() - ts.min()) / 2
+    late = ts >= start
+    minutes = (ts - start) / np.timedelta64(1, "m")
+
+    mask = late & np.isin(ids, stuck)
+    values[mask] = 21.5
+    mask = late & np.isin(ids, jumping)
+    values[mask] += 8.0
+    mask = late & np.isin(ids, drifting)
+    values[mask] += 0.05 * minutes[mask]
+    return {"flatline": set(stuck.tolist()), "jump": set(jumping.tolist()), "drift": set(drifting.tolist())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming anomaly detection")
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--hours", type=int, default=6)
+    parser.add_argument("--interval", type=float, default=1.0, help="Minutes between readings")
+    parser.add_argument("--faults", type=int, default=50, help="Devices corrupted per fault kind")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    device_ids = np.arange(1, args.devices + 1)
+    ids, ts, values = generate_history(device_ids, "temperature", args.hours, args.interval, seed=args.seed)
+    injected = inject_faults(ids, ts, values, device_ids, np.random.default_rng(args.seed), args.faults)
+
+    # One ingest batch per timestamp
+    order = np.argsort(ts, kind="stable")
+    ids, ts, values = ids[order], ts[order], values[order]
+    seconds = (ts - np.datetime64(0, "s")) / np.timedelta64(1, "s")
+    bounds = np.flatnonzero(np.r_[True, ts[1:] != ts[:-1], True])
+
+    detector = AnomalyDetector()
+    for device_id in device_ids.tolist():
+        detector.register(device_id, "temperature")
+    batch_ids = ids.tolist()
+
+    found = Counter()
+    flagged = {kind: set() for kind in KINDS}
+    started = time.perf_counter()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        for anomaly in detector.process_batch(batch_ids[start:end], seconds[start:end], values[start:end]):
+            found[anomaly.kind] += 1
+            flagged[anomaly.kind].add(anomaly.device_id)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(values):,} readings from {args.devices:,} devices in {len(bounds) - 1} batches")
+    print(f"{elapsed:.2f}s, {len(values) / elapsed:,.0f} readings/s, {sum(found.values()):,} detections")
+    for kind in KINDS:
+        line = f"  {kind:<9} {found[kind]:>7,} detections on {len(flagged[kind]):,} devices"
+        if kind in injected:
+            caught = len(flagged[kind] & injected[kind])
+            line += f", caught {caught}/{len(injected[kind])} injected"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
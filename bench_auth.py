@@ -0,0 +1,82 @@
+"""Benchmark login throughput of the auth pool.
+
+Creates users in a scratch database, fires a burst of concurrent logins
+(as at a shift change) for several pool sizes, and compares with resuming
+sessions from tokens, which skips bcrypt.
+
+    python bench_auth.py --users 50 --logins 200 --rounds 10
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+
+def run_burst(service, users, logins):
+    """Submit `logins` logins at once; return (elapsed, latencies, tokens)"""
+    latencies = []
+    tokens = []
+    lock = threading.Lock()
+    done = threading.Event()
+    remaining = [logins]
+
+    def on_done(started, result):
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            if result.ok:
+                tokens.append(result.token)
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    started = time.perf_counter()
+    for i in range(logins):
+        username, password = users[i % len(users)]
+        submitted = time.perf_counter()
+        service.login(username, password, lambda result, t=submitted: on_done(t, result))
+    done.wait()
+    return time.perf_counter() - started, latencies, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login throughput")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt work factor for the test users")
+    parser.add_argument("--workers", default="1,2,4,8", help="Pool sizes to compare")
+    args = parser.parse_args()
+
+    # Work in a scratch directory so smart_home.db is never touched
+    os.chdir(tempfile.mkdtemp(prefix="bench_auth_"))
+    from auth import AuthService, hash_password
+    from models import get_session, User
+
+    session = get_session()
+    users = [(f"bench{i}", f"secret{i}") for i in range(args.users)]
+    session.add_all(User(username=u, password_hash=hash_password(p, args.rounds)) for u, p in users)
+    session.commit()
+    session.close()
+
+    print(f"{args.logins} logins across {args.users} users, bcrypt rounds {args.rounds}")
+    tokens = []
+    for workers in (int(w) for w in args.workers.split(",")):
+        service = AuthService(workers=workers, max_pending=args.logins)
+        elapsed, latencies, tokens = run_burst(service, users, args.logins)
+        latencies.sort()
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(
+            f"  {workers:>2} workers: {args.logins / elapsed:7.1f} logins/s, "
+            f"median {statistics.median(latencies) * 1000:6.0f} ms, p95 {p95 * 1000:6.0f} ms"
+        )
+        service.executor.shutdown()
+
+    started = time.perf_counter()
+    resumed = sum(service.resume(token) is not None for token in tokens)
+    elapsed = time.perf_counter() - started
+    print(f"  token resume: {resumed / elapsed:,.0f} sessions/s ({resumed} tokens)")
+
+
+if __name__ == "__main__":
+    main()
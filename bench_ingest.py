@@ -0,0 +1,100 @@
+"""Benchmark the MQTT -> database -> hub ingest path per message.
+
+Builds a scratch database with a few hundred sensors, then pushes spooled
+records through MQTTClient.store_batch with the ingest hub as callback,
+exactly as the spool committer does. Reports throughput, transient
+memory per message (tracemalloc peak over a batch), memory retained
+afterwards, and how many ORM instances were loaded along the way.
+
+    python bench_ingest.py --devices 200 --messages 20000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-message cost of ingest")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    # Work in a scratch directory so smart_home.db is never touched
+    os.chdir(tempfile.mkdtemp(prefix="bench_ingest_"))
+    from sqlalchemy import event
+    from migrations import migrate
+    from models import get_session, Base, Device, SensorThreshold, User
+    from ingest_hub import hub
+    from mqtt_client import MQTTClient
+
+    session = get_session()
+    user = User(username="bench", password_hash="-")
+    session.add(user)
+    session.flush()
+    topics = []
+    for i in range(args.devices):
+        kind = "temperature" if i % 2 else "humidity"
+        topic = f"home/room{i}/{kind}"
+        session.add(Device(name=f"Sensor {i}", type=kind, mqtt_topic=topic, location=f"Room {i}",
+                           user_id=user.id, unit="C" if kind == "temperature" else "%"))
+        topics.append(topic)
+    session.flush()
+    # Alert thresholds on every other device
+    for device in session.query(Device).filter(Device.id % 2 == 0):
+        session.add(SensorThreshold(device_id=device.id, min_value=0, max_value=100, alert_enabled=True))
+    session.commit()
+    session.close()
+    migrate(background=False)
+
+    loads = [0]
+    event.listen(Base, "load", lambda target, context: loads.__setitem__(0, loads[0] + 1), propagate=True)
+
+    hub.start(connect=False)
+    client = MQTTClient(callback=hub.ingest)
+    start = datetime.now() - timedelta(seconds=args.messages)
+    records = []
+    for seq in range(1, args.messages + 1):
+        timestamp = start + timedelta(seconds=seq)
+        payload = json.dumps({"value": f"{20 + seq % 7}.5", "status": "Online", "timestamp": timestamp.isoformat()})
+        records.append((seq, timestamp.timestamp(), topics[seq % len(topics)], payload.encode()))
+    batches = [records[i:i + args.batch] for i in range(0, len(records), args.batch)]
+
+    # Warm up caches, statement compilation and the anomaly detector
+    client.store_batch(batches[0])
+    loads[0] = 0
+
+    # Time the first half without tracemalloc, which slows allocation down
+    half = 1 + (len(batches) - 1) // 2
+    timed = sum(len(b) for b in batches[1:half])
+    started = time.perf_counter()
+    for batch in batches[1:half]:
+        client.store_batch(batch)
+    elapsed = time.perf_counter() - started
+
+    traced = sum(len(b) for b in batches[half:])
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    peaks = []
+    for batch in batches[half:]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        client.store_batch(batch)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    print(f"{len(records)} messages in batches of {args.batch}, {args.devices} devices")
+    print(f"  throughput:          {timed / elapsed:9,.0f} messages/s")
+    print(f"  transient per msg:   {sum(peaks) / traced:9,.0f} bytes (peak over a batch / batch size)")
+    print(f"  retained per msg:    {retained / traced:9,.0f} bytes")
+    print(f"  ORM loads per msg:   {loads[0] / (timed + traced):9.2f}")
+    client.commands.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark the cost of recording metrics on the hot path.
+
+Times counter increments, histogram observations and timer blocks against
+an empty loop, and checks histogram quantiles against exact percentiles
+of the same samples.
+
+    python bench_metrics.py --ops 1000000
+"""
+import argparse
+import random
+import time
+
+import metrics
+
+
+def per_op(fn, ops):
+    started = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - started) / ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure metrics recording overhead")
+    parser.add_argument("--ops", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    counter = registry.counter("bench_ops")
+    histogram = registry.histogram("bench_seconds")
+
+    baseline = per_op(lambda: None, args.ops)
+    costs = {
+        "counter.inc()": per_op(counter.inc, args.ops),
+        "histogram.observe()": per_op(lambda: histogram.observe(0.0123), args.ops),
+    }
+
+    def timed():
+        with histogram.time():
+            pass
+
+    costs["with histogram.time()"] = per_op(timed, args.ops)
+    print(f"{args.ops:,} operations each, net of an empty call ({baseline * 1e9:.0f} ns)")
+    for name, cost in costs.items():
+        print(f"  {name:<24} {(cost - baseline) * 1e9:6.0f} ns")
+
+    # Log-normal latencies, like request times
+    samples = [random.lognormvariate(-6, 1.5) for _ in range(200_000)]
+    accuracy = registry.histogram("bench_accuracy")
+    for value in samples:
+        accuracy.observe(value)
+    samples.sort()
+    print("quantile accuracy (exact vs histogram):")
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = samples[int(q * (len(samples) - 1))]
+        approx = accuracy.quantile(q)
+        print(f"  p{q * 100:g}: {exact * 1000:8.3f} ms  {approx * 1000:8.3f} ms  ({(approx - exact) / exact:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Startup benchmark: how long until the login screen can be shown.
+
+Measures, in fresh interpreters, the `python -X importtime` cost of
+importing main and the wall time to import it and build the login views,
+and fails when either exceeds its budget or when a module that is only
+needed by the dashboard gets imported on the way.
+
+Most of the startup time is Flet and SQLAlchemy, which the login screen
+cannot do without and whose cost varies several-fold between machines.
+The budgets are for what the app adds on top: FLOOR_MODULES are imported
+first in the same interpreter and only the time after them is counted.
+
+    python bench_startup.py
+    python bench_startup.py --runs 10 --import-budget 75
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Budgets for reaching the login screen, in milliseconds after FLOOR_MODULES are loaded
+IMPORT_BUDGET_MS = 100
+LOGIN_BUDGET_MS = 150
+
+# Needed by the login screen whatever the app does
+FLOOR_MODULES = ("flet", "sqlalchemy", "sqlalchemy.orm")
+
+# Must not be imported before the user logs in
+DEFERRED_MODULES = ("numpy", "matplotlib", "reading_cache", "anomaly", "synthetic_data", "ingest_hub",
+                    "comparison", "duckdb")
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+LOGIN_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import {floor}
+floor = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.SmartHomeApp()
+app.setup_auth_views()
+done = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+print(f"{{(floor - started) * 1000:.1f}}|{{(imported - floor) * 1000:.1f}}|{{(done - floor) * 1000:.1f}}|{{','.join(loaded)}}")
+"""
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run(args, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    return subprocess.run(
+        [sys.executable, *args], cwd=workdir, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def import_profile(workdir):
+    """(total ms for main, [(cumulative ms, module)] of main's direct imports)"""
+    result = run(["-X", "importtime", "-c", "import main"], workdir)
+    total = 0.0
+    children = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        if len(indent) == 1:
+            # A top-level import; its children were printed just before it
+            if module == "main":
+                total = int(cumulative) / 1000
+                break
+            children = []
+        elif len(indent) == 3:
+            children.append((int(cumulative) / 1000, module))
+    return total, sorted(children, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to the login screen")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--login-budget", type=float, default=LOGIN_BUDGET_MS)
+    args = parser.parse_args()
+
+    # A scratch directory, so the benchmark never touches smart_home.db
+    with tempfile.TemporaryDirectory() as workdir:
+        script = LOGIN_SCRIPT.format(floor=", ".join(FLOOR_MODULES), deferred=DEFERRED_MODULES)
+        totals = []
+        floors = []
+        imports = []
+        logins = []
+        loaded = set()
+        for _ in range(args.runs):
+            total, children = import_profile(workdir)
+            totals.append(total)
+            floor, imported, login, modules = run(["-c", script], workdir).stdout.strip().split("|")
+            floors.append(float(floor))
+            imports.append(float(imported))
+            logins.append(float(login))
+            loaded.update(filter(None, modules.split(",")))
+
+    import_ms = statistics.median(imports)
+    login_ms = statistics.median(logins)
+    print(f"import main:   {statistics.median(totals):7.1f} ms in total (-X importtime)")
+    print(f"  {', '.join(FLOOR_MODULES)}: {statistics.median(floors):7.1f} ms")
+    print(f"  main on top: {import_ms:7.1f} ms (budget {args.import_budget:.0f} ms)")
+    print(f"login screen:  {login_ms:7.1f} ms on top (budget {args.login_budget:.0f} ms)")
+    print("slowest imports of main:")
+    for cumulative, module in children[:8]:
+        print(f"  {cumulative:7.1f} ms  {module}")
+
+    failures = []
+    if import_ms > args.import_budget:
+        failures.append("import time over budget")
+    if login_ms > args.login_budget:
+        failures.append("login screen over budget")
+    if loaded:
+        failures.append(f"imported before login: {', '.join(sorted(loaded))}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
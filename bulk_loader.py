@@ -0,0 +1,239 @@
+"""Bulk import/backfill tool for sensor readings.
+
+Usage:
+    python bulk_loader.py readings.csv
+    python bulk_loader.py readings.ndjson
+    python bulk_loader.py --synthetic --hours 720 --device-ids 1-2000
+
+CSV files need a header with device_id, value and timestamp columns; NDJSON
+files need the same keys on every line. Timestamps are ISO 8601.
+"""
+import argparse
+import csv
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+
+from aggregates import rebuild
+from models import get_engine, get_session, Device, SensorReading
+from reading_cache import reading_cache
+import storage
+
+# Rows handed to a single executemany call
+BATCH_SIZE = 50_000
+# Rows written between commits
+COMMIT_EVERY = 1_000_000
+
+# Pragmas relaxed for the duration of a load. Durability is traded for speed:
+# a crash mid-load can lose the load, never the rows committed before it.
+# journal_mode is left alone on a WAL database: leaving WAL needs exclusive
+# access, so it would fail while the app has the database open.
+FAST_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",  # 256 MB
+}
+
+# Matches the storage format SQLAlchemy uses for DateTime columns on SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def format_timestamp(ts):
+    """Render a timestamp the way SQLAlchemy stores it in SQLite
+
+    Stored timestamps are naive local times; aware input is converted to
+    local time first, like readings arriving over MQTT.
+    """
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts.strftime(TIMESTAMP_FORMAT)
+
+
+def read_csv(path):
+    """Yield (device_id, value, timestamp) rows from a CSV file"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield int(row["device_id"]), float(row["value"]), format_timestamp(row["timestamp"])
+
+
+def read_ndjson(path):
+    """Yield (device_id, value, timestamp) rows from a newline-delimited JSON file"""
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield int(row["device_id"]), float(row["value"]), format_timestamp(row["timestamp"])
+
+
+def rows_from_arrays(device_ids, timestamps, values):
+    """Yield rows from parallel NumPy arrays, rendering timestamps vectorized"""
+    import numpy as np
+
+    rendered = np.char.replace(np.datetime_as_string(timestamps, unit="us"), "T", " ")
+    return zip(device_ids.tolist(), values.tolist(), rendered.tolist())
+
+
+def synthetic_rows(device_ids, hours=48, device_types=None, seed=None):
+    """Yield generated history for each device, one device chunk at a time"""
+    from synthetic_data import iter_history
+
+    for chunk in iter_history(device_ids, device_types, hours, seed=seed):
+        yield from rows_from_arrays(*chunk)
+
+
+class BulkLoader:
+    def __init__(self, engine=None, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY):
+        self.engine = engine or get_engine()
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        # INSERT of the three data columns, executed with executemany; rows
+        # already stored for the same device and timestamp are skipped, so a
+        # file can be loaded again safely
+        self.insert_sql = str(
+            SensorReading.__table__.insert().prefix_with("OR IGNORE").compile(
+                dialect=self.engine.dialect,
+                column_keys=["device_id", "value", "timestamp"],
+            )
+        )
+
+    @contextmanager
+    def relaxed_pragmas(self, conn):
+        """Temporarily relax durability pragmas on a connection"""
+        saved = {}
+        for name, value in FAST_PRAGMAS.items():
+            current = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            if name == "journal_mode" and str(current).lower() == "wal":
+                continue
+            saved[name] = current
+            conn.exec_driver_sql(f"PRAGMA {name} = {value}")
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.rollback()
+            for name, value in saved.items():
+                conn.exec_driver_sql(f"PRAGMA {name} = {value}")
+            conn.commit()
+
+    def load(self, rows):
+        """Insert (device_id, value, timestamp) rows and return (count, seconds)
+
+        Timestamps must already be rendered with format_timestamp. The
+        hourly location rollups of the hours loaded into are rebuilt
+        afterwards.
+        """
+        rows = iter(rows)
+        loaded = 0
+        since_commit = 0
+        first = last = None  # timestamp range of the rows, as rendered
+        started = time.perf_counter()
+
+        with self.engine.connect() as conn:
+            with self.relaxed_pragmas(conn):
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    conn.exec_driver_sql(self.insert_sql, batch)
+                    loaded += len(batch)
+                    since_commit += len(batch)
+                    low = min(row[2] for row in batch)
+                    high = max(row[2] for row in batch)
+                    first = low if first is None else min(first, low)
+                    last = high if last is None else max(last, high)
+                    if since_commit >= self.commit_every:
+                        conn.commit()
+                        since_commit = 0
+                        logging.info(f"Committed {loaded} rows")
+                conn.commit()
+
+            if first is not None:
+                first, last = datetime.fromisoformat(first), datetime.fromisoformat(last)
+                since = first.replace(minute=0, second=0, microsecond=0)
+                until = last.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+                built = rebuild(conn, since, until)
+                conn.commit()
+                logging.info(f"Rebuilt {built} hourly location rollups")
+                # Analytics exports of the days the rows went into are redone
+                storage.written(first, last)
+
+        # Cached windows in this process no longer reflect the table
+        reading_cache.invalidate()
+
+        elapsed = time.perf_counter() - started
+        rate = loaded / elapsed if elapsed > 0 else 0
+        logging.info(f"Loaded {loaded} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+        return loaded, elapsed
+
+    def load_arrays(self, device_ids, timestamps, values):
+        """Insert readings held in parallel arrays, e.g. from synthetic_data"""
+        return self.load(rows_from_arrays(device_ids, timestamps, values))
+
+
+def parse_device_ids(spec):
+    """Parse a device id list such as "1,2,10-20" """
+    ids = []
+    for part in spec.split(","):
+        if "-" in part:
+            start, end = part.split("-", 1)
+            ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            ids.append(int(part))
+    return ids
+
+
+def device_types(device_ids=None):
+    """Map device id to type for the given ids, or for every sensor"""
+    session = get_session()
+    try:
+        query = session.query(Device.id, Device.type)
+        if device_ids is None:
+            query = query.filter(Device.type.in_(["temperature", "humidity"]))
+        else:
+            query = query.filter(Device.id.in_(device_ids))
+        return dict(query.order_by(Device.id).all())
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load sensor readings")
+    parser.add_argument("path", nargs="?", help="CSV or NDJSON file to import")
+    parser.add_argument("--synthetic", action="store_true", help="Load generated history instead of a file")
+    parser.add_argument("--hours", type=int, default=48, help="Hours of synthetic history per device")
+    parser.add_argument("--device-ids", help="Devices for synthetic history, e.g. 1-2000 (default: all sensors)")
+    parser.add_argument("--seed", type=int, help="Seed for reproducible synthetic history")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        if args.device_ids:
+            device_ids = parse_device_ids(args.device_ids)
+            known_types = device_types(device_ids)
+        else:
+            known_types = device_types()
+            device_ids = list(known_types)
+        types = [known_types.get(device_id, "temperature") for device_id in device_ids]
+        rows = synthetic_rows(device_ids, args.hours, types, args.seed)
+    elif args.path and args.path.endswith((".ndjson", ".jsonl")):
+        rows = read_ndjson(args.path)
+    elif args.path:
+        rows = read_csv(args.path)
+    else:
+        parser.error("either a file path or --synthetic is required")
+
+    loaded, elapsed = BulkLoader(batch_size=args.batch_size).load(rows)
+    rate = loaded / elapsed if elapsed > 0 else 0
+    print(f"Loaded {loaded} readings in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,224 @@
+"""Routing, acknowledgement and retry of device control commands.
+
+Commands are published to `<device mqtt_topic>/control` with a command id.
+A command stays pending until the device publishes a state on its topic
+that echoes the command id (or reports the expected value), and is
+re-published with backoff when no confirmation arrives in time.
+"""
+import heapq
+import threading
+import time
+import uuid
+from collections import deque
+
+# Seconds to wait for a device to confirm a command before re-sending it
+COMMAND_TIMEOUT = 2.0
+MAX_RETRIES = 3
+# Round-trip samples kept for latency percentiles
+LATENCY_SAMPLES = 1000
+
+# Command sent for the (on, off) switch positions of each device type
+COMMANDS = {
+    "light": ("ON", "OFF"),
+    "curtain": ("OPEN", "CLOSE"),
+    "door": ("UNLOCK", "LOCK"),
+    "camera": ("START", "STOP"),
+}
+
+# Value a device reports once a command has taken effect
+EXPECTED_VALUES = {
+    "ON": "ON",
+    "OFF": "OFF",
+    "OPEN": "100",
+    "CLOSE": "0",
+    "UNLOCK": "UNLOCKED",
+    "LOCK": "LOCKED",
+    "START": "Active",
+    "STOP": "Off",
+}
+
+
+def command_for(device_type, state):
+    """Command that puts a device of the given type into the given switch state"""
+    commands = COMMANDS.get(device_type)
+    if commands is None:
+        return None
+    return commands[0] if state else commands[1]
+
+
+def control_topic(device):
+    if not device.mqtt_topic:
+        raise ValueError(f"{device.name} has no MQTT topic")
+    return f"{device.mqtt_topic}/control"
+
+
+class PendingCommand:
+    __slots__ = ("id", "device_id", "topic", "state_topic", "message", "expected",
+                 "sent_at", "attempts", "on_done")
+
+    def __init__(self, device, command, state, on_done):
+        self.id = uuid.uuid4().hex[:12]
+        self.device_id = device.id
+        self.state_topic = device.mqtt_topic
+        self.topic = control_topic(device)
+        self.message = {
+            "command": command,
+            "state": "ON" if state else "OFF",
+            "command_id": self.id,
+        }
+        self.expected = EXPECTED_VALUES.get(command)
+        self.sent_at = None
+        self.attempts = 0
+        self.on_done = on_done
+
+
+class CommandDispatcher:
+    def __init__(self, publish, timeout=COMMAND_TIMEOUT, max_retries=MAX_RETRIES):
+        # publish(topic, message_dict)
+        self.publish = publish
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.pending = {}        # command id -> PendingCommand
+        self.by_topic = {}       # device state topic -> pending command id
+        self.deadlines = []      # heap of (deadline, command id, attempt)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._watch_timeouts, daemon=True)
+        self.thread.start()
+
+    def send(self, device, state, on_done=None):
+        """Send a switch command to one device and return its command id
+
+        on_done(command_id, confirmed) is called once the device confirms the
+        command or it has run out of retries. A command replaced by a newer
+        one for the same device is dropped without a callback.
+        """
+        return self.send_batch([(device, state)], on_done)[0]
+
+    def send_batch(self, changes, on_done=None):
+        """Send switch commands for many (device, state) pairs at once"""
+        commands = []
+        with self.cond:
+            for device, state in changes:
+                command = command_for(device.type, state)
+                if command is None:
+                    commands.append(None)
+                    continue
+                pending = PendingCommand(device, command, state, on_done)
+                # A newer command for the same device replaces the pending one
+                self.pending.pop(self.by_topic.get(pending.state_topic), None)
+                self.pending[pending.id] = pending
+                self.by_topic[pending.state_topic] = pending.id
+                commands.append(pending)
+            for pending in commands:
+                if pending is not None:
+                    self._arm(pending)
+            self.cond.notify()
+
+        for pending in commands:
+            if pending is not None:
+                self.publish(pending.topic, pending.message)
+        return [pending.id if pending else None for pending in commands]
+
+    def _arm(self, pending):
+        """Record a (re)send and schedule its timeout; caller holds the lock"""
+        now = time.monotonic()
+        if pending.sent_at is None:
+            pending.sent_at = now
+            self.sent += 1
+        else:
+            self.retried += 1
+        pending.attempts += 1
+        # Back off exponentially between retries
+        deadline = now + self.timeout * (2 ** (pending.attempts - 1))
+        heapq.heappush(self.deadlines, (deadline, pending.id, pending.attempts))
+
+    def handle_state(self, topic, payload):
+        """Match a device state publish against pending commands
+
+        Returns True when it confirmed a command.
+        """
+        with self.cond:
+            command_id = self.by_topic.get(topic)
+            pending = self.pending.get(command_id)
+            if pending is None:
+                return False
+            echoed = payload.get("command_id")
+            if echoed is not None:
+                if echoed != pending.id:
+                    return False
+            elif pending.expected is None or str(payload.get("value")) != pending.expected:
+                return False
+            del self.pending[pending.id]
+            del self.by_topic[topic]
+            self.acked += 1
+            self.latencies.append(time.monotonic() - pending.sent_at)
+
+        if pending.on_done:
+            pending.on_done(pending.id, True)
+        return True
+
+    def _watch_timeouts(self):
+        while True:
+            retries = []
+            failures = []
+            with self.cond:
+                while not self.stopped and not self._due():
+                    wait = self.deadlines[0][0] - time.monotonic() if self.deadlines else None
+                    self.cond.wait(wait)
+                if self.stopped:
+                    return
+
+                now = time.monotonic()
+                while self.deadlines and self.deadlines[0][0] <= now:
+                    _, command_id, attempt = heapq.heappop(self.deadlines)
+                    pending = self.pending.get(command_id)
+                    if pending is None or pending.attempts != attempt:
+                        continue  # Already confirmed, superseded or re-sent
+                    if pending.attempts > self.max_retries:
+                        del self.pending[command_id]
+                        if self.by_topic.get(pending.state_topic) == command_id:
+                            del self.by_topic[pending.state_topic]
+                        self.failed += 1
+                        failures.append(pending)
+                    else:
+                        self._arm(pending)
+                        retries.append(pending)
+
+            for pending in retries:
+                self.publish(pending.topic, pending.message)
+            for pending in failures:
+                print(f"Command {pending.message['command']} to {pending.topic} was not confirmed")
+                if pending.on_done:
+                    pending.on_done(pending.id, False)
+
+    def _due(self):
+        return bool(self.deadlines) and self.deadlines[0][0] <= time.monotonic()
+
+    def stats(self):
+        """Counters and round-trip latency percentiles in milliseconds"""
+        with self.cond:
+            samples = sorted(self.latencies)
+            stats = {
+                "sent": self.sent,
+                "acked": self.acked,
+                "retried": self.retried,
+                "failed": self.failed,
+                "pending": len(self.pending),
+            }
+        for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            stats[name] = samples[min(len(samples) - 1, int(q * len(samples)))] * 1000 if samples else None
+        stats["max_ms"] = samples[-1] * 1000 if samples else None
+        return stats
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
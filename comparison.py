@@ -0,0 +1,224 @@
+"""Comparison charts: several sensors overlaid on one time axis.
+
+All selected devices are fetched with a single grouped range query that
+averages their readings into GRID_POINTS equal buckets in the database, so
+the rows returned are bounded by devices x buckets however dense the
+history is. The bucket means land in one (devices x buckets) NumPy matrix,
+interior gaps are filled by linear interpolation across the whole matrix
+at once, and every series of a sensor type is drawn in one LineChart.
+Overlaying ten rooms costs about as much as drawing a single chart.
+"""
+from datetime import datetime, timedelta
+
+import flet as ft
+import numpy as np
+
+import metrics
+from sensor_data import get_bucket_stats
+
+# Points per series on the common time grid
+GRID_POINTS = 120
+# Series drawn when the view opens; the rest can be ticked in the legend
+MAX_SERIES = 8
+COMPARE_WINDOWS = {"1h": 1, "24h": 24, "7d": 168}
+DEFAULT_WINDOW = "24h"
+SERIES_COLORS = (
+    ft.colors.BLUE_400, ft.colors.ORANGE_400, ft.colors.GREEN_400, ft.colors.RED_400,
+    ft.colors.PURPLE_400, ft.colors.TEAL_400, ft.colors.PINK_400, ft.colors.BROWN_400,
+)
+UNITS = {"temperature": "°C", "humidity": "%"}
+
+compare_seconds = metrics.histogram("comparison_chart_seconds", "Time to query and draw a comparison view")
+
+
+def fill_gaps(matrix):
+    """Linearly interpolate the interior NaN runs of every row at once
+
+    Leading and trailing NaNs stay NaN: a series is never extended past
+    its first or last reading.
+    """
+    points = matrix.shape[1]
+    valid = ~np.isnan(matrix)
+    columns = np.arange(points)
+    # Nearest valid column at or before / at or after each cell
+    before = np.maximum.accumulate(np.where(valid, columns, -1), axis=1)
+    after = np.minimum.accumulate(np.where(valid, columns, points)[:, ::-1], axis=1)[:, ::-1]
+    rows, cols = np.nonzero(~valid & (before >= 0) & (after < points))
+    left, right = before[rows, cols], after[rows, cols]
+    filled = matrix.copy()
+    filled[rows, cols] = matrix[rows, left] + (cols - left) / (right - left) * (matrix[rows, right] - matrix[rows, left])
+    return filled
+
+
+def load_grid(session, device_ids, hours, points=GRID_POINTS, now=None):
+    """Readings of several devices resampled onto a common grid
+
+    Returns (bucket midpoints as datetime64[us], len(device_ids) x points
+    matrix of bucket means with gaps filled). Runs one query for all devices;
+    long windows over many devices go to the analytics engine if enabled.
+    """
+    now = now or datetime.now()
+    since = now - timedelta(hours=hours)
+    step = hours * 3600 / points
+    rows = get_bucket_stats(session, device_ids, since, step, since)
+
+    matrix = np.full((len(device_ids), points), np.nan)
+    if rows:
+        index = {device_id: i for i, device_id in enumerate(device_ids)}
+        ids, buckets, _, means = zip(*(row[:4] for row in rows))
+        row_index = np.fromiter((index[i] for i in ids), dtype=np.intp, count=len(rows))
+        # Readings stamped slightly ahead of now (device clock skew) go in the last bucket
+        matrix[row_index, np.minimum(buckets, points - 1)] = means
+    grid = np.datetime64(since, "us") + ((np.arange(points) + 0.5) * step * 1_000_000).astype("timedelta64[us]")
+    return grid, fill_gaps(matrix)
+
+
+class ComparisonView:
+    """Overlay of several sensors, one chart per sensor type"""
+
+    def __init__(self, page: ft.Page, session, devices, on_back, title="Compare Sensors"):
+        self.page = page
+        self.session = session
+        self.devices = [d for d in devices if d.type in UNITS]
+        self.on_back = on_back
+        self.title = title
+        self.grid = None
+        self.matrix = None
+        self.colors = {d.id: SERIES_COLORS[i % len(SERIES_COLORS)] for i, d in enumerate(self.devices)}
+        self.selected = {d.id for d in self.devices[:MAX_SERIES]}
+
+    def build(self):
+        self.window_dropdown = ft.Dropdown(
+            label="Window",
+            value=DEFAULT_WINDOW,
+            options=[ft.dropdown.Option(name) for name in COMPARE_WINDOWS],
+            width=120,
+            on_change=lambda _: self.reload(),
+        )
+        legend = ft.Row(
+            controls=[
+                ft.Checkbox(
+                    label=f"{d.name} ({d.location})" if d.location else d.name,
+                    value=d.id in self.selected,
+                    fill_color=self.colors[d.id],
+                    on_change=lambda e, device_id=d.id: self.toggle(device_id, e.control.value),
+                )
+                for d in self.devices
+            ],
+            wrap=True,
+        )
+        self.charts = ft.Column(spacing=20)
+        self.load()
+        return ft.Container(
+            content=ft.Column(
+                controls=[
+                    ft.Row(
+                        controls=[
+                            ft.IconButton(icon=ft.icons.ARROW_BACK, on_click=self.on_back),
+                            ft.Text(self.title, size=20, weight=ft.FontWeight.BOLD, expand=True),
+                            self.window_dropdown,
+                        ]
+                    ),
+                    legend,
+                    self.charts,
+                ],
+                scroll=ft.ScrollMode.AUTO,
+                spacing=20,
+                expand=True,
+            ),
+            padding=20,
+            expand=True,
+        )
+
+    def load(self):
+        """Query every device's window and redraw the charts"""
+        with compare_seconds.time():
+            hours = COMPARE_WINDOWS[self.window_dropdown.value]
+            self.grid, self.matrix = load_grid(self.session, [d.id for d in self.devices], hours)
+            self.charts.controls = self.create_charts()
+
+    def reload(self):
+        self.load()
+        self.page.update()
+
+    def toggle(self, device_id, shown):
+        """Show or hide a series; redrawn from the loaded grid, without a query"""
+        if shown:
+            self.selected.add(device_id)
+        else:
+            self.selected.discard(device_id)
+        self.charts.controls = self.create_charts()
+        self.charts.update()
+
+    def create_charts(self):
+        charts = []
+        for device_type, unit in UNITS.items():
+            rows = [i for i, d in enumerate(self.devices) if d.type == device_type and d.id in self.selected]
+            if rows:
+                charts.append(self.create_chart(device_type, unit, rows))
+        if not charts:
+            charts.append(ft.Text("Select sensors to compare", color=ft.colors.GREY_400))
+        return charts
+
+    def create_chart(self, device_type, unit, rows):
+        values = self.matrix[rows]
+        title = ft.Text(f"{device_type.capitalize()} ({unit})", size=16, weight=ft.FontWeight.BOLD)
+        if np.isnan(values).all():
+            return ft.Column(controls=[title, ft.Text("No data in this window", color=ft.colors.GREY_400)])
+
+        series = []
+        for row, device_values in zip(rows, values):
+            x = np.flatnonzero(~np.isnan(device_values))
+            series.append(ft.LineChartData(
+                data_points=[
+                    ft.LineChartDataPoint(int(i), round(float(y), 2))
+                    for i, y in zip(x, device_values[x])
+                ],
+                stroke_width=2,
+                color=self.colors[self.devices[row].id],
+                curved=True,
+                stroke_cap_round=True,
+            ))
+
+        min_y, max_y = float(np.nanmin(values)), float(np.nanmax(values))
+        if max_y == min_y:
+            min_y, max_y = min_y - 1, max_y + 1
+        hours = COMPARE_WINDOWS[self.window_dropdown.value]
+        time_format = "%H:%M" if hours <= 24 else "%a %H:%M"
+        label_every = len(self.grid) // 6
+        return ft.Column(
+            controls=[
+                title,
+                ft.Container(
+                    content=ft.LineChart(
+                        data_series=series,
+                        border=ft.border.all(1, ft.colors.GREY_400),
+                        horizontal_grid_lines=ft.ChartGridLines(color=ft.colors.GREY_200, width=1),
+                        left_axis=ft.ChartAxis(
+                            labels_size=40,
+                            labels=[
+                                ft.ChartAxisLabel(value=y, label=ft.Text(f"{y:.1f}"))
+                                for y in np.linspace(min_y, max_y, 6).tolist()
+                            ],
+                        ),
+                        bottom_axis=ft.ChartAxis(
+                            labels_size=40,
+                            labels=[
+                                ft.ChartAxisLabel(
+                                    value=i,
+                                    label=ft.Text(self.grid[i].astype(datetime).strftime(time_format)),
+                                )
+                                for i in range(0, len(self.grid), label_every)
+                            ],
+                        ),
+                        min_x=0,
+                        max_x=len(self.grid) - 1,
+                        min_y=min_y,
+                        max_y=max_y,
+                        expand=True,
+                        tooltip_bgcolor=ft.colors.with_opacity(0.8, ft.colors.BLUE_GREY_100),
+                    ),
+                    height=320,
+                ),
+            ]
+        )
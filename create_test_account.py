@@ -1,4 +1,4 @@
-import bcrypt
+from auth import hash_password
 from models import get_session, User, Device
 from datetime import datetime
 
@@ -13,7 +13,7 @@ def create_test_account():
     
     # Create test user
     password = "test123"
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    password_hash = hash_password(password)
     
     test_user = User(
         username="test",
@@ -0,0 +1,310 @@
+"""Lazily built, cached dashboard grid of device cards grouped by location.
+
+Cards are built in batches as the user scrolls towards the end of the
+grid instead of all at once, the built control tree is kept across
+navigation, and refresh() only rebuilds the cards of devices whose
+displayed attributes changed.
+"""
+import bisect
+
+import flet as ft
+from sqlalchemy import func
+
+from aggregates import aggregates
+from models import Device, SensorReading
+from rolling_stats import device_stats
+from search_index import DeviceSearchIndex
+
+# Cards built per batch
+CARDS_PER_BATCH = 60
+# Build the next batch once the scroll position is this close (px) to the end
+LOAD_AHEAD_PIXELS = 800
+
+SENSOR_TYPES = ("temperature", "humidity")
+
+
+def latest_readings(session, device_ids):
+    """Map device id to its most recent reading value with a single query"""
+    if not device_ids:
+        return {}
+    # SQLite returns the bare value column from the row holding MAX(timestamp)
+    rows = (
+        session.query(SensorReading.device_id, SensorReading.value, func.max(SensorReading.timestamp))
+        .filter(SensorReading.device_id.in_(device_ids))
+        .group_by(SensorReading.device_id)
+        .all()
+    )
+    return {device_id: value for device_id, value, _ in rows}
+
+
+def card_signature(device):
+    """Attributes shown on a card or searched; a card is rebuilt and re-indexed only when these change"""
+    return (device.name, device.type, device.location, device.unit, device.state, device.is_online,
+            device.mqtt_topic)
+
+
+def section_key(location):
+    """Devices without a location share one section with those whose location is empty"""
+    return location or ""
+
+
+class DeviceGrid:
+    def __init__(self, session, user_id, card_factory, section_menu=None):
+        self.session = session
+        self.user_id = user_id
+        # card_factory(device, latest_readings) -> card control
+        self.card_factory = card_factory
+        # section_menu(location, device_types) -> control shown in the location header, or None
+        self.section_menu = section_menu
+
+        self.devices = {}       # device_id -> Device
+        self.signatures = {}    # device_id -> card_signature
+        self.order = []         # device ids sorted by location
+        self.cursor = 0         # position in self.order up to which everything is built
+        self.cards = {}         # device_id -> card control
+        # Sections are keyed by section_key(location)
+        self.sections = {}      # location -> GridView holding its cards
+        self.section_columns = {}  # location -> section Column (header + grid)
+        self.section_order = []  # locations that have a section, sorted
+        self.summaries = {}     # location -> header Text with its live rollup
+        self.index = DeviceSearchIndex()
+        self.query = ""
+        self.visible_ids = None  # ids matching self.query, None for all
+
+        self.more_button = ft.TextButton(
+            text="Show more devices",
+            on_click=lambda _: self.load_more(),
+        )
+        self.view = ft.Column(
+            scroll=ft.ScrollMode.AUTO,
+            spacing=20,
+            expand=True,
+            on_scroll=self.on_scroll,
+            on_scroll_interval=100,
+            controls=[self.more_button],
+        )
+
+    def load(self):
+        """Read the user's devices and build the first batch of cards"""
+        for device in self.session.query(Device).filter_by(user_id=self.user_id).all():
+            self.devices[device.id] = device
+            self.signatures[device.id] = card_signature(device)
+            self.index.add(device)
+            aggregates.track(device)
+        self.sort_order()
+        self.build_batch()
+        return self.view
+
+    def sort_order(self):
+        self.order = sorted(self.devices, key=lambda i: (section_key(self.devices[i].location), i))
+        self.cursor = 0
+
+    def section(self, location):
+        """Return the grid for a location, creating its section in sorted position"""
+        key = section_key(location)
+        grid = self.sections.get(key)
+        if grid is not None:
+            return grid
+
+        grid = ft.GridView(
+            expand=1,
+            max_extent=250,
+            spacing=15,
+            run_spacing=15,
+            padding=15,
+        )
+        summary = ft.Text(
+            aggregates.describe(self.user_id, key),
+            size=14,
+            color=ft.colors.GREY_500,
+        )
+        header = ft.Row(
+            controls=[
+                ft.Text(
+                    location,
+                    size=20,
+                    weight=ft.FontWeight.BOLD,
+                ),
+                summary,
+            ]
+        )
+        if self.section_menu:
+            menu = self.section_menu(
+                location,
+                [d.type for d in self.devices.values() if section_key(d.location) == key],
+            )
+            if menu is not None:
+                header.controls.append(menu)
+        section = ft.Column(
+            controls=[
+                ft.Container(
+                    content=header,
+                    padding=ft.padding.only(left=10, top=10)
+                ),
+                ft.Container(
+                    content=grid,
+                    padding=10
+                )
+            ]
+        )
+        index = bisect.bisect(self.section_order, key)
+        self.section_order.insert(index, key)
+        self.view.controls.insert(index, section)
+        self.sections[key] = grid
+        self.section_columns[key] = section
+        self.summaries[key] = summary
+        return grid
+
+    def build_cards(self, device_ids):
+        """Build and place cards, fetching sensor values with one query"""
+        sensor_ids = [i for i in device_ids if self.devices[i].type in SENSOR_TYPES]
+        latest = latest_readings(self.session, sensor_ids)
+        device_stats.warm(self.session, sensor_ids)
+        for device_id in device_ids:
+            device = self.devices[device_id]
+            card = self.card_factory(device, latest)
+            card.visible = self.visible_ids is None or device_id in self.visible_ids
+            self.cards[device_id] = card
+            grid = self.section(device.location)
+            grid.controls.append(card)
+            if card.visible:
+                self.section_columns[section_key(device.location)].visible = True
+
+    def build_batch(self):
+        """Build the next CARDS_PER_BATCH cards that are not built yet"""
+        batch = []
+        while self.cursor < len(self.order) and len(batch) < CARDS_PER_BATCH:
+            device_id = self.order[self.cursor]
+            if device_id not in self.cards:
+                batch.append(device_id)
+            self.cursor += 1
+        self.build_cards(batch)
+        self.more_button.visible = self.has_more()
+        return bool(batch)
+
+    def has_more(self):
+        return any(i not in self.cards for i in self.order[self.cursor:])
+
+    def load_more(self):
+        if self.build_batch():
+            self.view.update()
+
+    def on_scroll(self, e: ft.OnScrollEvent):
+        if e.max_scroll_extent - e.pixels <= LOAD_AHEAD_PIXELS and self.has_more():
+            self.load_more()
+
+    def remove_card(self, device_id):
+        card = self.cards.pop(device_id, None)
+        if card is None:
+            return
+        for location, grid in self.sections.items():
+            if card in grid.controls:
+                grid.controls.remove(card)
+                if not grid.controls:
+                    self.remove_section(location)
+                break
+
+    def remove_section(self, key):
+        index = self.section_order.index(key)
+        del self.section_order[index]
+        del self.view.controls[index]
+        del self.sections[key]
+        del self.section_columns[key]
+        del self.summaries[key]
+
+    def refresh(self):
+        """Re-read the device list and rebuild only the cards that changed"""
+        fresh = {
+            device.id: device
+            for device in self.session.query(Device).filter_by(user_id=self.user_id).all()
+        }
+
+        for device_id in set(self.devices) - set(fresh):
+            self.remove_card(device_id)
+            self.index.remove(device_id)
+            aggregates.untrack(device_id)
+            del self.signatures[device_id]
+
+        changed = []
+        moved = False
+        for device_id, device in fresh.items():
+            aggregates.track(device)
+            signature = card_signature(device)
+            old = self.signatures.get(device_id)
+            self.signatures[device_id] = signature
+            if old == signature:
+                continue
+            self.index.add(device)
+            if old is None or old[2] != signature[2]:
+                # New or relocated device, placed with its location
+                moved = True
+                self.remove_card(device_id)
+            elif device_id in self.cards:
+                changed.append(device_id)
+
+        self.devices = fresh
+        if moved or len(self.order) != len(fresh):
+            self.sort_order()
+            # Devices in a location whose section is already shown are built now
+            self.build_cards([
+                i for i in self.order
+                if i not in self.cards and section_key(self.devices[i].location) in self.sections
+            ])
+
+        if changed:
+            latest = latest_readings(
+                self.session, [i for i in changed if self.devices[i].type in SENSOR_TYPES]
+            )
+            for device_id in changed:
+                self.replace_card(self.devices[device_id], latest)
+
+        self.more_button.visible = self.has_more()
+        if self.query:
+            self.apply_filter()
+
+    def filter(self, query):
+        """Show only the cards matching a search query"""
+        self.query = query
+        self.apply_filter()
+
+    def apply_filter(self):
+        """Toggle card visibility for the current query without rebuilding cards"""
+        self.visible_ids = self.index.search(self.query)
+
+        # Matches that have not been built yet are built once, up front
+        if self.visible_ids is not None:
+            self.build_cards([i for i in self.order if i in self.visible_ids and i not in self.cards])
+
+        for device_id, card in self.cards.items():
+            card.visible = self.visible_ids is None or device_id in self.visible_ids
+        for location, grid in self.sections.items():
+            self.section_columns[location].visible = any(card.visible for card in grid.controls)
+        self.more_button.visible = self.visible_ids is None and self.has_more()
+
+    def replace_card(self, device, latest_readings):
+        """Rebuild one card in place and return the grid that holds it"""
+        card = self.cards.get(device.id)
+        if card is None:
+            return None
+        grid = self.sections[section_key(device.location)]
+        new_card = self.card_factory(device, latest_readings)
+        new_card.visible = card.visible
+        grid.controls[grid.controls.index(card)] = new_card
+        self.cards[device.id] = new_card
+        self.signatures[device.id] = card_signature(device)
+        aggregates.track(device)
+        return grid
+
+    def update_summaries(self, locations):
+        """Set the live rollups of these locations' headers; returns the changed Texts"""
+        changed = []
+        for location in locations:
+            key = section_key(location)
+            summary = self.summaries.get(key)
+            if summary is None:
+                continue
+            value = aggregates.describe(self.user_id, key)
+            if value != summary.value:
+                summary.value = value
+                changed.append(summary)
+        return changed
@@ -63,12 +63,12 @@ class DeviceSimulator:
                 command = payload.get("command")
                 
                 if command:
-                    self.handle_command(base_topic, command)
+                    self.handle_command(base_topic, command, payload.get("command_id"))
                     
         except Exception as e:
             print(f"Error handling message: {e}")
 
-    def handle_command(self, topic, command):
+    def handle_command(self, topic, command, command_id=None):
         device = self.devices[topic]
         
         if device["type"] == "light":
@@ -91,9 +91,14 @@ class DeviceSimulator:
         elif device["type"] == "door":
             if command in ["LOCK", "UNLOCK"]:
                 device["value"] = "LOCKED" if command == "LOCK" else "UNLOCKED"
+
+        elif device["type"] == "camera":
+            if command in ["START", "STOP"]:
+                device["value"] = "Active" if command == "START" else "Off"
+                device["motion_detected"] = False
         
-        # Publish updated state
-        self.publish_state(topic)
+        # Publish updated state, echoing the command so it can be confirmed
+        self.publish_state(topic, command_id)
 
     def simulate_sensors(self):
         while True:
@@ -109,8 +114,10 @@ class DeviceSimulator:
                     device["value"] = round(current + random.uniform(-1, 1), 1)
                     
                 elif device["type"] == "camera":
-                    # Simulate random motion detection
-                    if random.random() < 0.1:  # 10% chance of motion
+                    # Simulate random motion detection while the camera is on
+                    if device["value"] == "Off":
+                        pass
+                    elif random.random() < 0.1:  # 10% chance of motion
                         device["motion_detected"] = True
                         device["value"] = "Motion Detected"
                     else:
@@ -122,13 +129,15 @@ class DeviceSimulator:
             # Wait before next update
             time.sleep(5)
 
-    def publish_state(self, topic):
+    def publish_state(self, topic, command_id=None):
         device = self.devices[topic]
         message = {
             "value": str(device["value"]),
             "status": "Online",
             "timestamp": datetime.now().isoformat()
         }
+        if command_id:
+            message["command_id"] = command_id
         
         if device["type"] == "camera" and device["motion_detected"]:
             message["alert"] = "Motion detected!"
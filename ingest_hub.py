@@ -0,0 +1,330 @@
+"""Process-wide ingest and fan-out of device events.
+
+Every dashboard session in the process shares one hub. The hub owns the
+only MQTT connection, and each message is decoded, stored, checked
+against thresholds, anomaly detection and automation rules exactly once.
+The result is published as a HubEvent to the subscriptions of the
+device's owner. Each dashboard session drains its own bounded queue; a
+session that falls behind loses its oldest events rather than holding up
+ingest or the other sessions.
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import select
+
+import metrics
+from aggregates import aggregates
+from anomaly import AnomalyDetector
+from automation import AutomationEngine
+from device_grid import SENSOR_TYPES
+from models import get_session, Device, SensorThreshold
+from mqtt_client import MQTTClient
+from reading_cache import reading_cache
+from rolling_stats import device_stats
+from scenes import SceneEngine
+
+thresholds = SensorThreshold.__table__
+
+# Events buffered per subscription before the oldest are dropped
+SUBSCRIBER_QUEUE = 1000
+
+ingest_seconds = metrics.histogram("ingest_seconds", "Time to check and fan out one batch of stored readings")
+late_readings = metrics.counter("ingest_late_readings", "Readings older than their device's newest, stored late")
+alerts_raised = metrics.counter("alerts_raised", "Threshold and anomaly alerts raised")
+events_published = metrics.counter("hub_events_published", "Events queued to dashboard subscriptions")
+events_dropped = metrics.counter("hub_events_dropped", "Events dropped from full subscription queues")
+
+
+class HubEvent:
+    """A change to publish to dashboards
+
+    kind is "reading" (value, timestamp, alerts), "liveness" (online) or
+    "devices" (device_ids whose stored state changed).
+    """
+
+    __slots__ = ("kind", "user_id", "device_id", "timestamp", "value", "alerts",
+                 "online", "device_ids", "origin")
+
+    def __init__(self, kind, user_id, device_id=None, timestamp=None, value=None,
+                 alerts=(), online=None, device_ids=(), origin=None):
+        self.kind = kind
+        self.user_id = user_id
+        self.device_id = device_id
+        self.timestamp = timestamp
+        self.value = value
+        self.alerts = alerts
+        self.online = online
+        self.device_ids = device_ids
+        self.origin = origin  # subscription that caused the change, skipped on fan-out
+
+
+class Subscription:
+    def __init__(self, hub, user_id, device_ids=None, maxsize=SUBSCRIBER_QUEUE):
+        self.hub = hub
+        self.user_id = user_id
+        self.device_ids = set(device_ids) if device_ids is not None else None
+        self.queue = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def matches(self, event):
+        if event.origin is self:
+            return False
+        if self.device_ids is None:
+            return True
+        if event.device_id is not None:
+            return event.device_id in self.device_ids
+        return not self.device_ids.isdisjoint(event.device_ids)
+
+    def put(self, event):
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1  # deque drops the oldest event on append
+                events_dropped.inc()
+            self.queue.append(event)
+            self.cond.notify()
+
+    def get_batch(self, timeout=None):
+        """Wait for events and return all queued ones; [] once closed"""
+        with self.cond:
+            while not self.queue and not self.closed:
+                if not self.cond.wait(timeout):
+                    return []
+            batch = list(self.queue)
+            self.queue.clear()
+            return batch
+
+    def close(self):
+        self.hub.unsubscribe(self)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class IngestHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.subscriptions = {}   # user id -> list of Subscription
+        self.device_users = {}    # device id -> owner user id
+        self.automations = {}     # user id -> AutomationEngine
+        self.mqtt_client = None
+        self.started = False
+
+        # Used only from the MQTT thread
+        self.session = None
+        self.scenes = None
+        self.thresholds = {}      # device id -> (min, max) or None, see threshold()
+        self.anomalies = AnomalyDetector()
+
+        metrics.gauge("hub_subscriptions", "Open dashboard subscriptions",
+                      fn=lambda: sum(len(s) for s in list(self.subscriptions.values())))
+
+    def start(self, connect=True):
+        """Connect the shared MQTT client once; safe to call from every session
+
+        With connect=False the client is created without a broker, so
+        messages can be fed to its on_message directly (e.g. a replay).
+        """
+        with self.start_lock:
+            if not self.started:
+                self._start(connect)
+                self.started = True
+
+    def _start(self, connect):
+        self.session = get_session()
+        self.scenes = SceneEngine(self.session)
+        client = MQTTClient(callback=self.ingest)
+        if connect:
+            try:
+                client.connect()
+            except Exception as err:
+                print(f"MQTT broker not available, live updates disabled: {err}")
+                client.commands.stop()
+                return
+        else:
+            client.start_ingest()
+        client.liveness.add_listener(self.on_liveness)
+        self.mqtt_client = client
+
+    def subscribe(self, user_id, device_ids=None, maxsize=SUBSCRIBER_QUEUE):
+        """Subscribe to a user's events, optionally only for some devices"""
+        subscription = Subscription(self, user_id, device_ids, maxsize)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(event.user_id, ()))
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+                events_published.inc()
+
+    def watch_devices(self, devices):
+        """Register a user's devices for liveness tracking and event routing"""
+        with self.lock:
+            for device in devices:
+                self.device_users[device.id] = device.user_id
+        if self.mqtt_client:
+            for device in devices:
+                self.mqtt_client.liveness.watch(device.id, device.type, bool(device.is_online))
+
+    def notify_devices(self, user_id, device_ids, origin=None):
+        """Tell a user's other sessions that these devices changed in the database"""
+        self.publish(HubEvent("devices", user_id, device_ids=list(device_ids), origin=origin))
+
+    # Automation rules, shared by all sessions of a user
+
+    def automation_engine(self, user_id):
+        with self.lock:
+            engine = self.automations.get(user_id)
+        if engine is not None:
+            return engine
+        engine = AutomationEngine()
+        session = get_session()
+        try:
+            devices = session.query(Device).filter_by(user_id=user_id).all()
+            engine.load(session, user_id, devices)
+        finally:
+            session.close()
+        with self.lock:
+            return self.automations.setdefault(user_id, engine)
+
+    def rules(self, user_id):
+        engine = self.automation_engine(user_id)
+        with self.lock:
+            return list(engine.rules.values())
+
+    def add_rule(self, user_id, rule):
+        engine = self.automation_engine(user_id)
+        with self.lock:
+            engine.add(rule)
+
+    def remove_rule(self, user_id, rule_id):
+        engine = self.automation_engine(user_id)
+        with self.lock:
+            engine.remove(rule_id)
+
+    # Ingest, called on the MQTT thread
+
+    def ingest(self, readings):
+        """Check a batch of stored readings once and publish them to the owners' sessions
+
+        A late reading (older than the device's newest) only updates the
+        cached windows and rolling statistics; live location rollups,
+        alerts, dashboards and automations act on current readings only.
+        Anomaly detection runs once over the whole batch, vectorized
+        across devices.
+        """
+        started = time.perf_counter()
+        current = []
+        for reading in readings:
+            device, timestamp, value = reading.device, reading.timestamp, reading.value
+            self.device_users[device.id] = device.user_id
+            reading_cache.add_reading(device.id, timestamp, value)
+            device_stats.add_reading(device.id, timestamp, value)
+            if reading.late:
+                late_readings.inc()
+                continue
+            aggregates.reading(device.id, value)
+            current.append(reading)
+
+        anomalies = {}  # (device id, epoch seconds) -> Anomaly list
+        sensors = [r for r in current if r.device.type in SENSOR_TYPES]
+        if sensors:
+            for reading in sensors:
+                self.anomalies.register(reading.device.id, reading.device.type)
+            found = self.anomalies.process_batch(
+                [r.device.id for r in sensors],
+                [r.timestamp.timestamp() for r in sensors],
+                [r.value for r in sensors],
+            )
+            for anomaly in found:
+                anomalies.setdefault((anomaly.device_id, anomaly.timestamp), []).append(anomaly)
+
+        for reading in current:
+            try:
+                self.fan_out(reading, anomalies.get((reading.device.id, reading.timestamp.timestamp()), ()))
+            except Exception as err:
+                print(f"Error processing reading: {err}")
+        ingest_seconds.observe(time.perf_counter() - started)
+
+    def fan_out(self, reading, anomalies):
+        """Raise alerts for a current reading, publish it and run automations"""
+        device, timestamp, value = reading.device, reading.timestamp, reading.value
+        alerts = [f"Alert: {device.name} {anomaly.describe()}" for anomaly in anomalies]
+
+        limits = self.threshold(device.id)
+        if limits is not None:
+            low, high = limits
+            if (low is not None and value < low) or (high is not None and value > high):
+                alerts.append(f"Alert: {device.name} value {value:.1f} is outside threshold range!")
+
+        if alerts:
+            alerts_raised.inc(len(alerts))
+        self.publish(HubEvent("reading", device.user_id, device.id, timestamp, value, alerts))
+        self.run_automations(device.user_id, device.id, value, timestamp)
+
+    def threshold(self, device_id):
+        """(min, max) alert limits of a device, None when alerts are off; cached"""
+        try:
+            return self.thresholds[device_id]
+        except KeyError:
+            pass
+        try:
+            row = self.session.execute(
+                select(thresholds.c.min_value, thresholds.c.max_value, thresholds.c.alert_enabled)
+                .where(thresholds.c.device_id == device_id)
+            ).first()
+            self.session.commit()
+        except Exception as err:
+            self.session.rollback()
+            print(f"Error loading thresholds: {err}")
+            return None
+        limits = (row.min_value, row.max_value) if row is not None and row.alert_enabled else None
+        self.thresholds[device_id] = limits
+        return limits
+
+    def invalidate_threshold(self, device_id):
+        """Call after a device's thresholds were changed"""
+        self.thresholds.pop(device_id, None)
+
+    def run_automations(self, user_id, device_id, value, timestamp):
+        with self.lock:
+            engine = self.automations.get(user_id)
+            fired = engine.evaluate(device_id, value, timestamp) if engine else []
+        for rule in fired:
+            print(f"Automation fired: {rule.text}")
+            try:
+                dispatcher = self.mqtt_client.commands if self.mqtt_client else None
+                run = self.scenes.apply(rule.action, user_id, dispatcher)
+            except Exception as err:
+                self.session.rollback()
+                print(f"Error running automation: {err}")
+                continue
+            if run.devices:
+                self.notify_devices(user_id, [d.id for d in run.devices])
+
+    def on_liveness(self, changes):
+        for device_id, online in changes:
+            aggregates.set_online(device_id, online)
+            user_id = self.device_users.get(device_id)
+            if user_id is not None:
+                self.publish(HubEvent("liveness", user_id, device_id, online=online))
+
+
+# Shared by every dashboard session in the process
+hub = IngestHub()
@@ -1,12 +1,13 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, User, Device, SensorThreshold
-import bcrypt
+from migrations import migrate
+from auth import hash_password
 
-# Create database
+# Create missing tables and upgrade existing ones in place
 engine = create_engine('sqlite:///smart_home.db')
-Base.metadata.drop_all(engine)  # Reset database
 Base.metadata.create_all(engine)
+migrate(engine, background=False)
 
 # Create session
 Session = sessionmaker(bind=engine)
@@ -15,10 +16,13 @@ session = Session()
 # Create test user if it doesn't exist
 test_user = session.query(User).filter_by(username='test').first()
 if not test_user:
-    password = bcrypt.hashpw('test123'.encode('utf-8'), bcrypt.gensalt())
+    password = hash_password('test123')
     test_user = User(username='test', password_hash=password)
     session.add(test_user)
-    session.commit()
+    session.flush()
+elif session.query(Device).filter_by(user_id=test_user.id).first():
+    print("Test data already present, database schema is up to date")
+    raise SystemExit
 
 # Define sensor defaults for different room types
 room_defaults = {
@@ -56,6 +60,8 @@ rooms = {
 for room_name, room_type in rooms.items():
     # Get defaults for this room type
     defaults = room_defaults[room_type]
+    # Topic segment used by the devices, e.g. home/living_room/temperature
+    topic_room = room_name.lower().replace(' ', '_')
     
     # Create camera for Living Room and Outside
     if room_name in ['Living Room', 'Outside']:
@@ -67,11 +73,11 @@ for room_name, room_type in rooms.items():
             is_online=True,
             is_enabled=True,
             location=room_name,
+            mqtt_topic=f"home/{topic_room}/camera",
             description=f"Security camera for {room_name}",
             user_id=test_user.id
         )
         session.add(camera_device)
-        session.commit()
     
     # Skip other sensors for Outside area
     if room_name == 'Outside':
@@ -86,12 +92,13 @@ for room_name, room_type in rooms.items():
         is_online=True,
         is_enabled=True,
         location=room_name,
+        mqtt_topic=f"home/{topic_room}/temperature",
         description=f"Temperature sensor for {room_name}",
         unit=defaults['temperature'][1],
         user_id=test_user.id
     )
     session.add(temp_device)
-    session.commit()
+    session.flush()  # To get the device ID
     
     # Add temperature thresholds
     temp_threshold = SensorThreshold(
@@ -101,7 +108,6 @@ for room_name, room_type in rooms.items():
         alert_enabled=True
     )
     session.add(temp_threshold)
-    session.commit()
     
     # Create humidity sensor
     humid_device = Device(
@@ -112,12 +118,13 @@ for room_name, room_type in rooms.items():
         is_online=True,
         is_enabled=True,
         location=room_name,
+        mqtt_topic=f"home/{topic_room}/humidity",
         description=f"Humidity sensor for {room_name}",
         unit=defaults['humidity'][1],
         user_id=test_user.id
     )
     session.add(humid_device)
-    session.commit()
+    session.flush()  # To get the device ID
     
     # Add humidity thresholds
     humid_threshold = SensorThreshold(
@@ -127,7 +134,6 @@ for room_name, room_type in rooms.items():
         alert_enabled=True
     )
     session.add(humid_threshold)
-    session.commit()
     
     # Create curtain control
     curtain_device = Device(
@@ -138,10 +144,13 @@ for room_name, room_type in rooms.items():
         is_online=True,
         is_enabled=True,
         location=room_name,
+        mqtt_topic=f"home/{topic_room}/curtain",
         description=f"Curtain control for {room_name}",
         user_id=test_user.id
     )
     session.add(curtain_device)
-    session.commit()
+
+# Write everything in a single transaction
+session.commit()
 
 print("Database initialized with test data including cameras, kid bedrooms, and curtain controls!")
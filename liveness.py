@@ -0,0 +1,183 @@
+"""Device liveness tracking with a hashed timer wheel.
+
+Every message re-arms its device's deadline (expected report interval of
+its type times MISSED_REPORTS). Re-arming only overwrites the deadline in
+a dict; the device stays in whatever wheel slot it is already in, and is
+moved forward lazily when that slot comes due. A device therefore costs
+O(1) amortized per message, and expiring devices never requires scanning
+the ones that are still reporting.
+
+Online/offline transitions are collected and flushed to the database in
+one executemany UPDATE, then passed to the registered listeners.
+"""
+import threading
+import time
+
+from sqlalchemy import update
+
+import metrics
+from models import Device, get_session
+
+# Seconds between reports expected from each device type
+EXPECTED_INTERVALS = {
+    "temperature": 5,
+    "humidity": 5,
+    "camera": 5,
+    "light": 60,
+    "door": 60,
+    "curtain": 60,
+}
+DEFAULT_INTERVAL = 60
+# Reports a device may miss before it is considered offline
+MISSED_REPORTS = 3
+
+TICK = 1.0         # wheel resolution in seconds
+WHEEL_SLOTS = 512  # deadlines further out than one turn wait extra turns
+FLUSH_INTERVAL = 2.0
+
+flush_size = metrics.histogram("liveness_flush_devices", "Devices per liveness flush", scale=1)
+transitions = metrics.counter("liveness_transitions", "Online/offline transitions written")
+
+
+class LivenessTracker:
+    def __init__(self, session_factory=get_session, tick=TICK, slots=WHEEL_SLOTS,
+                 flush_interval=FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.tick = tick
+        self.flush_interval = flush_interval
+        self.wheel = [[] for _ in range(slots)]
+        self.current = self._tick_of(time.monotonic())
+
+        self.deadlines = {}  # device id -> monotonic deadline, present while armed
+        self.online = {}     # device id -> last known state
+        self.changes = {}    # device id -> state not yet written to the database
+        self.listeners = []  # listener(list of (device_id, online))
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _tick_of(self, when):
+        return int(when // self.tick)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def watch(self, device_id, device_type, online=True):
+        """Start tracking a device known from the database
+
+        Devices stored as online are armed as if they had just reported, so
+        stale online flags are cleared if nothing arrives.
+        """
+        with self.lock:
+            self.online.setdefault(device_id, online)
+            if online and device_id not in self.deadlines:
+                self._arm(device_id, device_type, time.monotonic())
+
+    def seen(self, device_id, device_type):
+        """Record a message from a device"""
+        now = time.monotonic()
+        with self.lock:
+            self._arm(device_id, device_type, now)
+            if not self.online.get(device_id):
+                self.online[device_id] = True
+                self.changes[device_id] = True
+
+    def _arm(self, device_id, device_type, now):
+        deadline = now + EXPECTED_INTERVALS.get(device_type, DEFAULT_INTERVAL) * MISSED_REPORTS
+        if device_id not in self.deadlines:
+            self._schedule(device_id, deadline)
+        # Already in the wheel: it is moved when its current slot comes due
+        self.deadlines[device_id] = deadline
+
+    def _schedule(self, device_id, deadline):
+        # A deadline that falls in an already processed tick goes in the next one
+        slot_tick = max(self._tick_of(deadline), self.current + 1)
+        self.wheel[slot_tick % len(self.wheel)].append(device_id)
+
+    def advance(self, now=None):
+        """Expire devices whose deadline passed; returns how many went offline"""
+        now = time.monotonic() if now is None else now
+        expired = 0
+        with self.lock:
+            target = self._tick_of(now)
+            # After a long pause every slot is visited once, not once per missed tick
+            self.current = max(self.current, target - len(self.wheel))
+            while self.current < target:
+                self.current += 1
+                slot = self.wheel[self.current % len(self.wheel)]
+                if not slot:
+                    continue
+                self.wheel[self.current % len(self.wheel)] = []
+                for device_id in slot:
+                    deadline = self.deadlines.get(device_id)
+                    if deadline is None:
+                        continue
+                    if self._tick_of(deadline) > self.current:
+                        # Re-armed since it was scheduled, or due in a later turn
+                        self._schedule(device_id, deadline)
+                        continue
+                    del self.deadlines[device_id]
+                    if self.online.get(device_id):
+                        self.online[device_id] = False
+                        self.changes[device_id] = False
+                        expired += 1
+        return expired
+
+    def flush(self):
+        """Write pending transitions in one batch and notify listeners
+
+        Transitions that could not be written stay pending for the next flush.
+        """
+        with self.lock:
+            changes, self.changes = self.changes, {}
+        if not changes:
+            return []
+
+        rows = [{"id": device_id, "is_online": online} for device_id, online in changes.items()]
+        session = self.session_factory()
+        try:
+            session.execute(update(Device), rows)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            print(f"Error saving device liveness: {err}")
+            with self.lock:
+                # Retried on the next flush; a transition recorded since then is newer and wins
+                for device_id, online in changes.items():
+                    self.changes.setdefault(device_id, online)
+            return []
+        finally:
+            session.close()
+
+        flush_size.observe(len(changes))
+        transitions.inc(len(changes))
+        changed = list(changes.items())
+        for listener in list(self.listeners):
+            try:
+                listener(changed)
+            except Exception as err:
+                print(f"Error in liveness listener: {err}")
+        return changed
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self.stopped.wait(self.tick):
+            self.advance()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.tick * 2)
+            self.thread = None
+        self.flush()
@@ -1,18 +1,67 @@
 import flet as ft
-import bcrypt
 from datetime import datetime, timedelta
-from models import get_session, User, Device
-from mqtt_client import MQTTClient
-from sensor_data import SensorReading, SensorThreshold
-from sensor_details import SensorDetailsView
-import json
+from models import get_session, User, Device, AutomationRule, SensorReading, SensorThreshold
+from migrations import migrate
+from rolling_stats import device_stats
+from throttle import UpdateThrottle, Debouncer
+from device_grid import DeviceGrid, SENSOR_TYPES, latest_readings
+from scenes import SceneEngine, location_scenes
+from automation import compile_rule
+from auth import auth_service
+from aggregates import aggregates, rebuild
+import metrics
+import storage
+import logging
+import time
+from collections import deque
+import threading
 import random
+from sqlalchemy import insert
+
+# Seconds of typing pause before the device search is applied
+SEARCH_DEBOUNCE = 0.2
+
+ui_flush_seconds = metrics.histogram("ui_flush_seconds", "Time to apply a batch of hub events to a dashboard")
+ui_batch_events = metrics.histogram("ui_batch_events", "Hub events applied per dashboard flush", scale=1)
+chart_render_seconds = metrics.histogram("chart_render_seconds", "Time to build or redraw a sensor chart")
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+
+def bootstrap():
+    """Startup work that is not needed for the login screen
+
+    Started in the background once the app launches; the dashboard calls it
+    again and waits for it if it has not finished yet.
+    """
+    global _bootstrapped
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        # Add missing columns now; index builds and backfills continue in the background
+        migrate()
+        metrics.start()
+        # Export closed days for the analytics engine, when one is enabled
+        storage.start()
+        # Import the NumPy-based modules while the user is logging in
+        import reading_cache, anomaly, synthetic_data, ingest_hub, comparison  # noqa: F401
+        _bootstrapped = True
 
 class SmartHomeApp:
     def __init__(self):
         self.session = get_session()
         self.current_user = None
+        self.session_token = None
         self.mqtt_client = None
+        self.reading_listeners = {}  # device_id -> list of callbacks
+        self.home_view = None
+        self.home_summary = None
+        self.device_grid = None
+        self.search_debouncer = None
+        self.scenes = SceneEngine(self.session)
+        # Process-wide ingest hub and this session's event subscription
+        self.hub = None
+        self.subscription = None
         
     def initialize(self, page: ft.Page):
         self.page = page
@@ -22,7 +71,20 @@ class SmartHomeApp:
         self.page.spacing = 20
         
         self.setup_auth_views()
-        self.show_login()
+
+        # A reconnecting dashboard resumes its session without a password check
+        try:
+            token = self.page.client_storage.get("session_token")
+        except Exception:
+            token = None
+        user_id = auth_service.resume(token)
+        if user_id is not None:
+            self.session_token = token
+            self.current_user = self.session.get(User, user_id)
+        if self.current_user:
+            self.show_home()
+        else:
+            self.show_login()
 
     def setup_auth_views(self):
         # Login View
@@ -99,38 +161,45 @@ class SmartHomeApp:
             spacing=20
         )
 
-    def create_device_card(self, device):
+    def subscribe_readings(self, device_id, callback):
+        """Call `callback(timestamp, value)` for every reading stored for a device
+
+        Returns a function that removes the subscription.
+        """
+        listeners = self.reading_listeners.setdefault(device_id, [])
+        listeners.append(callback)
+
+        def unsubscribe():
+            if callback in listeners:
+                listeners.remove(callback)
+            if not listeners and self.reading_listeners.get(device_id) is listeners:
+                del self.reading_listeners[device_id]
+
+        return unsubscribe
+
+    def create_device_card(self, device, latest_readings=None):
         def on_card_click(e):
-            details_view = SensorDetailsView(self.page, device, self.session, lambda _: self.show_home())
-            self.page.clean()
-            self.page.add(details_view.build())
+            self.show_device_details(e, device)
 
         def on_switch_change(e):
+            previous = device.state
             try:
                 # Update device state
                 device.state = e.control.value
                 self.session.commit()
-
-                # Prepare MQTT message based on device type
-                mqtt_message = {
-                    "state": "ON" if device.state else "OFF"
-                }
-
-                # Add device-specific commands
-                if device.type == "light":
-                    mqtt_message["command"] = "ON" if device.state else "OFF"
-                elif device.type == "curtain":
-                    mqtt_message["command"] = "OPEN" if device.state else "CLOSE"
-                elif device.type == "door":
-                    mqtt_message["command"] = "UNLOCK" if device.state else "LOCK"
-                elif device.type == "camera":
-                    mqtt_message["command"] = "START" if device.state else "STOP"
-
-                # Publish MQTT message
-                if self.mqtt_client:
-                    self.mqtt_client.publish(
-                        f"device/{device.id}/control",
-                        json.dumps(mqtt_message)
+                if self.hub:
+                    self.hub.notify_devices(device.user_id, [device.id], self.subscription)
+                aggregates.track(device)
+                self.update_summaries([device.location])
+
+                # Send the command to the device's control topic; devices
+                # added without a topic are only switched in the database
+                if self.mqtt_client and device.mqtt_topic:
+                    requested = device.state
+                    self.mqtt_client.commands.send(
+                        device,
+                        requested,
+                        lambda command_id, confirmed: on_command_done(e.control, requested, previous, confirmed)
                     )
 
                 # Update UI to reflect new state
@@ -145,8 +214,16 @@ class SmartHomeApp:
                 )
             except Exception as err:
                 print(f"Error changing device state: {err}")
-                # Revert switch state on error
-                e.control.value = not e.control.value
+                # Revert the stored and displayed state on error
+                self.session.rollback()
+                if device.state != previous:
+                    device.state = previous
+                    self.session.commit()
+                    if self.hub:
+                        self.hub.notify_devices(device.user_id, [device.id], self.subscription)
+                    aggregates.track(device)
+                    self.update_summaries([device.location])
+                e.control.value = previous
                 e.control.update()
                 self.page.show_snack_bar(
                     ft.SnackBar(
@@ -154,6 +231,31 @@ class SmartHomeApp:
                     )
                 )
 
+        def on_command_done(switch, requested, previous, confirmed):
+            # Called on the dispatcher's thread; the revert runs with the page's other handlers
+            if not confirmed:
+                self.page.run_thread(revert_command, switch, requested, previous)
+
+        def revert_command(switch, requested, previous):
+            if device.state != requested:
+                return  # switched again since, the newer command decides
+            # The device never confirmed the command, revert to the state before it
+            try:
+                device.state = previous
+                self.session.commit()
+                if self.hub:
+                    self.hub.notify_devices(device.user_id, [device.id], self.subscription)
+                switch.value = previous
+                switch.update()
+                aggregates.track(device)
+                self.update_summaries([device.location])
+                self.page.show_snack_bar(
+                    ft.SnackBar(content=ft.Text(f"{device.name} did not respond"))
+                )
+            except Exception as err:
+                self.session.rollback()
+                print(f"Error reverting device state: {err}")
+
         # Create the icon based on device type
         icon_map = {
             "temperature": ft.icons.THERMOSTAT,
@@ -203,22 +305,38 @@ class SmartHomeApp:
             spacing=8,  # Increased from 5
         )
 
+        if device.is_online is False:
+            main_content.controls.append(
+                ft.Row(
+                    controls=[
+                        ft.Icon(ft.icons.CLOUD_OFF, size=14, color=ft.colors.RED_300),
+                        ft.Text("Offline", size=12, color=ft.colors.RED_300),
+                    ],
+                    alignment=ft.MainAxisAlignment.CENTER,
+                    spacing=4,
+                )
+            )
+
         # Add status or control based on device type
         status_control = None
         if device.type in ["temperature", "humidity"]:
-            # Get latest reading
-            latest_reading = (
-                self.session.query(SensorReading)
-                .filter_by(device_id=device.id)
-                .order_by(SensorReading.timestamp.desc())
-                .first()
-            )
-            if latest_reading:
+            # Get latest reading, unless the caller already fetched it
+            if latest_readings is not None:
+                latest_value = latest_readings.get(device.id)
+            else:
+                latest_reading = (
+                    self.session.query(SensorReading)
+                    .filter_by(device_id=device.id)
+                    .order_by(SensorReading.timestamp.desc())
+                    .first()
+                )
+                latest_value = latest_reading.value if latest_reading else None
+            if latest_value is not None:
                 # Create value display with large text
                 status_control = ft.Column(
                     controls=[
                         ft.Text(
-                            f"{latest_reading.value:.1f}",
+                            f"{latest_value:.1f}",
                             size=32,  # Increased from 24
                             weight=ft.FontWeight.BOLD,
                             color=ft.colors.BLUE_400,
@@ -234,6 +352,17 @@ class SmartHomeApp:
                     horizontal_alignment=ft.CrossAxisAlignment.CENTER,
                     spacing=4,  # Increased from 2
                 )
+                # 24h range from the rolling aggregates
+                day_stats = device_stats.get(device.id, "24h")
+                if day_stats is not None:
+                    status_control.controls.append(
+                        ft.Text(
+                            f"24h {day_stats['min']:.1f} - {day_stats['max']:.1f}",
+                            size=12,
+                            color=ft.colors.GREY_400,
+                            text_align=ft.TextAlign.CENTER,
+                        )
+                    )
             else:
                 status_control = ft.Text(
                     "No data",
@@ -292,9 +421,6 @@ class SmartHomeApp:
 
     def generate_dummy_readings(self):
         """Generate 24 hours of dummy readings for temperature and humidity sensors"""
-        from datetime import datetime, timedelta
-        import random
-
         # Get all temperature and humidity sensors
         sensors = (
             self.session.query(Device)
@@ -302,13 +428,16 @@ class SmartHomeApp:
             .all()
         )
 
-        # Generate readings for each sensor
+        # Delete existing readings in one statement
+        sensor_ids = [sensor.id for sensor in sensors]
+        self.session.query(SensorReading).filter(
+            SensorReading.device_id.in_(sensor_ids)
+        ).delete(synchronize_session=False)
+
+        # Generate 24 readings per sensor, one for each hour
+        base_time = datetime.now() - timedelta(hours=24)
+        rows = []
         for sensor in sensors:
-            # Delete existing readings
-            self.session.query(SensorReading).filter_by(device_id=sensor.id).delete()
-            
-            # Generate 24 readings, one for each hour
-            base_time = datetime.now() - timedelta(hours=24)
             base_value = 22 if sensor.type == "temperature" else 50  # Base temperature or humidity
             
             for hour in range(24):
@@ -319,39 +448,55 @@ class SmartHomeApp:
                 else:
                     value = base_value + random.uniform(-10, 10)  # Humidity varies by ±10%
                 
-                reading = SensorReading(
-                    device_id=sensor.id,
-                    value=round(value, 1),
-                    timestamp=timestamp
-                )
-                self.session.add(reading)
-        
+                rows.append({
+                    "device_id": sensor.id,
+                    "value": round(value, 1),
+                    "timestamp": timestamp
+                })
+
+        # Insert all readings with a single executemany
+        if rows:
+            self.session.execute(insert(SensorReading), rows)
+        # Rebuild the hourly location rollups, which still count the deleted readings
+        rebuild(self.session.connection())
         self.session.commit()
+        from reading_cache import reading_cache
+        reading_cache.invalidate()
 
     def setup_home_view(self):
-        # Get user's devices from database
-        devices = self.session.query(Device).filter_by(user_id=self.current_user.id).all()
-        
+        bootstrap()
+        # MQTT ingest, alerts and automations run once per process in the hub
+        from ingest_hub import hub
+        self.hub = hub
+        hub.start()
+        self.mqtt_client = hub.mqtt_client
+
         # Generate dummy readings if none exist
-        readings_count = self.session.query(SensorReading).count()
-        if readings_count == 0:
+        if self.session.query(SensorReading.id).first() is None:
             self.generate_dummy_readings()
-        
-        # Group devices by location
-        devices_by_location = {}
-        for device in devices:
-            if device.location not in devices_by_location:
-                devices_by_location[device.location] = []
-            devices_by_location[device.location].append(device)
 
-        # Create the main container
-        main_column = ft.Column(
-            scroll=ft.ScrollMode.AUTO,
-            spacing=20,
-            expand=True
+        # Cards are built lazily by the grid as the user scrolls
+        self.device_grid = DeviceGrid(
+            self.session,
+            self.current_user.id,
+            self.create_device_card,
+            self.create_location_menu
         )
-
-        # Add search bar
+        grid_view = self.device_grid.load()
+        self.home_summary = ft.Text(
+            aggregates.describe(self.current_user.id),
+            size=14,
+            color=ft.colors.GREY_500,
+        )
+        hub.automation_engine(self.current_user.id)
+        hub.watch_devices(list(self.device_grid.devices.values()))
+        self.subscription = hub.subscribe(self.current_user.id)
+        threading.Thread(
+            target=self.consume_events, args=(self.subscription,), name="dashboard-events", daemon=True
+        ).start()
+
+        # Add search bar, filtering cards once typing pauses
+        self.search_debouncer = Debouncer(SEARCH_DEBOUNCE, self.apply_search)
         search_bar = ft.TextField(
             prefix_icon=ft.icons.SEARCH,
             hint_text="Search devices...",
@@ -359,6 +504,7 @@ class SmartHomeApp:
             expand=True,
             height=45,
             border_color=ft.colors.BLUE_400,
+            on_change=lambda e: self.search_debouncer.call(e.control.value),
         )
         
         # Add view toggle
@@ -374,6 +520,18 @@ class SmartHomeApp:
                 controls=[
                     search_bar,
                     view_toggle,
+                    ft.IconButton(
+                        icon=ft.icons.STACKED_LINE_CHART,
+                        tooltip="Compare sensors",
+                        icon_color=ft.colors.BLUE_400,
+                        on_click=lambda _: self.show_comparison()
+                    ),
+                    ft.IconButton(
+                        icon=ft.icons.AUTO_MODE,
+                        tooltip="Automations",
+                        icon_color=ft.colors.BLUE_400,
+                        on_click=self.show_automations_dialog
+                    ),
                     ft.IconButton(
                         icon=ft.icons.ADD,
                         tooltip="Add Device",
@@ -385,41 +543,16 @@ class SmartHomeApp:
             ),
             padding=ft.padding.only(bottom=20)
         )
-        main_column.controls.append(top_bar)
 
-        # Add devices grouped by location
-        for location in sorted(devices_by_location.keys()):
-            # Create location section
-            location_devices = devices_by_location[location]
-            
-            # Create grid for location's devices
-            location_grid = ft.GridView(
-                expand=1,
-                max_extent=250,
-                spacing=15,
-                run_spacing=15,
-                padding=15,
-            )
-            
-            # Add devices to grid
-            for device in location_devices:
-                location_grid.controls.append(self.create_device_card(device))
-            
-            # Add location section to main column
-            main_column.controls.extend([
-                ft.Container(
-                    content=ft.Text(
-                        location,
-                        size=20,
-                        weight=ft.FontWeight.BOLD,
-                    ),
-                    padding=ft.padding.only(left=10, top=10)
-                ),
-                ft.Container(
-                    content=location_grid,
-                    padding=10
-                )
-            ])
+        # Create the main container
+        main_column = ft.Column(
+            controls=[
+                top_bar,
+                grid_view
+            ],
+            spacing=20,
+            expand=True
+        )
 
         # Wrap in a container for padding
         main_container = ft.Container(
@@ -428,36 +561,166 @@ class SmartHomeApp:
             expand=True,
         )
 
-        # Clear the page and add the new view
-        self.page.clean()
-        self.page.add(
-            ft.Container(
-                content=ft.Column(
-                    controls=[
-                        ft.Container(
-                            content=ft.Row(
-                                controls=[
-                                    ft.Text("Smart Home Dashboard", 
-                                           size=32, 
-                                           weight=ft.FontWeight.BOLD),
-                                    ft.IconButton(
-                                        icon=ft.icons.LOGOUT,
-                                        tooltip="Logout",
-                                        on_click=self.handle_logout
-                                    )
-                                ],
-                                alignment=ft.MainAxisAlignment.SPACE_BETWEEN
-                            ),
-                            padding=ft.padding.only(left=20, right=20, top=20, bottom=10)
+        # Keep the built view so returning to the dashboard reuses it
+        self.home_view = ft.Container(
+            content=ft.Column(
+                controls=[
+                    ft.Container(
+                        content=ft.Row(
+                            controls=[
+                                ft.Column(
+                                    controls=[
+                                        ft.Text("Smart Home Dashboard", 
+                                               size=32, 
+                                               weight=ft.FontWeight.BOLD),
+                                        self.home_summary,
+                                    ],
+                                    spacing=0,
+                                ),
+                                ft.IconButton(
+                                    icon=ft.icons.LOGOUT,
+                                    tooltip="Logout",
+                                    on_click=self.handle_logout
+                                )
+                            ],
+                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN
                         ),
-                        main_container
-                    ],
-                    expand=True,
-                ),
+                        padding=ft.padding.only(left=20, right=20, top=20, bottom=10)
+                    ),
+                    main_container
+                ],
                 expand=True,
+            ),
+            expand=True,
+        )
+
+    def create_location_menu(self, location, device_types):
+        """Bulk actions and sensor comparison menu for a location header"""
+        items = [
+            ft.PopupMenuItem(
+                text=scene.name,
+                on_click=lambda _, scene=scene: self.apply_scene(scene)
+            )
+            for scene in location_scenes(location, device_types)
+        ]
+        if any(t in SENSOR_TYPES for t in device_types):
+            items.append(ft.PopupMenuItem(
+                text="Compare sensors",
+                on_click=lambda _: self.show_comparison(location)
+            ))
+        if not items:
+            return None
+        return ft.PopupMenuButton(
+            icon=ft.icons.MORE_HORIZ,
+            tooltip="Bulk actions",
+            items=items
+        )
+
+    def apply_scene(self, scene):
+        """Apply a scene and refresh every affected card in a single page update"""
+        try:
+            dispatcher = self.mqtt_client.commands if self.mqtt_client else None
+            run = self.scenes.apply(scene, self.current_user.id, dispatcher)
+
+            started = time.perf_counter()
+            for device in run.devices:
+                self.device_grid.replace_card(device, {})
+            self.update_summaries({d.location for d in run.devices}, redraw=False)
+            self.page.update()
+            run.ui_ms = (time.perf_counter() - started) * 1000
+            self.hub.notify_devices(self.current_user.id, [d.id for d in run.devices], self.subscription)
+
+            print(f"Scene {run.summary()}")
+            self.page.show_snack_bar(
+                ft.SnackBar(content=ft.Text(run.summary()))
+            )
+        except Exception as err:
+            print(f"Error applying scene: {err}")
+            self.session.rollback()
+            self.page.show_snack_bar(
+                ft.SnackBar(content=ft.Text(f"Error applying {scene.name}: {str(err)}"))
+            )
+
+    def show_automations_dialog(self, e):
+        def close_dialog(e):
+            self.page.dialog.open = False
+            self.page.update()
+
+        def rule_row(rule_id, text):
+            return ft.Row(
+                controls=[
+                    ft.Text(text, expand=True),
+                    ft.IconButton(
+                        icon=ft.icons.DELETE,
+                        tooltip="Delete rule",
+                        on_click=lambda _: delete_rule(rule_id)
+                    )
+                ]
             )
+
+        def delete_rule(rule_id):
+            self.session.query(AutomationRule).filter_by(id=rule_id).delete()
+            self.session.commit()
+            self.hub.remove_rule(self.current_user.id, rule_id)
+            rules_column.controls = [rule_row(r.id, r.text) for r in self.hub.rules(self.current_user.id)]
+            rules_column.update()
+
+        def add_rule(e):
+            try:
+                rule = compile_rule(rule_field.value or "", list(self.device_grid.devices.values()))
+            except ValueError as err:
+                rule_field.error_text = str(err)
+                rule_field.update()
+                return
+
+            row = AutomationRule(user_id=self.current_user.id, text=rule.text, enabled=True)
+            self.session.add(row)
+            self.session.commit()
+            rule.id = row.id
+            self.hub.add_rule(self.current_user.id, rule)
+
+            rule_field.value = ""
+            rule_field.error_text = None
+            rules_column.controls.append(rule_row(rule.id, rule.text))
+            rule_field.update()
+            rules_column.update()
+
+        rules_column = ft.Column(
+            controls=[rule_row(r.id, r.text) for r in self.hub.rules(self.current_user.id)],
+            spacing=5,
+            scroll=ft.ScrollMode.AUTO,
+            height=250
+        )
+        rule_field = ft.TextField(
+            label="New rule",
+            hint_text="if Living Room temperature > 26 for 5 min, close curtain",
+            width=450
         )
 
+        self.page.dialog = ft.AlertDialog(
+            title=ft.Text("Automations"),
+            content=ft.Column(
+                controls=[rules_column, rule_field],
+                spacing=10,
+                height=350
+            ),
+            actions=[
+                ft.TextButton("Close", on_click=close_dialog),
+                ft.TextButton("Add", on_click=add_rule)
+            ]
+        )
+        self.page.dialog.open = True
+        self.page.update()
+
+    def apply_search(self, query):
+        if not self.device_grid:
+            return
+        try:
+            self.device_grid.filter(query)
+            self.device_grid.view.update()
+        except Exception as err:
+            print(f"Error filtering devices: {err}")
+
     def show_add_device_dialog(self, e):
         def close_dialog(e):
             self.page.dialog.open = False
@@ -520,7 +783,8 @@ class SmartHomeApp:
                 location_field.update()
 
                 # Refresh device grid
-                self.update_device_grid()
+                self.device_grid.refresh()
+                self.device_grid.view.update()
 
             except Exception as err:
                 print(f"Error adding device: {err}")
@@ -565,66 +829,111 @@ class SmartHomeApp:
         self.page.update()
 
     def show_device_details(self, e, device):
+        def on_back(_):
+            details_view.dispose()
+            self.show_home()
+
         details_view = SensorDetailsView(
             self.page,
             device,
             self.session,
-            lambda _: self.show_home()
+            on_back,
+            self.subscribe_readings
         )
         self.page.clean()
         self.page.add(details_view.build())
 
-    def update_device_ui(self, device):
-        """Update device card in UI when MQTT message is received"""
+    def update_summaries(self, locations, redraw=True):
+        """Show the current rollups in the home header and these locations' headers"""
+        if not self.device_grid:
+            return
+        changed = self.device_grid.update_summaries(locations)
+        value = aggregates.describe(self.current_user.id)
+        if value != self.home_summary.value:
+            self.home_summary.value = value
+            changed.append(self.home_summary)
+        if redraw:
+            for text in changed:
+                if text.page:
+                    text.update()
+
+    def show_comparison(self, location=None):
+        """Overlay the sensors of one location, or of the whole home"""
+        from comparison import ComparisonView
+
+        devices = [
+            d for d in self.device_grid.devices.values()
+            if d.type in SENSOR_TYPES and (location is None or d.location == location)
+        ]
+        devices.sort(key=lambda d: (d.type, d.location or "", d.name))
+        title = f"Compare Sensors: {location}" if location else "Compare Sensors"
+        comparison = ComparisonView(self.page, self.session, devices, lambda _: self.show_home(), title)
+        self.page.clean()
+        self.page.add(comparison.build())
+        self.page.update()
+
+    def consume_events(self, subscription):
+        """Apply hub events to this session's dashboard until unsubscribed"""
+        while not subscription.closed:
+            events = subscription.get_batch()
+            if events:
+                self.apply_events(events)
+
+    def apply_events(self, events):
+        """Apply a batch of hub events, updating each affected grid once"""
+        if not self.device_grid:
+            return
+        started = time.perf_counter()
+        ui_batch_events.observe(len(events))
         try:
-            # Store reading in database
-            if hasattr(device, 'value') and device.value is not None:
-                try:
-                    value = float(device.value) if str(device.value).replace('.', '').isdigit() else 0
-                    reading = SensorReading(
-                        device_id=device.id,
-                        value=value,
-                        timestamp=datetime.now()
-                    )
-                    self.session.add(reading)
-                    self.session.commit()
-                except (ValueError, AttributeError) as err:
-                    print(f"Error storing reading: {err}")
-
-            # Check thresholds
-            threshold = (
-                self.session.query(SensorThreshold)
-                .filter_by(device_id=device.id)
-                .first()
-            )
-            
-            if threshold and threshold.alert_enabled:
-                try:
-                    value = float(device.value) if str(device.value).replace('.', '').isdigit() else 0
-                    if (threshold.min_value is not None and value < threshold.min_value) or \
-                       (threshold.max_value is not None and value > threshold.max_value):
-                        self.page.show_snack_bar(
-                            ft.SnackBar(
-                                content=ft.Text(f"Alert: {device.name} value {value:.1f} is outside threshold range!")
-                            )
-                        )
-                except (ValueError, AttributeError) as err:
-                    print(f"Error checking threshold: {err}")
-
-            # Update UI
-            if hasattr(self, 'devices_grid'):
-                for control in self.devices_grid.controls:
-                    if isinstance(control.content, ft.Container) and \
-                       isinstance(control.content.content, ft.Column) and \
-                       len(control.content.content.controls) > 1 and \
-                       control.content.content.controls[1].value == device.name:
-                        new_card = self.create_device_card(device)
-                        index = self.devices_grid.controls.index(control)
-                        self.devices_grid.controls[index] = new_card
-                        self.page.update()
-                        break
+            devices = self.device_grid.devices
+            latest = {}      # device id -> newest value in the batch
+            rebuild = set()
+            changed = []
+            alerts = []
+            for event in events:
+                if event.kind == "reading":
+                    for callback in list(self.reading_listeners.get(event.device_id, ())):
+                        callback(event.timestamp, event.value)
+                    alerts.extend(event.alerts)
+                    device = devices.get(event.device_id)
+                    if device is not None and device.type in SENSOR_TYPES and event.value is not None:
+                        latest[event.device_id] = event.value
+                        rebuild.add(event.device_id)
+                elif event.kind == "liveness":
+                    if event.device_id in devices:
+                        devices[event.device_id].is_online = event.online
+                        rebuild.add(event.device_id)
+                elif event.kind == "devices":
+                    changed.extend(event.device_ids)
+
+            if changed:
+                # Reload devices changed by other sessions or automations in one query
+                self.session.query(Device).filter(Device.id.in_(changed)).populate_existing().all()
+                rebuild.update(changed)
+
+            rebuilt = [devices[i] for i in rebuild if i in devices]
+            # Sensor values for the other rebuilt cards in one query
+            missing = [d.id for d in rebuilt if d.type in SENSOR_TYPES and d.id not in latest]
+            if missing:
+                latest.update(latest_readings(self.session, missing))
+
+            grids = set()
+            for device in rebuilt:
+                grid = self.device_grid.replace_card(device, latest)
+                if grid is not None and grid.page:
+                    grids.add(grid)
+            for grid in grids:
+                grid.update()
+            if rebuilt:
+                self.update_summaries({d.location for d in rebuilt})
+
+            if alerts:
+                more = f" (+{len(alerts) - 1} more)" if len(alerts) > 1 else ""
+                self.page.show_snack_bar(ft.SnackBar(content=ft.Text(alerts[-1] + more)))
         except Exception as err:
-            print(f"Error in update_device_ui: {err}")
+            print(f"Error applying device events: {err}")
+        ui_flush_seconds.observe(time.perf_counter() - started)
 
     def show_login(self):
         self.page.clean()
@@ -647,29 +956,24 @@ class SmartHomeApp:
     def show_home(self):
         """Show the home view."""
         self.page.clean()
-        self.setup_home_view()
+        if self.home_view is None:
+            self.setup_home_view()
+        else:
+            # Reuse the cached view, rebuilding only cards that changed
+            self.device_grid.refresh()
+        self.page.add(self.home_view)
         self.page.update()
 
     def handle_login(self, e):
-        user = (
-            self.session.query(User)
-            .filter_by(username=self.username_login.value)
-            .first()
+        # bcrypt runs on the auth pool; the button stays disabled until it answers
+        button = e.control
+        button.disabled = True
+        button.update()
+        auth_service.login(
+            self.username_login.value,
+            self.password_login.value,
+            lambda result: self.finish_auth(result, button, "Welcome back, {}!"),
         )
-        
-        if user and bcrypt.checkpw(
-            self.password_login.value.encode('utf-8'),
-            user.password_hash
-        ):
-            self.current_user = user
-            self.show_home()
-            self.page.show_snack_bar(
-                ft.SnackBar(content=ft.Text(f"Welcome back, {user.username}!"))
-            )
-        else:
-            self.page.show_snack_bar(
-                ft.SnackBar(content=ft.Text("Invalid username or password"))
-            )
 
     def handle_register(self, e):
         if self.password_register.value != self.confirm_password.value:
@@ -678,50 +982,83 @@ class SmartHomeApp:
             )
             return
 
-        existing_user = (
-            self.session.query(User)
-            .filter_by(username=self.username_register.value)
-            .first()
+        button = e.control
+        button.disabled = True
+        button.update()
+        auth_service.register(
+            self.username_register.value,
+            self.password_register.value,
+            lambda result: self.finish_auth(result, button, "Registration successful!"),
         )
-        
-        if existing_user:
+
+    def finish_auth(self, result, button, message):
+        """Called from the auth pool once a login or registration completes"""
+        try:
+            button.disabled = False
+            if not result.ok:
+                button.update()
+                self.page.show_snack_bar(ft.SnackBar(content=ft.Text(result.error)))
+                return
+
+            self.session_token = result.token
+            try:
+                self.page.client_storage.set("session_token", result.token)
+            except Exception as err:
+                print(f"Error storing session token: {err}")
+            self.current_user = self.session.get(User, result.user_id)
+            self.show_home()
             self.page.show_snack_bar(
-                ft.SnackBar(content=ft.Text("Username already exists"))
+                ft.SnackBar(content=ft.Text(message.format(self.current_user.username)))
             )
-            return
-
-        password_hash = bcrypt.hashpw(
-            self.password_register.value.encode('utf-8'),
-            bcrypt.gensalt()
-        )
-        
-        new_user = User(
-            username=self.username_register.value,
-            password_hash=password_hash
-        )
-        self.session.add(new_user)
-        self.session.commit()
-        
-        self.current_user = new_user
-        self.show_home()
-        self.page.show_snack_bar(
-            ft.SnackBar(content=ft.Text("Registration successful!"))
-        )
+        except Exception as err:
+            print(f"Error finishing sign-in: {err}")
 
     def handle_logout(self, e):
+        auth_service.logout(self.session_token)
+        self.session_token = None
+        try:
+            self.page.client_storage.remove("session_token")
+        except Exception as err:
+            print(f"Error clearing session token: {err}")
+        if self.subscription:
+            self.subscription.close()
+            self.subscription = None
         self.current_user = None
+        self.home_view = None
+        self.home_summary = None
+        self.device_grid = None
+        if self.search_debouncer:
+            self.search_debouncer.stop()
         self.show_login()
         self.page.show_snack_bar(
             ft.SnackBar(content=ft.Text("Logged out successfully"))
         )
 
+# Points kept in the live detail chart
+LIVE_WINDOW_POINTS = 24
+# Minimum seconds between redraws of the live detail chart
+LIVE_UPDATE_INTERVAL = 1.0
+# Hours of readings the detail chart is seeded from, via the reading cache
+HISTORY_HOURS = 24
+# Rolling statistics windows shown in the details view
+STATS_WINDOWS = ("1h", "24h", "7d")
+
 class SensorDetailsView:
-    def __init__(self, page: ft.Page, device, session, on_back):
+    def __init__(self, page: ft.Page, device, session, on_back, subscribe=None):
         self.page = page
         self.device = device
         self.session = session
         self.on_back = on_back
+        self.subscribe = subscribe
         self.update_interval = None
+        self.unsubscribe = None
+
+        # Sliding window of chart points, fed by live readings
+        self.points = deque(maxlen=LIVE_WINDOW_POINTS)
+        self.point_times = deque(maxlen=LIVE_WINDOW_POINTS)
+        self.next_x = 0
+        self.pending = []
+        self.pending_lock = threading.Lock()
         
         # Get or create threshold settings
         self.threshold = (
@@ -780,6 +1117,7 @@ class SensorDetailsView:
                 raise ValueError("Min value cannot be greater than max value")
 
             self.session.commit()
+            self.thresholds_changed()
             
             # Show success message
             self.page.show_snack_bar(
@@ -800,9 +1138,15 @@ class SensorDetailsView:
             self.min_threshold.update()
             self.max_threshold.update()
 
+    def thresholds_changed(self):
+        # The ingest hub caches alert limits per device
+        from ingest_hub import hub
+        hub.invalidate_threshold(self.device.id)
+
     def toggle_alerts(self, e):
         self.threshold.alert_enabled = e.control.value
         self.session.commit()
+        self.thresholds_changed()
         
         # Show status message
         self.page.show_snack_bar(
@@ -813,32 +1157,14 @@ class SensorDetailsView:
             )
         )
 
-    def create_chart(self):
-        # Get the last 24 hours of readings
-        readings = (
-            self.session.query(SensorReading)
-            .filter_by(device_id=self.device.id)
-            .order_by(SensorReading.timestamp.desc())
-            .limit(24)
-            .all()
-        )
-        
-        if not readings:
-            return ft.Column(
-                controls=[
-                    ft.Icon(ft.icons.SHOW_CHART, size=40, color=ft.colors.GREY_400),
-                    ft.Text("No data available yet", color=ft.colors.GREY_400),
-                ],
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                alignment=ft.MainAxisAlignment.CENTER,
-                expand=True,
-            )
-        
-        # Prepare data for the chart
-        timestamps = [reading.timestamp.strftime("%H:%M") for reading in reversed(readings)]
-        values = [reading.value for reading in reversed(readings)]
-        
-        # Calculate axis values
+    def add_point(self, timestamp, value):
+        self.points.append(ft.LineChartDataPoint(self.next_x, value))
+        self.point_times.append(timestamp.strftime("%H:%M"))
+        self.next_x += 1
+
+    def apply_window(self):
+        """Fit the axes and labels of the chart to the current window"""
+        values = [point.y for point in self.points]
         min_val = min(values)
         max_val = max(values)
         step = (max_val - min_val) / 5  # Create 5 steps
@@ -846,24 +1172,59 @@ class SensorDetailsView:
         # Generate axis labels with proper rounding
         y_axis_values = []
         current = min_val
-        while current <= max_val:
+        while current <= max_val and step > 0:
             y_axis_values.append(current)
             current += step
+        if not y_axis_values:
+            y_axis_values.append(min_val)
+
+        first_x = self.points[0].x
+        self.series.data_points = list(self.points)
+        self.chart.left_axis.labels = [
+            ft.ChartAxisLabel(
+                value=i,
+                label=ft.Text(f"{i:.1f}")
+            )
+            for i in y_axis_values
+        ]
+        self.chart.bottom_axis.labels = [
+            ft.ChartAxisLabel(
+                value=point.x,
+                label=ft.Text(label)
+            )
+            for point, label in zip(self.points, self.point_times)
+            if point.x % 4 == 0
+        ]
+        self.chart.min_y = min_val
+        self.chart.max_y = max_val
+        self.chart.min_x = first_x
+        self.chart.max_x = max(first_x, self.points[-1].x)
+
+    def create_chart(self):
+        with chart_render_seconds.time():
+            return self._create_chart()
+
+    def _create_chart(self):
+        # Seed the window with the most recent readings, kept current in memory by ingest
+        from reading_cache import reading_cache
+        series = reading_cache.get(self.session, self.device.id, HISTORY_HOURS)
+        self.latest_reading = None
+        if series is not None:
+            timestamps, values = series
+            recent = [(ts.astype(datetime), float(value))
+                      for ts, value in zip(timestamps[-LIVE_WINDOW_POINTS:], values[-LIVE_WINDOW_POINTS:])]
+            for timestamp, value in recent:
+                self.add_point(timestamp, value)
+            self.latest_reading = recent[-1]
         
-        # Create the chart
-        return ft.LineChart(
-            data_series=[
-                ft.LineChartData(
-                    data_points=[
-                        ft.LineChartDataPoint(x, y) 
-                        for x, y in enumerate(values)
-                    ],
-                    stroke_width=2,
-                    color=ft.colors.BLUE_400,
-                    curved=True,
-                    stroke_cap_round=True,
-                )
-            ],
+        self.series = ft.LineChartData(
+            stroke_width=2,
+            color=ft.colors.BLUE_400,
+            curved=True,
+            stroke_cap_round=True,
+        )
+        self.chart = ft.LineChart(
+            data_series=[self.series],
             border=ft.border.all(1, ft.colors.GREY_400),
             horizontal_grid_lines=ft.ChartGridLines(
                 interval=1,
@@ -875,52 +1236,112 @@ class SensorDetailsView:
                 color=ft.colors.GREY_200,
                 width=1,
             ),
-            left_axis=ft.ChartAxis(
-                labels=[
-                    ft.ChartAxisLabel(
-                        value=i,
-                        label=ft.Text(f"{i:.1f}")
-                    )
-                    for i in y_axis_values
-                ],
-                labels_size=40,
-            ),
+            left_axis=ft.ChartAxis(labels_size=40),
             bottom_axis=ft.ChartAxis(
-                labels=[
-                    ft.ChartAxisLabel(
-                        value=i,
-                        label=ft.Text(timestamps[i])
-                    )
-                    for i in range(0, len(timestamps), 4)
-                ],
                 labels_size=40,
                 labels_interval=4,
             ),
             expand=True,
-            min_y=min_val,
-            max_y=max_val,
-            min_x=0,
-            max_x=len(values) - 1,
             tooltip_bgcolor=ft.colors.with_opacity(0.8, ft.colors.BLUE_GREY_100),
         )
 
+        if not self.points:
+            return ft.Column(
+                controls=[
+                    ft.Icon(ft.icons.SHOW_CHART, size=40, color=ft.colors.GREY_400),
+                    ft.Text("No data available yet", color=ft.colors.GREY_400),
+                ],
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                alignment=ft.MainAxisAlignment.CENTER,
+                expand=True,
+            )
+        
+        self.apply_window()
+        return self.chart
+
+    def on_reading(self, timestamp, value):
+        """Queue a live reading; the chart is redrawn at a capped rate"""
+        with self.pending_lock:
+            self.pending.append((timestamp, value))
+        self.update_interval.request()
+
+    def flush_live_points(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        started = time.perf_counter()
+        try:
+            for timestamp, value in pending:
+                self.add_point(timestamp, value)
+            self.apply_window()
+
+            timestamp, value = pending[-1]
+            self.current_value_text.value = f"{value} {self.device.unit}"
+            self.last_updated_text.value = timestamp.strftime("%H:%M:%S")
+            self.refresh_stats()
+
+            # Only the chart and the stat values are sent to the client
+            if self.chart_container.content is not self.chart:
+                self.chart_container.content = self.chart
+                self.chart_container.update()
+            else:
+                self.chart.update()
+            self.current_value_text.update()
+            self.last_updated_text.update()
+            self.stats_table.update()
+        except Exception as err:
+            print(f"Error updating live chart: {err}")
+        chart_render_seconds.observe(time.perf_counter() - started)
+
+    def refresh_stats(self):
+        """Fill the statistics table from the rolling aggregates"""
+        unit = self.device.unit or ""
+        for window, cells in zip(STATS_WINDOWS, self.stats_cells):
+            stats = device_stats.get(self.device.id, window)
+            if stats is None:
+                values = ("-", "-", "-", "-")
+            else:
+                values = (
+                    f"{stats['mean']:.1f} {unit}",
+                    f"{stats['stddev']:.2f}",
+                    f"{stats['min']:.1f} {unit}",
+                    f"{stats['max']:.1f} {unit}",
+                )
+            for cell, value in zip(cells, values):
+                cell.value = value
+
     def build(self):
-        # Get latest reading
-        latest_reading = (
-            self.session.query(SensorReading)
-            .filter_by(device_id=self.device.id)
-            .order_by(SensorReading.timestamp.desc())
-            .first()
+        # The chart loads the most recent readings, including the latest one
+        self.chart_container = ft.Container(
+            content=self.create_chart(),
+            expand=True,
+            padding=10,
         )
-        
+
         # Create stats cards
-        if latest_reading:
-            current_value = f"{latest_reading.value} {self.device.unit}"
-            last_updated = latest_reading.timestamp.strftime("%H:%M:%S")
+        if self.latest_reading:
+            timestamp, value = self.latest_reading
+            current_value = f"{value} {self.device.unit}"
+            last_updated = timestamp.strftime("%H:%M:%S")
         else:
             current_value = "No data"
             last_updated = "Never"
             
+        self.current_value_text = ft.Text(
+            current_value,
+            size=24,
+            weight=ft.FontWeight.BOLD,
+            color=ft.colors.BLUE_400,
+        )
+        self.last_updated_text = ft.Text(
+            last_updated,
+            size=24,
+            weight=ft.FontWeight.BOLD,
+            color=ft.colors.BLUE_400,
+        )
+
         stats_row = ft.Row(
             controls=[
                 ft.Card(
@@ -928,12 +1349,7 @@ class SensorDetailsView:
                         content=ft.Column(
                             controls=[
                                 ft.Text("Current Value", size=14, color=ft.colors.GREY_400),
-                                ft.Text(
-                                    current_value,
-                                    size=24,
-                                    weight=ft.FontWeight.BOLD,
-                                    color=ft.colors.BLUE_400,
-                                ),
+                                self.current_value_text,
                             ],
                             spacing=5,
                         ),
@@ -945,12 +1361,7 @@ class SensorDetailsView:
                         content=ft.Column(
                             controls=[
                                 ft.Text("Last Updated", size=14, color=ft.colors.GREY_400),
-                                ft.Text(
-                                    last_updated,
-                                    size=24,
-                                    weight=ft.FontWeight.BOLD,
-                                    color=ft.colors.BLUE_400,
-                                ),
+                                self.last_updated_text,
                             ],
                             spacing=5,
                         ),
@@ -961,6 +1372,32 @@ class SensorDetailsView:
             alignment=ft.MainAxisAlignment.SPACE_AROUND,
         )
 
+        # Rolling mean/stddev/min/max, maintained incrementally per reading
+        device_stats.warm(self.session, [self.device.id])
+        self.stats_cells = [
+            [ft.Text() for _ in range(4)] for _ in STATS_WINDOWS
+        ]
+        self.refresh_stats()
+        self.stats_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Window")),
+                ft.DataColumn(ft.Text("Mean"), numeric=True),
+                ft.DataColumn(ft.Text("Std Dev"), numeric=True),
+                ft.DataColumn(ft.Text("Min"), numeric=True),
+                ft.DataColumn(ft.Text("Max"), numeric=True),
+            ],
+            rows=[
+                ft.DataRow(cells=[ft.DataCell(ft.Text(window))] + [ft.DataCell(cell) for cell in cells])
+                for window, cells in zip(STATS_WINDOWS, self.stats_cells)
+            ],
+        )
+        stats_card = ft.Card(
+            content=ft.Container(
+                content=self.stats_table,
+                padding=10,
+            )
+        )
+
         # Create threshold settings card
         threshold_card = ft.Card(
             content=ft.Container(
@@ -990,6 +1427,11 @@ class SensorDetailsView:
             )
         )
 
+        # Stream new readings into the chart while the view is shown
+        if self.subscribe and self.unsubscribe is None:
+            self.update_interval = UpdateThrottle(LIVE_UPDATE_INTERVAL, self.flush_live_points)
+            self.unsubscribe = self.subscribe(self.device.id, self.on_reading)
+
         # Create main view
         return ft.Column(
             controls=[
@@ -1011,6 +1453,7 @@ class SensorDetailsView:
                     padding=10,
                 ),
                 stats_row,
+                stats_card,
                 threshold_card,
                 ft.Container(
                     content=ft.Text(
@@ -1020,16 +1463,15 @@ class SensorDetailsView:
                     ),
                     padding=ft.padding.only(left=10, top=20, bottom=10),
                 ),
-                ft.Container(
-                    content=self.create_chart(),
-                    expand=True,
-                    padding=10,
-                ),
+                self.chart_container,
             ],
             expand=True,
         )
 
     def dispose(self):
+        if self.unsubscribe:
+            self.unsubscribe()
+            self.unsubscribe = None
         if self.update_interval:
             self.update_interval.stop()
 
@@ -1038,4 +1480,6 @@ def main(page: ft.Page):
     app.initialize(page)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    threading.Thread(target=bootstrap, name="bootstrap", daemon=True).start()
     ft.app(target=main)
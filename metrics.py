@@ -0,0 +1,289 @@
+"""In-process metrics: counters, gauges and latency histograms.
+
+Recording is a lock and an integer add, cheap enough for the MQTT and UI
+hot paths. Histograms use HDR-style log-linear buckets (16 sub-buckets
+per power of two, so any recorded value is within ~6% of its bucket) and
+never store individual samples, so their memory stays bounded however
+many values are recorded.
+
+The registry is exposed as Prometheus text on a local HTTP endpoint and
+summarised in a periodic log line:
+
+    METRICS_PORT=9108           # 0 disables the endpoint
+    METRICS_LOG_INTERVAL=60     # seconds, 0 disables the log line
+
+    curl -s localhost:9108/metrics
+"""
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', 60))
+
+# Values below 2**SUB_BITS are counted exactly, larger ones in 2**(SUB_BITS - 1) sub-buckets per power of two
+SUB_BITS = 5
+SUB_COUNT = 1 << (SUB_BITS - 1)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name + "_total", self.value)]
+
+
+class Gauge:
+    """A value that goes up and down, or is read from `fn` when scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get(self):
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception:
+            return float("nan")
+
+    def samples(self):
+        return [(self.name, self.get())]
+
+
+def bucket_index(n):
+    if n < 2 * SUB_COUNT:
+        return n
+    shift = n.bit_length() - SUB_BITS
+    return shift * SUB_COUNT + (n >> shift)
+
+
+def bucket_bounds(index):
+    """[low, high) of the integers counted in a bucket"""
+    if index < 2 * SUB_COUNT:
+        return index, index + 1
+    shift = index // SUB_COUNT - 1
+    mantissa = index % SUB_COUNT + SUB_COUNT
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class Histogram:
+    """Distribution of values, recorded as integers in units of 1/scale
+
+    The default scale records seconds with microsecond resolution; use
+    scale=1 for counts such as batch sizes.
+    """
+
+    kind = "summary"
+
+    def __init__(self, name, help, scale=1_000_000):
+        self.name = name
+        self.help = help
+        self.scale = scale
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bucket_index(max(0, int(value * self.scale)))
+        with self.lock:
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        """Context manager that observes the seconds spent in its block"""
+        return _Timer(self)
+
+    def quantile(self, q):
+        with self.lock:
+            buckets = sorted(self.buckets.items())
+            count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, n in buckets:
+            seen += n
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                # Middle of the bucket, like HDR's "highest equivalent" halved
+                return (low + high - 1) / 2 / self.scale
+        return self.max
+
+    def samples(self):
+        samples = [(f'{self.name}{{quantile="{q}"}}', self.quantile(q)) for q in QUANTILES]
+        samples.append((self.name + "_sum", self.sum))
+        samples.append((self.name + "_count", self.count))
+        samples.append((self.name + "_max", self.max))
+        return samples
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help="", fn=None):
+        return self._get(Gauge, name, help, fn=fn)
+
+    def histogram(self, name, help="", scale=1_000_000):
+        return self._get(Histogram, name, help, scale=scale)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {value:.6g}" if isinstance(value, float) else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """One line with every counter and gauge and the p50/p99 of each histogram"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        parts = []
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    unit = "ms" if metric.scale == 1_000_000 else ""
+                    factor = 1000 if unit else 1
+                    parts.append(
+                        f"{metric.name}=n{metric.count}/p50 {metric.quantile(0.5) * factor:.3g}{unit}"
+                        f"/p99 {metric.quantile(0.99) * factor:.3g}{unit}"
+                    )
+            else:
+                value = metric.get() if isinstance(metric, Gauge) else metric.value
+                parts.append(f"{metric.name}={value:.3g}" if isinstance(value, float) else f"{metric.name}={value}")
+        return " ".join(parts)
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve GET /metrics from a daemon thread; returns the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_log(interval=METRICS_LOG_INTERVAL):
+    """Log registry.summary() every `interval` seconds from a daemon thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info("metrics %s", registry.summary())
+
+    thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+_started = False
+
+
+def start():
+    """Start the endpoint and log line as configured; later calls do nothing"""
+    global _started
+    if _started:
+        return
+    _started = True
+    if METRICS_PORT:
+        try:
+            server = start_http_server()
+            logger.info("Metrics at http://%s:%d/metrics", *server.server_address[:2])
+        except OSError as err:
+            logger.warning("Metrics endpoint not started: %s", err)
+    if METRICS_LOG_INTERVAL > 0:
+        start_log()
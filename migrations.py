@@ -0,0 +1,221 @@
+"""Versioned, online schema migrations for smart_home.db.
+
+The schema version is kept in SQLite's `PRAGMA user_version`. Migrations
+are idempotent, applied in version order, and each one bumps the version
+when it has completed, so an interrupted upgrade resumes where it stopped.
+
+Nothing here rewrites a table: columns are added with ALTER TABLE ADD
+COLUMN, which only changes the schema record, and data is backfilled in
+short rowid-range transactions. Migrations marked online (index builds,
+backfills) run in a background thread after startup. SQLite cannot build
+a single index incrementally, so while an index is being built readers
+continue (WAL mode) and writers wait for it on their busy timeout.
+
+    python migrations.py            # apply everything now and report
+    python migrations.py --status
+"""
+import argparse
+import logging
+import threading
+import time
+
+from models import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Rows updated per backfill transaction; keeps write locks short
+BACKFILL_CHUNK = 5_000
+
+MIGRATIONS = []
+
+
+class Migration:
+    __slots__ = ("version", "description", "apply", "online")
+
+    def __init__(self, version, description, apply, online):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.online = online
+
+
+def migration(version, online=False):
+    """Register a migration; the function's docstring is its description"""
+    def register(apply):
+        MIGRATIONS.append(Migration(version, (apply.__doc__ or apply.__name__).strip(), apply, online))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return apply
+    return register
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def add_column(conn, table, name, ddl):
+    """ALTER TABLE ADD COLUMN unless the column already exists"""
+    if name not in columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
+def backfill(conn, table, assignment, condition, chunk=BACKFILL_CHUNK):
+    """UPDATE table SET assignment WHERE condition, one rowid range at a time
+
+    Each chunk is its own transaction, so concurrent writers only ever wait
+    for one chunk. Returns the number of rows updated.
+    """
+    last = conn.exec_driver_sql(f"SELECT max(rowid) FROM {table}").scalar() or 0
+    conn.commit()
+    updated = 0
+    for start in range(0, last + 1, chunk):
+        result = conn.exec_driver_sql(
+            f"UPDATE {table} SET {assignment} WHERE rowid >= ? AND rowid < ? AND ({condition})",
+            (start, start + chunk),
+        )
+        conn.commit()
+        updated += result.rowcount
+    return updated
+
+
+def current_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_version(conn, version):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+@migration(1)
+def add_device_columns(conn):
+    """Add the device and threshold columns written by the app"""
+    add_column(conn, "devices", "value", "VARCHAR")
+    add_column(conn, "devices", "status", "VARCHAR")
+    add_column(conn, "devices", "is_online", "BOOLEAN")
+    add_column(conn, "devices", "is_enabled", "BOOLEAN")
+    add_column(conn, "devices", "last_updated", "DATETIME")
+    add_column(conn, "sensor_thresholds", "alert_email", "VARCHAR")
+
+
+@migration(2, online=True)
+def index_readings_by_device(conn):
+    """Index sensor readings by device and time"""
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sensor_readings_device_ts "
+        "ON sensor_readings (device_id, timestamp)"
+    )
+
+
+@migration(3, online=True)
+def index_devices(conn):
+    """Index devices by owner and MQTT topic"""
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_devices_user_id ON devices (user_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_devices_mqtt_topic ON devices (mqtt_topic)")
+
+
+@migration(4, online=True)
+def backfill_device_flags(conn):
+    """Default is_enabled and is_online on existing devices"""
+    backfill(conn, "devices", "is_enabled = 1", "is_enabled IS NULL")
+    backfill(conn, "devices", "is_online = 0", "is_online IS NULL")
+
+
+@migration(5, online=True)
+def unique_readings(conn):
+    """Drop duplicate readings and make (device_id, timestamp) unique"""
+    unique = {row[1]: row[2] for row in conn.exec_driver_sql("PRAGMA index_list(sensor_readings)")}
+    if unique.get("ix_sensor_readings_device_ts"):
+        return
+    # One transaction: no duplicate can slip in between the delete and the index
+    deleted = conn.exec_driver_sql(
+        "DELETE FROM sensor_readings WHERE EXISTS ("
+        "SELECT 1 FROM sensor_readings AS first WHERE first.device_id = sensor_readings.device_id "
+        "AND first.timestamp = sensor_readings.timestamp AND first.rowid < sensor_readings.rowid)"
+    ).rowcount
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_sensor_readings_device_ts")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX ix_sensor_readings_device_ts ON sensor_readings (device_id, timestamp)"
+    )
+    logger.info("Removed %d duplicate readings", deleted)
+
+
+@migration(6, online=True)
+def build_location_rollups(conn):
+    """Build hourly location rollups from the stored readings"""
+    from aggregates import rebuild
+
+    # One transaction: readings stored meanwhile wait for it, then add to the rebuilt rows
+    built = rebuild(conn)
+    logger.info("Built %d hourly location rollups", built)
+
+
+def _apply(conn, pending):
+    for m in pending:
+        started = time.perf_counter()
+        # Migrations are idempotent; an interrupted one is simply run again
+        m.apply(conn)
+        set_version(conn, m.version)
+        conn.commit()
+        logger.info("Applied migration %d (%s) in %.2fs", m.version, m.description,
+                    time.perf_counter() - started)
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def migrate(bind=None, background=True):
+    """Bring the database schema up to date
+
+    Migrations up to the first online one run before returning; with
+    background=True the rest continue in a daemon thread, which is
+    returned (None when nothing is left to do).
+    """
+    bind = bind or get_engine()
+    with bind.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        conn.commit()
+        pending = pending_migrations(conn)
+        blocking = []
+        for m in pending:
+            if m.online and background:
+                break
+            blocking.append(m)
+        _apply(conn, blocking)
+
+    remaining = pending[len(blocking):]
+    if not remaining:
+        return None
+
+    def run():
+        try:
+            with bind.connect() as conn:
+                _apply(conn, remaining)
+        except Exception as err:
+            logger.error("Background migration failed: %s", err)
+
+    thread = threading.Thread(target=run, name="migrations", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the smart_home.db schema")
+    parser.add_argument("--status", action="store_true", help="Show the schema version and pending migrations")
+    args = parser.parse_args()
+
+    if args.status:
+        with get_engine().connect() as conn:
+            print(f"Schema version {current_version(conn)}")
+            for m in pending_migrations(conn):
+                print(f"  pending {m.version}: {m.description}")
+        return
+
+    migrate(background=False)
+    with get_engine().connect() as conn:
+        print(f"Schema is at version {current_version(conn)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,10 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
+import os
+import threading
 
-# Create a configured "Session" class
-engine = create_engine('sqlite:///smart_home.db')
+DATABASE_URL = 'sqlite:///smart_home.db'
+
+# The engine is created, and the schema checked, on first use rather than
+# at import time; see get_engine()
+_engine = None
+_engine_lock = threading.Lock()
 Base = declarative_base()
 
 class Device(Base):
@@ -13,14 +19,19 @@ class Device(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String)
     type = Column(String)
-    mqtt_topic = Column(String)
+    mqtt_topic = Column(String, index=True)
     location = Column(String)
     description = Column(String)
     unit = Column(String)
     state = Column(Boolean, default=False)
+    value = Column(String)
+    status = Column(String)
+    is_online = Column(Boolean, default=False)
+    is_enabled = Column(Boolean, default=True)
+    last_updated = Column(DateTime)
     readings = relationship("SensorReading", back_populates="device")
     threshold = relationship("SensorThreshold", back_populates="device", uselist=False)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     user = relationship("User", back_populates="devices")
 
 class SensorReading(Base):
@@ -32,6 +43,11 @@ class SensorReading(Base):
     timestamp = Column(DateTime, default=datetime.now)
     device = relationship("Device", back_populates="readings")
 
+    __table_args__ = (
+        # Unique: a device reports one value per timestamp, redeliveries are dropped
+        Index('ix_sensor_readings_device_ts', 'device_id', 'timestamp', unique=True),
+    )
+
 class SensorThreshold(Base):
     __tablename__ = 'sensor_thresholds'
     
@@ -40,6 +56,7 @@ class SensorThreshold(Base):
     min_value = Column(Float, nullable=True)
     max_value = Column(Float, nullable=True)
     alert_enabled = Column(Boolean, default=False)
+    alert_email = Column(String, nullable=True)
     device = relationship("Device", back_populates="threshold")
 
 class User(Base):
@@ -50,11 +67,60 @@ class User(Base):
     password_hash = Column(String)
     devices = relationship("Device", back_populates="user")
 
-# Create all tables in the engine
-Base.metadata.create_all(engine)
+class AutomationRule(Base):
+    __tablename__ = 'automation_rules'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    text = Column(String)
+    enabled = Column(Boolean, default=True)
+
+class IngestCheckpoint(Base):
+    """Last spool sequence number stored, committed with the data it covers"""
+    __tablename__ = 'ingest_checkpoints'
+
+    name = Column(String, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+class LocationRollup(Base):
+    """Hourly aggregate of one sensor type's readings in a location, see aggregates.py"""
+    __tablename__ = 'location_rollups'
+
+    user_id = Column(Integer, primary_key=True)
+    location = Column(String, primary_key=True)  # '' for devices without one
+    type = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+
+# Create a configured "Session" class, bound once the engine exists
+Session = sessionmaker()
+
+def get_engine():
+    """Create the engine and any missing tables on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # Writers wait up to 30s for locks, e.g. while a migration builds an index
+                engine = create_engine(DATABASE_URL, connect_args={'timeout': 30})
+                if os.getenv('QUERY_PROFILE'):
+                    # Opt-in: per-query timings, slow-query log and N+1 report at exit
+                    import query_profiler
+                    query_profiler.install(engine)
+                Base.metadata.create_all(engine)
+                Session.configure(bind=engine)
+                _engine = engine
+    return _engine
 
-# Create a configured "Session" class
-Session = sessionmaker(bind=engine)
+def __getattr__(name):
+    # `from models import engine` keeps working, and creates it lazily
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def get_session():
-    return Session()
+def get_session(**kwargs):
+    get_engine()
+    return Session(**kwargs)
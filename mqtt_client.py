@@ -1,18 +1,95 @@
 import paho.mqtt.client as mqtt
 import json
+import time
 from datetime import datetime
-from models import get_session, Device
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import select, update, bindparam
+from models import get_engine, Device, SensorReading, IngestCheckpoint
+from records import DeviceInfo, Reading
+from command_dispatcher import CommandDispatcher
+from liveness import LivenessTracker
+from spool import Spool
+from aggregates import hourly_rows, upsert_rollups
+import metrics
+import storage
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+messages_received = metrics.counter("mqtt_messages_received", "MQTT messages received")
+messages_decoded = metrics.counter("mqtt_messages_decoded", "MQTT messages with a valid JSON payload")
+messages_dropped = metrics.counter("mqtt_messages_dropped", "MQTT messages not applied (bad payload, unknown topic or error)")
+message_seconds = metrics.histogram("mqtt_message_seconds", "Time to spool one MQTT message on the network thread")
+db_commit_seconds = metrics.histogram("db_commit_seconds", "Latency of database commits on the ingest path")
+readings_stored = metrics.counter("ingest_readings_stored", "Sensor readings written to the database")
+
+late_dropped = metrics.counter("ingest_late_dropped", "Readings older than the lateness window, dropped")
+duplicates = metrics.counter("ingest_duplicates", "Readings already stored for the same device and timestamp")
+
+devices = Device.__table__
+readings = SensorReading.__table__
+checkpoints = IngestCheckpoint.__table__
+# Newest state of a device, one executemany per batch
+update_state = (
+    update(devices)
+    .where(devices.c.id == bindparam("b_id"))
+    .values(value=bindparam("b_value"), status=bindparam("b_status"), last_updated=bindparam("b_updated"))
+)
+
+# Name of this client's row in ingest_checkpoints
+CHECKPOINT = 'mqtt'
+# Commands this client publishes; home/# delivers them back to it
+CONTROL_SUFFIX = '/control'
+# Seconds a reading may arrive after its device timestamp and still be stored
+LATENESS_WINDOW = float(os.getenv('LATENESS_WINDOW', 3600))
+# Device timestamps further ahead of the receive time than this are not trusted
+MAX_CLOCK_SKEW = 300
+
+def parse_value(value):
+    return float(value) if str(value).replace('.', '').isdigit() else 0
+
+def reading_time(payload, received):
+    """The device's timestamp for a message, falling back to the receive time"""
+    stamp = payload.get('timestamp')
+    try:
+        if isinstance(stamp, (int, float)):
+            timestamp = datetime.fromtimestamp(stamp)
+        elif stamp:
+            timestamp = datetime.fromisoformat(stamp)
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+        else:
+            return received
+    except (TypeError, ValueError, OverflowError, OSError):
+        return received
+    if (timestamp - received).total_seconds() > MAX_CLOCK_SKEW:
+        return received
+    return timestamp
+
+def save_checkpoint(conn, seq):
+    conn.execute(
+        sqlite_insert(checkpoints)
+        .values(name=CHECKPOINT, seq=seq)
+        .on_conflict_do_update(index_elements=["name"], set_={"seq": seq})
+    )
+
 class MQTTClient:
     def __init__(self, callback=None):
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        # Called with the list of records.Reading stored by each batch
         self.callback = callback
+        # Ingest's view of the devices, loaded at start and on first message per new topic
+        self.devices = {}        # mqtt topic -> DeviceInfo
+        self.last_updated = {}   # device id -> newest stored reading time
+        # Control commands, confirmed by the state the device publishes back
+        self.commands = CommandDispatcher(self.publish)
+        # Online/offline state, written to the database in batches
+        self.liveness = LivenessTracker()
+        # Messages are spooled to disk first and stored by a committer thread
+        self.spool = Spool(self.store_batch, skip=self.skip_records)
         
         # Get MQTT credentials from environment variables
         self.mqtt_broker = os.getenv('MQTT_BROKER', 'localhost')
@@ -20,16 +97,34 @@ class MQTTClient:
         self.mqtt_username = os.getenv('MQTT_USERNAME')
         self.mqtt_password = os.getenv('MQTT_PASSWORD')
 
+    def start_ingest(self):
+        """Open the spool, replaying anything not yet stored, and start storing"""
+        with get_engine().connect() as conn:
+            committed = conn.execute(
+                select(checkpoints.c.seq).where(checkpoints.c.name == CHECKPOINT)
+            ).scalar() or 0
+            # Known before the first message, so arrivals can be matched without the database
+            self.lookup_devices(conn, conn.execute(
+                select(devices.c.mqtt_topic).where(devices.c.mqtt_topic.is_not(None))
+            ).scalars().all())
+        self.spool.open(committed)
+        self.spool.start()
+
     def connect(self):
         if self.mqtt_username and self.mqtt_password:
             self.client.username_pw_set(self.mqtt_username, self.mqtt_password)
         
         self.client.connect(self.mqtt_broker, self.mqtt_port, 60)
+        self.start_ingest()
         self.client.loop_start()
+        self.liveness.start()
 
     def disconnect(self):
         self.client.loop_stop()
         self.client.disconnect()
+        self.spool.stop()
+        self.commands.stop()
+        self.liveness.stop()
 
     def on_connect(self, client, userdata, flags, rc):
         print(f"Connected with result code {rc}")
@@ -37,29 +132,172 @@ class MQTTClient:
         client.subscribe("home/#")
 
     def on_message(self, client, userdata, msg):
+        # No database work happens here, so a busy database never stalls the network loop
+        if msg.topic.endswith(CONTROL_SUFFIX):
+            return
+        messages_received.inc()
+        started = time.perf_counter()
+        try:
+            self.spool.append(msg.topic, msg.payload)
+        except Exception as e:
+            messages_dropped.inc()
+            print(f"Error spooling message: {e}")
         try:
-            payload = json.loads(msg.payload.decode())
-            topic = msg.topic
-            
-            # Update device in database
-            session = get_session()
-            device = session.query(Device).filter_by(mqtt_topic=topic).first()
-            
-            if device:
-                device.value = str(payload.get('value', ''))
-                device.status = payload.get('status', 'Unknown')
-                device.is_online = True
-                device.last_updated = datetime.now()
-                session.commit()
-                
-                # Notify UI if callback is provided
-                if self.callback:
-                    self.callback(device)
-            
-            session.close()
-            
+            self.on_arrival(msg.topic, msg.payload)
         except Exception as e:
             print(f"Error processing message: {e}")
+        message_seconds.observe(time.perf_counter() - started)
+
+    def on_arrival(self, topic, payload):
+        """Mark the device online and confirm pending commands as a state arrives
+
+        Uses the cached devices only; a topic not seen by the committer yet
+        is picked up once its first batch is stored. States older than the
+        device's newest stored reading neither confirm nor revive it.
+        """
+        device = self.devices.get(topic)
+        if device is None:
+            return
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return
+        if not isinstance(payload, dict):
+            return
+        received = datetime.now()
+        timestamp = reading_time(payload, received)
+        last = self.last_updated.get(device.id)
+        if (received - timestamp).total_seconds() > LATENESS_WINDOW or (last is not None and timestamp < last):
+            return
+        self.commands.handle_state(topic, payload)
+        self.liveness.seen(device.id, device.type)
+
+    def lookup_devices(self, conn, topics):
+        """DeviceInfo for topics not cached yet; also seeds their newest timestamps"""
+        missing = [topic for topic in topics if topic not in self.devices]
+        if not missing:
+            return
+        rows = conn.execute(
+            select(devices.c.id, devices.c.user_id, devices.c.type, devices.c.name,
+                   devices.c.mqtt_topic, devices.c.location, devices.c.last_updated)
+            .where(devices.c.mqtt_topic.in_(missing))
+            .order_by(devices.c.id.desc())
+        )
+        for device_id, user_id, device_type, name, topic, location, last_updated in rows:
+            # The lowest id wins when several devices share a topic
+            self.devices[topic] = DeviceInfo(device_id, user_id, device_type, name, topic, location)
+            self.last_updated[device_id] = last_updated
+
+    def skip_records(self, seq):
+        """Move the checkpoint past a quarantined record without storing it"""
+        with get_engine().connect() as conn:
+            save_checkpoint(conn, seq)
+            conn.commit()
+
+    def store_batch(self, records):
+        """Store spooled (seq, received, topic, payload) records in one transaction
+
+        Readings are stamped with the device's timestamp and inserted with
+        ON CONFLICT DO NOTHING on (device_id, timestamp), so redelivered
+        and retained messages are stored once. Readings older than
+        LATENESS_WINDOW at arrival are dropped; later ones that are older
+        than the device's current state are stored but leave the state
+        alone. Device state, readings, their hourly location rollups and
+        the spool checkpoint are committed together, so a batch that is
+        retried or replayed after a crash is never stored twice. Raises if nothing could be stored.
+
+        A payload that is not a JSON object is dropped and counted; value
+        and status are stored as text whatever JSON type they arrive as.
+
+        Only Core statements are used and cached DeviceInfo records are
+        passed on, so no ORM objects are built per message. Liveness and
+        command acknowledgements are handled on arrival, not here.
+        """
+        messages = []
+        for seq, received, topic, payload in records:
+            try:
+                payload = json.loads(payload)
+            except ValueError as e:
+                messages_dropped.inc()
+                print(f"Error processing message: {e}")
+                continue
+            if not isinstance(payload, dict):
+                messages_dropped.inc()
+                print(f"Error processing message on {topic}: payload is not a JSON object")
+                continue
+            messages_decoded.inc()
+            # Stored as text whatever JSON type the device sent
+            state = (str(payload.get('value', '')), str(payload.get('status', 'Unknown')))
+            received = datetime.fromtimestamp(received)
+            timestamp = reading_time(payload, received)
+            if (received - timestamp).total_seconds() > LATENESS_WINDOW:
+                late_dropped.inc()
+                continue
+            messages.append((topic, state, timestamp))
+
+        with get_engine().connect() as conn:
+            self.lookup_devices(conn, {topic for topic, _, _ in messages})
+
+            candidates = []
+            rows = []
+            for topic, state, timestamp in messages:
+                device = self.devices.get(topic)
+                if device is None:
+                    messages_dropped.inc()
+                    continue
+                value = parse_value(state[0])
+                rows.append({"device_id": device.id, "value": value, "timestamp": timestamp})
+                candidates.append((state, device, timestamp, value))
+
+            inserted = set()
+            if rows:
+                result = conn.execute(
+                    sqlite_insert(readings).on_conflict_do_nothing(index_elements=["device_id", "timestamp"])
+                    .returning(readings.c.device_id, readings.c.timestamp),
+                    rows,
+                )
+                inserted = set(result.tuples())
+
+            stored = []
+            newest = {}  # device id -> (timestamp, state) of its newest reading in the batch
+            for state, device, timestamp, value in candidates:
+                key = (device.id, timestamp)
+                if key not in inserted:
+                    duplicates.inc()
+                    continue
+                inserted.discard(key)  # a repeat within the batch is a duplicate too
+                current = newest.get(device.id)
+                last = current[0] if current else self.last_updated.get(device.id)
+                late = last is not None and timestamp < last
+                if not late:
+                    newest[device.id] = (timestamp, state)
+                stored.append(Reading(device, timestamp, value, late))
+
+            if newest:
+                conn.execute(update_state, [
+                    {"b_id": device_id, "b_value": value, "b_status": status, "b_updated": timestamp}
+                    for device_id, (timestamp, (value, status)) in newest.items()
+                ])
+            rollup_rows = hourly_rows(stored)
+            if rollup_rows:
+                conn.execute(upsert_rollups, rollup_rows)
+            save_checkpoint(conn, records[-1][0])
+            with db_commit_seconds.time():
+                conn.commit()
+
+        for device_id, (timestamp, _) in newest.items():
+            self.last_updated[device_id] = timestamp
+        readings_stored.inc(len(stored))
+        if stored:
+            # Late or replayed readings may land in a day already exported for analytics
+            storage.written(min(r.timestamp for r in stored), max(r.timestamp for r in stored))
+
+        # Notify UI if callback is provided, once with the whole batch
+        if self.callback and stored:
+            try:
+                self.callback(stored)
+            except Exception as e:
+                print(f"Error processing batch: {e}")
 
     def publish(self, topic, message):
         """Publish a message to a specific topic"""
@@ -0,0 +1,287 @@
+"""Record live MQTT traffic to a compact binary log and replay it.
+
+The log is append-only. It starts with a header (magic, format version,
+wall-clock start time); after that, every record is a 10-byte header
+(microseconds since the previous record, topic id, payload length)
+followed by the raw payload. A topic is written out in full once, in a
+definition record with topic id NEW_TOPIC, and later records refer to it
+by number. A record cut short by a crash is ignored on reading.
+
+Replay keeps the recorded gaps between messages, divided by the speed
+factor, so bursts and quiet periods keep their shape. Messages go either
+to the broker (the app receives them like live traffic) or straight into
+the app's ingest pipeline, without a broker.
+
+The app stores readings by the device's timestamp and drops those older
+than LATENESS_WINDOW, so by default a replayed payload's "timestamp" is
+moved forward by as much as the message's receive time: a reading keeps
+the lateness it was recorded with, however old the recording is, and a
+second replay stores new readings instead of duplicates. Pass
+--keep-timestamps to send the payloads exactly as recorded.
+
+    python mqtt_recorder.py record traffic.mqr --duration 3600
+    python mqtt_recorder.py info traffic.mqr
+    python mqtt_recorder.py replay traffic.mqr --speed 10
+    python mqtt_recorder.py replay traffic.mqr --speed max --target ingest
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAGIC = b"MQTTREC"
+VERSION = 1
+FILE_HEADER = struct.Struct("<7sBd")   # magic, version, start time (epoch seconds)
+RECORD_HEADER = struct.Struct("<IHI")  # gap in microseconds, topic id, payload length
+NEW_TOPIC = 0xFFFF
+MAX_GAP_US = 0xFFFFFFFF  # longer silences (over ~71 minutes) are shortened to this
+FLUSH_INTERVAL = 1.0
+
+
+class Message:
+    """A recorded message, shaped like paho's MQTTMessage for on_message"""
+
+    __slots__ = ("topic", "payload", "offset")
+
+    def __init__(self, topic, payload, offset):
+        self.topic = topic
+        self.payload = payload
+        self.offset = offset  # seconds since the start of the recording
+
+
+class LogWriter:
+    def __init__(self, path, start=None):
+        self.file = open(path, "wb")
+        self.start = time.time() if start is None else start
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, self.start))
+        self.last = self.start
+        self.topics = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, topic, payload, received=None):
+        received = time.time() if received is None else received
+        with self.lock:
+            topic_id = self.topics.get(topic)
+            if topic_id is None:
+                if len(self.topics) == NEW_TOPIC:
+                    raise ValueError(f"a recording holds at most {NEW_TOPIC} topics, {topic} is one more")
+                topic_id = self.topics[topic] = len(self.topics)
+                name = topic.encode("utf-8")
+                self.file.write(RECORD_HEADER.pack(0, NEW_TOPIC, len(name)) + name)
+            elapsed = round((received - self.last) * 1_000_000)
+            gap = min(MAX_GAP_US, max(0, elapsed))
+            # Offsets add up exactly; after a shortened silence the next gap starts from the real time
+            self.last = received if elapsed > MAX_GAP_US else self.last + gap / 1_000_000
+            self.file.write(RECORD_HEADER.pack(gap, topic_id, len(payload)) + payload)
+            self.count += 1
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_log(path):
+    """(start time, iterator of Message) for a recording"""
+    f = open(path, "rb")
+    header = f.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        f.close()
+        raise ValueError(f"{path} is not an MQTT recording")
+    magic, version, start = FILE_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        f.close()
+        raise ValueError(f"{path} is not an MQTT recording (version {VERSION})")
+
+    def messages():
+        topics = []
+        offset_us = 0
+        with f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                gap, topic_id, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return  # truncated tail of an interrupted recording
+                if topic_id == NEW_TOPIC:
+                    topics.append(payload.decode("utf-8"))
+                    continue
+                offset_us += gap
+                yield Message(topics[topic_id], payload, offset_us / 1_000_000)
+
+    return start, messages()
+
+
+def mqtt_connect(client):
+    username = os.getenv('MQTT_USERNAME')
+    password = os.getenv('MQTT_PASSWORD')
+    if username and password:
+        client.username_pw_set(username, password)
+    client.connect(os.getenv('MQTT_BROKER', 'localhost'), int(os.getenv('MQTT_PORT', 1883)), 60)
+
+
+def record(path, topic="home/#", duration=None):
+    import paho.mqtt.client as mqtt
+
+    writer = LogWriter(path)
+    client = mqtt.Client()
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(topic)
+    client.on_message = lambda c, userdata, msg: writer.write(msg.topic, msg.payload)
+    mqtt_connect(client)
+    client.loop_start()
+    print(f"Recording {topic} to {path}, Ctrl+C to stop")
+    deadline = time.monotonic() + duration if duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(FLUSH_INTERVAL)
+            writer.flush()
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    writer.close()
+    print(f"Recorded {writer.count} messages, {os.path.getsize(path):,} bytes")
+
+
+def shift_timestamp(payload, seconds):
+    """A JSON payload with its "timestamp" moved by `seconds`, in the same format
+
+    Payloads without a usable timestamp are returned unchanged.
+    """
+    try:
+        data = json.loads(payload)
+        stamp = data["timestamp"]
+        if isinstance(stamp, (int, float)) and not isinstance(stamp, bool):
+            data["timestamp"] = stamp + seconds
+        else:
+            data["timestamp"] = (datetime.fromisoformat(stamp) + timedelta(seconds=seconds)).isoformat()
+    except (ValueError, TypeError, KeyError, OverflowError):
+        return payload
+    return json.dumps(data).encode()
+
+
+def replay(messages, deliver, speed=1.0, start=None):
+    """Call deliver(message) for each message at `speed` times the recorded pace
+
+    speed=None replays as fast as possible. With `start`, the recording's
+    start time, each payload's timestamp is shifted by the time between
+    the message's recorded receipt and its delivery. Returns (count,
+    elapsed seconds, worst lag behind schedule in seconds).
+    """
+    count = 0
+    worst_lag = 0.0
+    started = time.perf_counter()
+    for message in messages:
+        if speed:
+            due = started + message.offset / speed
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            else:
+                worst_lag = max(worst_lag, now - due)
+        if start is not None:
+            message.payload = shift_timestamp(message.payload, time.time() - (start + message.offset))
+        deliver(message)
+        count += 1
+    return count, time.perf_counter() - started, worst_lag
+
+
+def broker_target():
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client()
+    mqtt_connect(client)
+    client.loop_start()
+
+    def deliver(message):
+        client.publish(message.topic, message.payload)
+
+    def close():
+        client.loop_stop()
+        client.disconnect()
+
+    return deliver, close
+
+
+def ingest_target():
+    """Feed messages to the app's MQTT handler and ingest hub, without a broker"""
+    from ingest_hub import hub
+
+    hub.start(connect=False)
+    client = hub.mqtt_client
+
+    def deliver(message):
+        client.on_message(None, None, message)
+
+    def close():
+        # Wait for the spool to store everything delivered so far
+        client.spool.stop(timeout=None)
+        client.commands.stop()
+        client.liveness.flush()
+
+    return deliver, close
+
+
+def info(path):
+    start, messages = read_log(path)
+    count = 0
+    topics = set()
+    last = 0.0
+    for message in messages:
+        count += 1
+        topics.add(message.topic)
+        last = message.offset
+    print(f"{path}: {count} messages on {len(topics)} topics, "
+          f"{last:.1f} s recorded from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}")
+    if last:
+        print(f"  average {count / last:.1f} messages/s, {os.path.getsize(path) / max(count, 1):.0f} bytes/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay MQTT traffic")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Record live traffic")
+    rec.add_argument("path")
+    rec.add_argument("--topic", default="home/#")
+    rec.add_argument("--duration", type=float, help="Seconds to record (default: until Ctrl+C)")
+    rep = sub.add_parser("replay", help="Play a recording back")
+    rep.add_argument("path")
+    rep.add_argument("--speed", default="1", help="Speed factor, e.g. 1, 10 or max")
+    rep.add_argument("--target", choices=("broker", "ingest"), default="broker")
+    rep.add_argument("--keep-timestamps", action="store_true",
+                     help="Send the recorded device timestamps instead of shifting them to replay time")
+    show = sub.add_parser("info", help="Summarise a recording")
+    show.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path, args.topic, args.duration)
+    elif args.command == "info":
+        info(args.path)
+    else:
+        speed = None if args.speed == "max" else float(args.speed)
+        deliver, close = broker_target() if args.target == "broker" else ingest_target()
+        start, messages = read_log(args.path)
+        try:
+            count, elapsed, lag = replay(messages, deliver, speed, None if args.keep_timestamps else start)
+        finally:
+            close()
+        print(f"Replayed {count} messages in {elapsed:.1f} s ({count / max(elapsed, 1e-9):,.0f} messages/s), "
+              f"worst lag {lag * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
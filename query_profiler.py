@@ -0,0 +1,217 @@
+"""Opt-in SQL profiler: per-query statistics, slow-query log and N+1 detection.
+
+Enabled by setting QUERY_PROFILE=1 before the app starts; models.get_engine()
+then installs the hooks on the engine. Every statement is timed and
+aggregated by its normalized SQL (literals and IN lists collapsed to ?)
+and by the line of application code that issued it. A report sorted by
+total time is printed on exit.
+
+    QUERY_PROFILE=1 python main.py
+    QUERY_PROFILE=1 SLOW_QUERY_MS=20 QUERY_PROFILE_REPORT=queries.txt python main.py
+
+A statement whose time exceeds SLOW_QUERY_MS is logged when it happens.
+The same statement from the same call site run N_PLUS_ONE_THRESHOLD or
+more times on one thread, never more than N_PLUS_ONE_GAP seconds apart
+(other statements may run in between), is flagged as a likely N+1
+pattern: a loop that should have been one query.
+"""
+import atexit
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
+N_PLUS_ONE_GAP = 0.05
+# Report written here instead of stderr
+QUERY_PROFILE_REPORT = os.getenv('QUERY_PROFILE_REPORT')
+
+SQLALCHEMY_DIR = os.path.dirname(sqlalchemy.__file__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(statement):
+    """SQL with whitespace collapsed and literals and IN lists replaced by ?"""
+    sql = _SPACE.sub(" ", statement).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _IN_LIST.sub("(?...)", sql)
+
+
+def call_site():
+    """file:line (function) of the innermost frame outside SQLAlchemy and this module"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(SQLALCHEMY_DIR) and filename != __file__ and not filename.startswith("<sqlalchemy"):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "?"
+
+
+class QueryStats:
+    __slots__ = ("sql", "site", "count", "total", "rows", "times", "slow", "n_plus_one", "max_run")
+
+    def __init__(self, sql, site):
+        self.sql = sql
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.times = Histogram(sql, "")
+        self.slow = 0
+        self.n_plus_one = 0  # bursts flagged as N+1
+        self.max_run = 0     # most executions in one burst
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms=SLOW_QUERY_MS, n_plus_one=N_PLUS_ONE_THRESHOLD, gap=N_PLUS_ONE_GAP):
+        self.slow = slow_ms / 1000
+        self.n_plus_one = n_plus_one
+        self.gap = gap
+        self.stats = {}  # (normalized sql, call site) -> QueryStats
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+        event.listen(engine, "handle_error", self.on_error)
+        event.listen(Session, "do_orm_execute", self.count_rows)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        key = (normalize(statement), call_site())
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = QueryStats(*key)
+            stats.count += 1
+            stats.total += elapsed
+            if cursor.rowcount > 0:
+                # Rows changed by INSERT/UPDATE/DELETE; SELECTs are counted in count_rows
+                stats.rows += cursor.rowcount
+            if elapsed >= self.slow:
+                stats.slow += 1
+        stats.times.observe(elapsed)
+        self.local.last = stats
+
+        if elapsed >= self.slow:
+            logger.warning("Slow query %.1f ms at %s: %s %r", elapsed * 1000, key[1],
+                           key[0][:300], parameters if not executemany else f"{len(parameters)} rows")
+        self.check_run(stats)
+
+    def on_error(self, context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+
+    def check_run(self, stats):
+        """Track bursts of one statement on this thread"""
+        now = time.perf_counter()
+        runs = getattr(self.local, "runs", None)
+        if runs is None:
+            runs = self.local.runs = {}  # QueryStats -> [executions in burst, last execution]
+        run = runs.get(stats)
+        if run is not None and now - run[1] <= self.gap:
+            run[0] += 1
+            run[1] = now
+        else:
+            run = runs[stats] = [1, now]
+        if run[0] > stats.max_run:
+            stats.max_run = run[0]
+        if run[0] == self.n_plus_one:
+            with self.lock:
+                stats.n_plus_one += 1
+            logger.warning("Possible N+1: %s ran %d+ times in quick succession at %s",
+                           stats.sql[:200], run[0], stats.site)
+
+    def count_rows(self, state):
+        """Count the rows an ORM SELECT returns by buffering its result"""
+        if not state.is_select or state.execution_options.get("yield_per") \
+                or state.execution_options.get("stream_results"):
+            return None
+        self.local.last = None
+        frozen = state.invoke_statement().freeze()
+        stats = self.local.last
+        if stats is not None:
+            rows = len(frozen.data)
+            with self.lock:
+                stats.rows += rows
+        return frozen()
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.local = threading.local()
+            self.started = time.perf_counter()
+
+    def report(self, limit=30):
+        """Text table of the most expensive queries by total time"""
+        with self.lock:
+            stats = sorted(self.stats.values(), key=lambda s: s.total, reverse=True)
+        elapsed = time.perf_counter() - self.started
+        queries = sum(s.count for s in stats)
+        total = sum(s.total for s in stats)
+        lines = [
+            f"Query profile: {queries} queries, {total * 1000:.0f} ms in SQL over {elapsed:.0f} s "
+            f"({len(stats)} distinct statement/call-site pairs)",
+            f"{'count':>7} {'total ms':>9} {'mean ms':>8} {'p99 ms':>8} {'rows':>8}  flags  call site / SQL",
+        ]
+        for s in stats[:limit]:
+            flags = []
+            if s.n_plus_one:
+                flags.append(f"N+1 x{s.n_plus_one} (burst {s.max_run})")
+            if s.slow:
+                flags.append(f"slow x{s.slow}")
+            lines.append(
+                f"{s.count:>7} {s.total * 1000:>9.1f} {s.total / s.count * 1000:>8.2f} "
+                f"{s.times.quantile(0.99) * 1000:>8.2f} {s.rows:>8}  {', '.join(flags) or '-'}  {s.site}"
+            )
+            lines.append(f"{'':>45}{s.sql[:160]}")
+        suspects = [s for s in stats if s.n_plus_one]
+        if suspects:
+            lines.append("Likely N+1 patterns (batch these into one query):")
+            for s in suspects:
+                lines.append(f"  {s.site}: {s.count} runs, largest burst {s.max_run}: {s.sql[:120]}")
+        return "\n".join(lines)
+
+    def dump(self):
+        text = self.report()
+        if QUERY_PROFILE_REPORT:
+            with open(QUERY_PROFILE_REPORT, "w") as f:
+                f.write(text + "\n")
+        else:
+            print(text, file=sys.stderr)
+
+
+profiler = None
+
+
+def install(engine):
+    """Profile every statement run on `engine` and report at exit"""
+    global profiler
+    if profiler is None:
+        profiler = QueryProfiler()
+        atexit.register(profiler.dump)
+    profiler.install(engine)
+    return profiler
@@ -0,0 +1,201 @@
+"""In-memory cache of recent sensor readings per (device_id, window).
+
+Each cached window holds its readings as two compact NumPy arrays
+(datetime64[us] timestamps and float64 values). New readings from the
+ingest path are appended to every cached window of their device, and the
+head of a window is trimmed when it is read and as readings are appended,
+so a window stays valid without ever going back to the database and an
+unread window holds no more than its span.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import metrics
+from models import SensorReading
+
+# Cached (device_id, hours) windows kept before least recently used ones are dropped
+MAX_ENTRIES = 256
+INITIAL_CAPACITY = 64
+
+
+class _Window:
+    """Growable sorted buffer of (timestamp, value) pairs"""
+
+    __slots__ = ("timestamps", "values", "start", "end")
+
+    def __init__(self, timestamps, values):
+        capacity = max(INITIAL_CAPACITY, 2 * len(values))
+        self.timestamps = np.empty(capacity, dtype="datetime64[us]")
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.start = 0
+        self.end = len(values)
+        self.timestamps[:self.end] = timestamps
+        self.values[:self.end] = values
+
+    def _make_room(self):
+        size = self.end - self.start
+        if self.start and size <= len(self.values) // 2:
+            # Plenty of trimmed space at the head, shift the data down
+            self.timestamps[:size] = self.timestamps[self.start:self.end]
+            self.values[:size] = self.values[self.start:self.end]
+        else:
+            capacity = 2 * len(self.values)
+            timestamps = np.empty(capacity, dtype="datetime64[us]")
+            values = np.empty(capacity, dtype=np.float64)
+            timestamps[:size] = self.timestamps[self.start:self.end]
+            values[:size] = self.values[self.start:self.end]
+            self.timestamps, self.values = timestamps, values
+        self.start, self.end = 0, size
+
+    def append(self, timestamp, value):
+        if self.end == len(self.values):
+            self._make_room()
+        if self.end > self.start and timestamp < self.timestamps[self.end - 1]:
+            # Late reading, keep the buffer sorted
+            i = self.start + int(np.searchsorted(self.timestamps[self.start:self.end], timestamp, "right"))
+            self.timestamps[i + 1:self.end + 1] = self.timestamps[i:self.end]
+            self.values[i + 1:self.end + 1] = self.values[i:self.end]
+        else:
+            i = self.end
+        self.timestamps[i] = timestamp
+        self.values[i] = value
+        self.end += 1
+
+    def newest(self):
+        return self.timestamps[self.end - 1]
+
+    def trim(self, since):
+        self.start += int(np.searchsorted(self.timestamps[self.start:self.end], since, "left"))
+
+    def contains(self, timestamp):
+        i = self.start + int(np.searchsorted(self.timestamps[self.start:self.end], timestamp, "left"))
+        return i < self.end and self.timestamps[i] == timestamp
+
+    def snapshot(self):
+        return self.timestamps[self.start:self.end].copy(), self.values[self.start:self.end].copy()
+
+
+class ReadingCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.windows = OrderedDict()  # (device_id, hours) -> _Window
+        self.device_hours = {}  # device_id -> set of cached hours
+        self.loading = {}  # device_id -> lists collecting readings while a window is queried
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.appends = 0
+        self.evictions = 0
+
+    def get(self, session, device_id, hours):
+        """Return (timestamps, values) arrays for the last `hours` of a device
+
+        Returns None when the device has no readings in the window.
+        Readings added while a missing window is queried are collected and
+        merged into it, skipping those the query already returned.
+        """
+        key = (device_id, hours)
+        since = np.datetime64(datetime.now() - timedelta(hours=hours), "us")
+
+        with self.lock:
+            window = self.windows.get(key)
+            if window is not None:
+                self.hits += 1
+                self.windows.move_to_end(key)
+                window.trim(since)
+                return window.snapshot()
+            self.misses += 1
+            added = []
+            self.loading.setdefault(device_id, []).append(added)
+
+        try:
+            rows = (
+                session.query(SensorReading.timestamp, SensorReading.value)
+                .filter(
+                    SensorReading.device_id == device_id,
+                    SensorReading.timestamp >= since.astype(datetime),
+                )
+                .order_by(SensorReading.timestamp)
+                .all()
+            )
+        finally:
+            with self.lock:
+                collecting = self.loading[device_id]
+                collecting.remove(added)
+                if not collecting:
+                    del self.loading[device_id]
+
+        timestamps = np.array([r[0] for r in rows], dtype="datetime64[us]")
+        values = np.array([r[1] for r in rows], dtype=np.float64)
+        with self.lock:
+            window = _Window(timestamps, values)
+            # Readings are unique per (device, timestamp), so a known timestamp is a repeat
+            for timestamp, value in added:
+                if timestamp >= since and not window.contains(timestamp):
+                    window.append(timestamp, value)
+            if window.end == 0:
+                return None
+            self.windows[key] = window
+            self.device_hours.setdefault(device_id, set()).add(hours)
+            while len(self.windows) > self.max_entries:
+                self._remove(next(iter(self.windows)))
+                self.evictions += 1
+            return window.snapshot()
+
+    def _remove(self, key):
+        del self.windows[key]
+        device_id, hours = key
+        cached = self.device_hours[device_id]
+        cached.discard(hours)
+        if not cached:
+            del self.device_hours[device_id]
+
+    def add_reading(self, device_id, timestamp, value):
+        """Extend every cached window of a device with a newly stored reading
+
+        Readings further behind the window's newest one than its span are
+        dropped from the head, so a window that is never read stays bounded.
+        """
+        timestamp = np.datetime64(timestamp, "us")
+        with self.lock:
+            for hours in self.device_hours.get(device_id, ()):
+                window = self.windows[(device_id, hours)]
+                window.append(timestamp, value)
+                window.trim(window.newest() - np.timedelta64(hours, "h"))
+                self.appends += 1
+            for added in self.loading.get(device_id, ()):
+                added.append((timestamp, value))
+
+    def invalidate(self, device_id=None):
+        """Drop cached windows for one device, or for all devices"""
+        with self.lock:
+            if device_id is None:
+                self.windows.clear()
+                self.device_hours.clear()
+                return
+            for hours in list(self.device_hours.get(device_id, ())):
+                self._remove((device_id, hours))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.windows),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "appends": self.appends,
+                "evictions": self.evictions,
+            }
+
+
+# Process-wide cache shared by the chart views and the ingest path
+reading_cache = ReadingCache()
+
+metrics.gauge("reading_cache_hit_ratio", "Share of chart window lookups served from memory",
+              fn=lambda: reading_cache.stats()["hit_rate"])
+metrics.gauge("reading_cache_entries", "Cached (device, window) entries",
+              fn=lambda: len(reading_cache.windows))
@@ -0,0 +1,40 @@
+"""Value objects carried through the ingest pipeline.
+
+The MQTT -> database -> hub -> dashboard path handles every message, so
+it passes these small __slots__ records instead of SQLAlchemy objects:
+no identity map, instance state or attribute instrumentation per
+message, and nothing that can expire or detach when a session closes.
+They are built once and not modified afterwards.
+"""
+
+
+class DeviceInfo:
+    """What ingest needs to know about a device, cached per MQTT topic"""
+
+    __slots__ = ("id", "user_id", "type", "name", "topic", "location")
+
+    def __init__(self, id, user_id, type, name, topic, location=None):
+        self.id = id
+        self.user_id = user_id
+        self.type = type
+        self.name = name
+        self.topic = topic
+        self.location = location
+
+    def __repr__(self):
+        return f"DeviceInfo({self.id}, {self.name!r})"
+
+
+class Reading:
+    """A stored reading; late when older than the device's newest one"""
+
+    __slots__ = ("device", "timestamp", "value", "late")
+
+    def __init__(self, device, timestamp, value, late=False):
+        self.device = device
+        self.timestamp = timestamp
+        self.value = value
+        self.late = late
+
+    def __repr__(self):
+        return f"Reading({self.device.id}, {self.timestamp}, {self.value})"
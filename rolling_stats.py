@@ -0,0 +1,275 @@
+"""Streaming windowed statistics per device.
+
+Each device keeps rolling aggregates over several time windows. Readings
+are folded into fixed-size time buckets with Welford's update; closed
+buckets are merged into the window totals with Chan's parallel combine
+and removed again with its inverse when they fall out of the window.
+Min/max over the window use monotonic deques of bucket extremes. Every
+reading is O(1) amortized and memory per device is bounded by the number
+of buckets, not the number of readings. A late reading (older than the
+newest one) is folded into the bucket it belongs to while that bucket is
+still inside the window.
+"""
+import math
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from sensor_data import get_bucket_stats
+
+# Windows maintained per device: name -> (span seconds, bucket seconds)
+WINDOWS = {
+    "1h": (3600, 60),
+    "24h": (24 * 3600, 15 * 60),
+    "7d": (7 * 24 * 3600, 3600),
+}
+
+# Timestamps are naive local times; buckets are aligned on seconds since this
+EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+class _Bucket:
+    __slots__ = ("start", "count", "mean", "m2", "min", "max")
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+
+class RollingWindow:
+    __slots__ = ("span", "bucket_span", "closed", "open", "count", "mean", "m2", "mins", "maxs")
+
+    def __init__(self, span, bucket_span):
+        self.span = span
+        self.bucket_span = bucket_span
+        self.closed = deque()  # closed buckets, oldest first
+        self.open = None       # bucket currently receiving readings
+        # Totals over the closed buckets
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.mins = deque()    # (start, min) with increasing mins
+        self.maxs = deque()    # (start, max) with decreasing maxes
+
+    def add(self, ts, value):
+        start = ts - ts % self.bucket_span
+        if self.open is not None and self.open.start != start:
+            self._close()
+        if self.open is None:
+            self.open = _Bucket(start)
+        self.open.add(value)
+        self.expire(ts)
+
+    def seed(self, bucket):
+        """Append a pre-aggregated bucket; seeds must arrive oldest first"""
+        if self.open is not None:
+            self._close()
+        self.open = bucket
+
+    def _close(self):
+        bucket, self.open = self.open, None
+        self.count, self.mean, self.m2 = _combine(
+            self.count, self.mean, self.m2, bucket.count, bucket.mean, bucket.m2
+        )
+        self.closed.append(bucket)
+        self._push_extremes(bucket)
+
+    def _push_extremes(self, bucket):
+        while self.mins and self.mins[-1][1] > bucket.min:
+            self.mins.pop()
+        self.mins.append((bucket.start, bucket.min))
+        while self.maxs and self.maxs[-1][1] < bucket.max:
+            self.maxs.pop()
+        self.maxs.append((bucket.start, bucket.max))
+
+    def add_late(self, ts, value, now):
+        """Fold in a reading older than the newest one, if still in the window
+
+        The reading's bucket is updated (or created) in place and the
+        window totals are combined with the single value; min/max deques
+        are rebuilt from the closed buckets, at most a few hundred.
+        """
+        start = ts - ts % self.bucket_span
+        if self.open is None or start > self.open.start:
+            self.add(ts, value)
+            return
+        if start == self.open.start:
+            self.open.add(value)
+            return
+        if start + self.bucket_span <= now - self.span:
+            return  # already out of the window
+
+        position = len(self.closed)
+        while position and self.closed[position - 1].start > start:
+            position -= 1
+        if position and self.closed[position - 1].start == start:
+            self.closed[position - 1].add(value)
+        else:
+            bucket = _Bucket(start)
+            bucket.add(value)
+            self.closed.insert(position, bucket)
+        self.count, self.mean, self.m2 = _combine(self.count, self.mean, self.m2, 1, value, 0.0)
+        self.mins.clear()
+        self.maxs.clear()
+        for bucket in self.closed:
+            self._push_extremes(bucket)
+
+    def expire(self, now):
+        cutoff = now - self.span
+        if self.open is not None and self.open.start + self.bucket_span <= cutoff:
+            self._close()
+        while self.closed and self.closed[0].start + self.bucket_span <= cutoff:
+            bucket = self.closed.popleft()
+            n = self.count - bucket.count
+            if n == 0:
+                self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            else:
+                # Inverse of _combine
+                mean = (self.count * self.mean - bucket.count * bucket.mean) / n
+                delta = bucket.mean - mean
+                self.m2 -= bucket.m2 + delta * delta * n * bucket.count / self.count
+                self.count, self.mean = n, mean
+            if self.mins and self.mins[0][0] == bucket.start:
+                self.mins.popleft()
+            if self.maxs and self.maxs[0][0] == bucket.start:
+                self.maxs.popleft()
+
+    def snapshot(self):
+        count, mean, m2 = self.count, self.mean, self.m2
+        low = self.mins[0][1] if self.mins else math.inf
+        high = self.maxs[0][1] if self.maxs else -math.inf
+        if self.open is not None:
+            count, mean, m2 = _combine(count, mean, m2, self.open.count, self.open.mean, self.open.m2)
+            low = min(low, self.open.min)
+            high = max(high, self.open.max)
+        if count == 0:
+            return None
+        return {
+            "count": count,
+            "mean": mean,
+            "stddev": math.sqrt(max(m2, 0.0) / count),
+            "min": low,
+            "max": high,
+        }
+
+
+class DeviceStats:
+    """Rolling aggregates for one device over every window in WINDOWS"""
+
+    __slots__ = ("windows", "last_ts", "warmed")
+
+    def __init__(self, warmed=-math.inf):
+        self.windows = {name: RollingWindow(*spans) for name, spans in WINDOWS.items()}
+        self.last_ts = None
+        self.warmed = warmed  # readings before this were seeded from the database
+
+    def add(self, ts, value):
+        if self.last_ts is not None and ts < self.last_ts:
+            # Out of order: update the bucket it belongs to, if still in the window
+            for window in self.windows.values():
+                window.add_late(ts, value, self.last_ts)
+            return
+        self.last_ts = ts
+        for window in self.windows.values():
+            window.add(ts, value)
+
+
+class StatsRegistry:
+    def __init__(self):
+        self.devices = {}  # device_id -> DeviceStats
+        self.loading = {}  # device_id -> readings collected while it is being warmed
+        self.lock = threading.Lock()
+
+    def warm(self, session, device_ids):
+        """Seed devices not warmed yet from per-bucket aggregates of their history
+
+        Runs one grouped query per window, routed like other wide scans;
+        raw readings are never loaded. The queries run outside the lock
+        and cover readings up to the moment warming started; readings
+        added from then on are collected and folded in afterwards.
+        """
+        with self.lock:
+            missing = [i for i in device_ids if i not in self.devices and i not in self.loading]
+            if not missing:
+                return
+            for device_id in missing:
+                self.loading[device_id] = []
+            now = datetime.now()
+
+        try:
+            seeded = {device_id: DeviceStats(_seconds(now)) for device_id in missing}
+            for name, (span, bucket_span) in WINDOWS.items():
+                rows = get_bucket_stats(session, missing, now - timedelta(seconds=span), bucket_span, EPOCH, now)
+                for device_id, index, count, mean, sum_squares, low, high in rows:
+                    seed = _Bucket(index * bucket_span)
+                    seed.count, seed.mean = count, mean
+                    seed.m2 = max(sum_squares - count * mean * mean, 0.0)
+                    seed.min, seed.max = low, high
+                    seeded[device_id].windows[name].seed(seed)
+        except Exception:
+            with self.lock:
+                for device_id in missing:
+                    del self.loading[device_id]
+            raise
+
+        with self.lock:
+            for device_id, stats in seeded.items():
+                stats.last_ts = stats.warmed if any(w.open for w in stats.windows.values()) else None
+                for ts, value in self.loading.pop(device_id):
+                    if ts >= stats.warmed:
+                        stats.add(ts, value)
+                self.devices[device_id] = stats
+
+    def add_reading(self, device_id, timestamp, value):
+        """Fold in a stored reading; ignored until the device has been warmed
+
+        The reading is already in the database, so warm() picks it up with
+        the rest of the device's history. Readings from before a device was
+        warmed were seeded by it and are not counted twice.
+        """
+        ts = _seconds(timestamp)
+        with self.lock:
+            stats = self.devices.get(device_id)
+            if stats is not None:
+                if ts >= stats.warmed:
+                    stats.add(ts, value)
+            elif device_id in self.loading:
+                self.loading[device_id].append((ts, value))
+
+    def get(self, device_id, window="24h"):
+        """Aggregates of a device over a window, or None without data"""
+        with self.lock:
+            stats = self.devices.get(device_id)
+            if stats is None:
+                return None
+            rolling = stats.windows[window]
+            rolling.expire(_seconds(datetime.now()))
+            return rolling.snapshot()
+
+
+# Process-wide registry fed by the ingest path
+device_stats = StatsRegistry()
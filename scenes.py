@@ -0,0 +1,128 @@
+"""Scenes and bulk actions: one state change applied to many devices.
+
+All state changes of a scene are written with a single executemany UPDATE
+in one transaction, and the device commands are published in the
+background through the command dispatcher so the caller never waits on
+the broker.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update
+
+from command_dispatcher import COMMANDS
+from models import Device
+
+# Applied scenes kept for timing reports
+HISTORY_SIZE = 100
+
+# Bulk actions offered for each switchable device type: (label, state)
+TYPE_ACTIONS = {
+    "light": (("Turn on lights", True), ("Turn off lights", False)),
+    "curtain": (("Open curtains", True), ("Close curtains", False)),
+    "door": (("Unlock doors", True), ("Lock doors", False)),
+    "camera": (("Start cameras", True), ("Stop cameras", False)),
+}
+
+
+class Scene:
+    """Put every device of a type, optionally in one location, into a state"""
+
+    def __init__(self, name, device_type, state, location=None):
+        self.name = name
+        self.device_type = device_type
+        self.state = state
+        self.location = location
+
+    def query(self, session, user_id):
+        query = session.query(Device).filter(
+            Device.user_id == user_id,
+            Device.type == self.device_type,
+        )
+        if self.location is not None:
+            query = query.filter(Device.location == self.location)
+        return query
+
+
+def location_scenes(location, device_types):
+    """Bulk actions available for the device types present in a location"""
+    return [
+        Scene(label, device_type, state, location)
+        for device_type in sorted(set(device_types) & set(TYPE_ACTIONS))
+        for label, state in TYPE_ACTIONS[device_type]
+    ]
+
+
+class SceneRun:
+    """Timing of one applied scene; command confirmations are counted as they arrive"""
+
+    def __init__(self, scene, devices):
+        self.scene = scene
+        self.devices = devices
+        self.started = time.perf_counter()
+        self.db_ms = None
+        self.ui_ms = None
+        self.commands = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def on_command_done(self, command_id, confirmed):
+        with self.lock:
+            if confirmed:
+                self.confirmed += 1
+            else:
+                self.failed += 1
+            finished = self.confirmed + self.failed == self.commands
+        if finished:
+            elapsed = (time.perf_counter() - self.started) * 1000
+            print(f"Scene '{self.scene.name}': {self.confirmed}/{self.commands} devices confirmed in {elapsed:.0f} ms")
+
+    def summary(self):
+        return (
+            f"{self.scene.name}: {len(self.devices)} devices "
+            f"(db {self.db_ms:.0f} ms, ui {self.ui_ms or 0:.0f} ms)"
+        )
+
+
+class SceneEngine:
+    def __init__(self, session):
+        self.session = session
+        # Publishes are fanned out off the UI thread, in submission order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scene-publish")
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def apply(self, scene, user_id, dispatcher=None):
+        """Apply a scene to a user's matching devices and return its SceneRun
+
+        The caller refreshes the UI for the returned run's devices and then
+        records run.ui_ms.
+        """
+        targets = [d for d in scene.query(self.session, user_id) if d.state != scene.state]
+        run = SceneRun(scene, targets)
+
+        if targets:
+            # One executemany UPDATE in one transaction
+            self.session.execute(
+                update(Device),
+                [{"id": device.id, "state": scene.state} for device in targets],
+            )
+            self.session.commit()
+            # Reload the expired devices with a single query
+            self.session.query(Device).filter(Device.id.in_([d.id for d in targets])).all()
+        run.db_ms = (time.perf_counter() - run.started) * 1000
+
+        if dispatcher is not None:
+            publishable = [d for d in targets if d.mqtt_topic and d.type in COMMANDS]
+            run.commands = len(publishable)
+            if publishable:
+                self.executor.submit(
+                    dispatcher.send_batch,
+                    [(device, scene.state) for device in publishable],
+                    run.on_command_done,
+                )
+
+        self.history.append(run)
+        return run
@@ -0,0 +1,84 @@
+"""In-memory n-gram index for searching devices by name, location, type and topic."""
+import re
+from collections import defaultdict
+
+# Length of the character n-grams stored in the index
+NGRAM = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def ngrams(token):
+    return {token[i:i + NGRAM] for i in range(len(token) - NGRAM + 1)}
+
+
+def search_text(device):
+    """Text a device is matched against"""
+    fields = (device.name, device.location, device.type, device.mqtt_topic)
+    return " ".join(tokenize(" ".join(f for f in fields if f)))
+
+
+class DeviceSearchIndex:
+    def __init__(self):
+        self.grams = defaultdict(set)     # n-gram -> device ids
+        self.prefixes = defaultdict(set)  # token prefix shorter than NGRAM -> device ids
+        self.texts = {}                   # device_id -> search text
+
+    def add(self, device):
+        if device.id in self.texts:
+            self.remove(device.id)
+        text = search_text(device)
+        self.texts[device.id] = text
+        for token in set(text.split()):
+            for gram in ngrams(token):
+                self.grams[gram].add(device.id)
+            for length in range(1, min(NGRAM, len(token) + 1)):
+                self.prefixes[token[:length]].add(device.id)
+
+    def remove(self, device_id):
+        text = self.texts.pop(device_id, None)
+        if text is None:
+            return
+        for token in set(text.split()):
+            for gram in ngrams(token):
+                self._discard(self.grams, gram, device_id)
+            for length in range(1, min(NGRAM, len(token) + 1)):
+                self._discard(self.prefixes, token[:length], device_id)
+
+    @staticmethod
+    def _discard(postings, key, device_id):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(device_id)
+            if not ids:
+                del postings[key]
+
+    def _term_matches(self, term):
+        if len(term) < NGRAM:
+            # Short terms match the start of a word
+            return self.prefixes.get(term, set())
+
+        postings = sorted((self.grams.get(gram, set()) for gram in ngrams(term)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        # N-grams can come from different words, confirm the substring
+        return {i for i in candidates if term in self.texts[i]}
+
+    def search(self, query):
+        """Return the ids of devices matching every word of the query
+
+        Returns None for an empty query, meaning no filter.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return None
+        result = None
+        for term in sorted(terms, key=len, reverse=True):
+            matches = self._term_matches(term)
+            result = set(matches) if result is None else result & matches
+            if not result:
+                break
+        return result
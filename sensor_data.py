@@ -1,47 +1,32 @@
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')  # Set the backend before importing pyplot
-import matplotlib.pyplot as plt
-import numpy as np
 import io
 import base64
 import logging
 from models import SensorReading, SensorThreshold
+import storage
+# matplotlib and the NumPy-based modules are imported on first use; they
+# are not needed to start the app or show the login screen
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-def generate_dummy_data(device_id, hours=48):
+# Longest window offered by the chart views; dummy history is generated once
+# at this length per device and sliced for shorter windows
+DUMMY_HISTORY_HOURS = 168
+_dummy_history = {}
+
+def generate_dummy_data(device_id, hours=48, device_type="temperature", seed=None):
     """Generate dummy sensor readings for testing"""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(hours=hours)
-    
-    # Generate timestamps every 5 minutes
-    timestamps = []
-    current = start_time
-    while current <= end_time:
-        timestamps.append(current)
-        current += timedelta(minutes=5)
-    
-    # Generate random values with a realistic pattern
-    base_value = 22.0  # Base temperature for temperature sensors
-    if "humidity" in str(device_id).lower():
-        base_value = 45.0  # Base humidity for humidity sensors
-    
-    # Add daily pattern and some random noise
-    values = []
-    for ts in timestamps:
-        hour = ts.hour
-        # Daily pattern: lower at night, higher during day
-        daily_pattern = 2 * np.sin(2 * np.pi * (hour - 6) / 24)
-        noise = np.random.normal(0, 0.5)
-        value = base_value + daily_pattern + noise
-        values.append(round(value, 1))
-    
-    return timestamps, values
+    from synthetic_data import generate_history
+    _, timestamps, values = generate_history([device_id], device_type, hours, seed=seed)
+    return timestamps.tolist(), values.tolist()
 
 def create_chart_image(timestamps, values, device_type="temperature", threshold=None):
     """Create a matplotlib chart and return it as a base64 encoded image"""
+    import matplotlib
+    matplotlib.use('Agg')  # Set the backend before importing pyplot
+    import matplotlib.pyplot as plt
+
     logging.info(f"Creating chart with {len(timestamps)} data points")
     
     # Clear any existing plots
@@ -132,7 +117,7 @@ def create_chart_image(timestamps, values, device_type="temperature", threshold=
     
     return graphic
 
-def get_recent_readings(session, device_id, hours=48):
+def get_recent_readings(session, device_id, hours=48, device_type="temperature"):
     """Get recent readings or generate dummy data if no readings exist"""
     since = datetime.now() - timedelta(hours=hours)
     readings = session.query(SensorReading).filter(
@@ -141,21 +126,37 @@ def get_recent_readings(session, device_id, hours=48):
     ).order_by(SensorReading.timestamp.desc()).all()
     
     if not readings:
-        logging.info(f"No readings found for device {device_id}, generating dummy data...")
-        # Generate and return dummy data
-        timestamps, values = generate_dummy_data(device_id, hours)
-        logging.info(f"Generated {len(timestamps)} dummy readings")
-        logging.info(f"Sample values: {values[:5]}")
-        
-        dummy_readings = []
-        for ts, val in zip(timestamps, values):
-            reading = SensorReading(
-                device_id=device_id,
-                value=val,
-                timestamp=ts
-            )
-            dummy_readings.append(reading)
-        return dummy_readings
+        # Generate dummy data once per device and keep it for later views
+        generated_hours, timestamps, values = _dummy_history.get(device_id, (0, [], []))
+        if hours > generated_hours:
+            logging.info(f"No readings found for device {device_id}, generating dummy data...")
+            generated_hours = max(hours, DUMMY_HISTORY_HOURS)
+            timestamps, values = generate_dummy_data(device_id, generated_hours, device_type)
+            _dummy_history[device_id] = (generated_hours, timestamps, values)
+
+        return [
+            SensorReading(device_id=device_id, value=val, timestamp=ts)
+            for ts, val in zip(timestamps, values)
+            if ts >= since
+        ]
     
     logging.info(f"Found {len(readings)} real readings")
     return readings
+
+def get_recent_series(session, device_id, hours=48, device_type="temperature"):
+    """Get (timestamps, values) for the last `hours`, served from the reading cache"""
+    from reading_cache import reading_cache
+    series = reading_cache.get(session, device_id, hours)
+    if series is not None:
+        return series
+
+    readings = get_recent_readings(session, device_id, hours, device_type)
+    return [r.timestamp for r in readings], [r.value for r in readings]
+
+def get_bucket_stats(session, device_ids, since, bucket_seconds, origin=storage.EPOCH, until=None):
+    """Per-bucket (device_id, bucket, count, mean, sum of squares, min, max) rows, sorted
+
+    Wide scans are answered by the analytics engine when one is enabled,
+    everything else by SQLite; see storage.py.
+    """
+    return storage.buckets(session, device_ids, since, bucket_seconds, origin, until)
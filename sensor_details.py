@@ -1,5 +1,5 @@
 import flet as ft
-from sensor_data import get_recent_readings, create_chart_image
+from sensor_data import get_recent_series, create_chart_image
 from models import SensorThreshold
 from datetime import datetime
 
@@ -175,19 +175,13 @@ class SensorDetailsView:
             hours = int(self.time_dropdown.value)
             print(f"Updating chart for {hours} hours")
             
-            readings = get_recent_readings(self.session, self.device.id, hours)
-            print(f"Got {len(readings)} readings")
+            timestamps, values = get_recent_series(self.session, self.device.id, hours, self.device.type)
+            print(f"Got {len(values)} readings")
             
-            if readings:
-                timestamps = [r.timestamp for r in readings]
-                values = [r.value for r in readings]
-                
-                # Get threshold if it exists
-                threshold = self.session.query(SensorThreshold).filter_by(device_id=self.device.id).first()
-                
+            if len(values):
                 # Create chart image
                 print("Generating chart image...")
-                chart_data = create_chart_image(timestamps, values, self.device.type, threshold)
+                chart_data = create_chart_image(timestamps, values, self.device.type, self.threshold)
                 
                 # Set the image source with proper data URI
                 self.chart_image.src_base64 = chart_data
@@ -0,0 +1,348 @@
+"""Durable spool between the MQTT thread and the database.
+
+Every received message is appended to a segment file before anything
+else happens, and a committer thread drains the spool into the database
+in batches. The MQTT thread never waits on SQLite, and a locked database
+or a crash only delays readings; it never loses them.
+
+Segments are append-only files named after the sequence number of their
+first record. A record is a header (length, CRC32, sequence number,
+receive time, topic length), then the topic and the payload. Each append
+is a single unbuffered write, so it survives a crash of the process. A
+sync thread fsyncs the open segments every SPOOL_FSYNC_INTERVAL seconds,
+so an OS crash or power loss can lose at most that much. A torn record
+at the end of a segment fails its length or CRC check and is ignored.
+
+The apply callback stores a batch together with the sequence number of
+its last record, in one transaction (see MQTTClient.store_batch). On
+startup the spool replays every record after that checkpoint. A batch
+therefore lands in the database exactly once, however often it is
+retried. Segments that only hold committed records are deleted.
+
+A batch that fails QUARANTINE_AFTER times in a row is retried one record
+at a time. A record that still fails is appended to quarantine.log (same
+format as a segment, readable with read_segment) and the checkpoint moves
+past it, so one unstorable message cannot stall ingest or be replayed on
+every restart.
+
+Records wait in memory for the committer, up to SPOOL_MEMORY_RECORDS.
+Beyond that they stay on disk only and are read back once the committer
+catches up, so a long database outage costs disk space, not memory.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from dotenv import load_dotenv
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock on the spool directory
+    fcntl = None
+
+load_dotenv()
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'spool')
+# Seconds between fsyncs of the spool; also the most an OS crash can lose
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 0.05))
+SEGMENT_BYTES = 4 * 1024 * 1024
+SPOOL_MEMORY_RECORDS = 50_000
+# Records stored per database transaction
+COMMIT_BATCH = 500
+MAX_RETRY_DELAY = 5.0
+# Failed attempts at one batch before its records are tried one by one
+QUARANTINE_AFTER = 5
+
+HEADER = struct.Struct("<IIQdH")  # record length, crc32 of the rest, seq, received, topic length
+SEQ_OFFSET = 8  # the CRC covers everything from the sequence number on
+
+appended = metrics.counter("spool_appended", "Messages written to the spool")
+committed_records = metrics.counter("spool_committed", "Spooled messages committed to the database")
+commit_retries = metrics.counter("spool_commit_retries", "Failed spool batch commits, retried")
+batch_size = metrics.histogram("spool_batch_records", "Records per spool commit", scale=1)
+fsync_seconds = metrics.histogram("spool_fsync_seconds", "Time to fsync the spool")
+quarantined = metrics.counter("spool_quarantined", "Spooled messages that could not be stored, set aside")
+
+
+def encode(seq, received, topic, payload):
+    topic = topic.encode("utf-8")
+    body = HEADER.pack(0, 0, seq, received, len(topic))[SEQ_OFFSET:] + topic + payload
+    return struct.pack("<II", HEADER.size + len(topic) + len(payload), zlib.crc32(body)) + body
+
+
+def read_segment(path, after=0, limit=None):
+    """Records (seq, received, topic, payload) of a segment with seq > after"""
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        length, crc, seq, received, topic_len = HEADER.unpack_from(data, pos)
+        end = pos + length
+        if length < HEADER.size or end > len(data) or zlib.crc32(data[pos + SEQ_OFFSET:end]) != crc:
+            break  # torn write at the tail
+        if seq > after:
+            start = pos + HEADER.size
+            records.append((seq, received, data[start:start + topic_len].decode("utf-8"),
+                            data[start + topic_len:end]))
+            if limit is not None and len(records) >= limit:
+                break
+        pos = end
+    return records
+
+
+class Spool:
+    def __init__(self, apply, directory=SPOOL_DIR, fsync_interval=SPOOL_FSYNC_INTERVAL,
+                 segment_bytes=SEGMENT_BYTES, memory_records=SPOOL_MEMORY_RECORDS, batch=COMMIT_BATCH,
+                 skip=None):
+        self.apply = apply  # apply(records) must store them and the last seq atomically
+        self.skip = skip    # skip(seq) stores only the checkpoint; without it failed batches retry forever
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.memory_records = memory_records
+        self.batch = batch
+
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.segments = []      # [first seq, path] in order; the last one is open for appends
+        self.fd = None
+        self.size = 0
+        self.dirty = False
+        self.closing = []       # fds of rolled segments, fsynced and closed by the sync thread
+        self.next_seq = 1
+        self.committed = 0
+        self.memory = deque()   # records waiting for the committer
+        self.spilled_from = None  # first seq that is only on disk, None when all are in memory
+        self.lock_file = None
+        self.threads = []
+        self.stopped = threading.Event()
+
+        metrics.gauge("spool_backlog", "Spooled messages not yet in the database",
+                      fn=lambda: self.next_seq - 1 - self.committed)
+        metrics.gauge("spool_segments", "Spool segment files on disk", fn=lambda: len(self.segments))
+
+    def open(self, committed):
+        """Scan existing segments; records after `committed` are replayed"""
+        if self.fd is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl is not None:
+            self.lock_file = open(os.path.join(self.directory, "lock"), "w")
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f"Spool {self.directory} is in use by another process")
+
+        self.committed = committed
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("seg-") and n.endswith(".log"))
+        self.segments = [[int(n[4:-4]), os.path.join(self.directory, n)] for n in names]
+        last = committed
+        if self.segments:
+            # Only the newest segment can end in a torn record; appends always go to a new one
+            first, path = self.segments[-1]
+            records = read_segment(path)
+            if records:
+                last = max(last, records[-1][0])
+            else:
+                last = max(last, first - 1)
+                self.segments.pop()
+                os.remove(path)
+        self.next_seq = last + 1
+        if last > committed:
+            self.spilled_from = committed + 1
+            print(f"Replaying {last - committed} spooled messages")
+        self._collect()
+        self._new_segment()
+
+    def _new_segment(self):
+        if self.fd is not None:
+            self.closing.append(self.fd)
+        path = os.path.join(self.directory, f"seg-{self.next_seq:016d}.log")
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segments.append([self.next_seq, path])
+        self.size = 0
+
+    def append(self, topic, payload, received=None):
+        """Durably queue a message for the database; returns its sequence number"""
+        received = time.time() if received is None else received
+        with self.lock:
+            seq = self.next_seq
+            record = encode(seq, received, topic, payload)
+            if self.size + len(record) > self.segment_bytes and self.size:
+                self._new_segment()
+            os.write(self.fd, record)
+            self.size += len(record)
+            self.dirty = True
+            self.next_seq += 1
+            if self.spilled_from is None:
+                if len(self.memory) < self.memory_records:
+                    self.memory.append((seq, received, topic, payload))
+                else:
+                    self.spilled_from = seq
+            self.ready.notify()
+        appended.inc()
+        return seq
+
+    def _load_spilled(self):
+        """Read records that only exist on disk back into memory"""
+        with self.lock:
+            start = self.spilled_from
+            end = self.next_seq - 1
+            segments = [s[:] for s in self.segments]
+        records = []
+        for i, (first, path) in enumerate(segments):
+            following = segments[i + 1][0] if i + 1 < len(segments) else end + 1
+            if following <= start or first > end:
+                continue
+            records.extend(r for r in read_segment(path, start - 1, self.memory_records - len(records))
+                           if r[0] <= end)
+            if len(records) >= self.memory_records:
+                break
+        with self.lock:
+            self.memory.extend(records)
+            loaded_to = records[-1][0] if records else end
+            self.spilled_from = loaded_to + 1 if loaded_to + 1 < self.next_seq else None
+
+    def _take(self):
+        with self.lock:
+            while not self.memory and self.spilled_from is None and not self.stopped.is_set():
+                self.ready.wait(0.5)
+            spilled = not self.memory and self.spilled_from is not None
+        if spilled:
+            self._load_spilled()
+        with self.lock:
+            return [self.memory.popleft() for _ in range(min(self.batch, len(self.memory)))]
+
+    def _commit_loop(self):
+        delay = 0.1
+        failures = 0
+        batch = []
+        while True:
+            if not batch:
+                if self.stopped.is_set() and not self.memory and self.spilled_from is None:
+                    return
+                batch = self._take()
+                if not batch:
+                    continue
+            try:
+                if failures >= QUARANTINE_AFTER and self.skip is not None:
+                    self._isolate(batch)
+                else:
+                    self.apply(batch)
+                    self._committed(batch)
+            except Exception as err:
+                # Nothing more was stored; keep the batch and try again
+                failures += 1
+                commit_retries.inc()
+                print(f"Spool commit failed, retrying in {delay:.1f}s: {err}")
+                if self.stopped.wait(delay):
+                    return
+                delay = min(MAX_RETRY_DELAY, delay * 2)
+                continue
+            delay = 0.1
+            failures = 0
+            batch = []
+
+    def _committed(self, records):
+        batch_size.observe(len(records))
+        committed_records.inc(len(records))
+        with self.lock:
+            self.committed = records[-1][0]
+            self.ready.notify_all()
+            self._collect()
+
+    def _isolate(self, batch):
+        """Store a batch that keeps failing one record at a time, quarantining the ones that fail
+
+        A record is only quarantined if the checkpoint can be moved past it,
+        so while the database itself is unavailable nothing is set aside.
+        Raises with the records not yet settled left in `batch`.
+        """
+        while batch:
+            record = batch[0]
+            try:
+                self.apply([record])
+            except Exception as err:
+                self.skip(record[0])  # raises while the database is unavailable
+                self._quarantine(record, err)
+            self._committed([record])
+            batch.pop(0)
+
+    def _quarantine(self, record, err):
+        """Append a record that cannot be stored to quarantine.log, in segment format"""
+        seq, received, topic, payload = record
+        with open(os.path.join(self.directory, "quarantine.log"), "ab") as f:
+            f.write(encode(seq, received, topic, payload))
+        quarantined.inc()
+        print(f"Quarantined spooled message {seq} on {topic}: {err}")
+
+    def _collect(self):
+        """Delete segments whose records are all committed (lock held)"""
+        while len(self.segments) > 1 and self.segments[1][0] <= self.committed + 1:
+            _, path = self.segments.pop(0)
+            try:
+                os.remove(path)
+            except OSError as err:
+                print(f"Could not remove spool segment {path}: {err}")
+
+    def sync(self):
+        with self.lock:
+            fds = self.closing + [self.fd] if self.dirty or self.closing else []
+            closing, self.closing = self.closing, []
+            self.dirty = False
+        if not fds:
+            return
+        started = time.perf_counter()
+        for fd in fds:
+            os.fsync(fd)
+        fsync_seconds.observe(time.perf_counter() - started)
+        for fd in closing:
+            os.close(fd)
+
+    def _sync_loop(self):
+        while not self.stopped.wait(self.fsync_interval):
+            self.sync()
+
+    def start(self):
+        self.stopped.clear()
+        self.threads = [
+            threading.Thread(target=self._commit_loop, name="spool-commit", daemon=True),
+            threading.Thread(target=self._sync_loop, name="spool-sync", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def wait_committed(self, seq=None, timeout=None):
+        """Wait until everything appended so far (or up to seq) is in the database"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            seq = self.next_seq - 1 if seq is None else seq
+            while self.committed < seq:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.ready.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Commit what can be committed within `timeout`, then fsync and close"""
+        self.wait_committed(timeout=timeout)
+        self.stopped.set()
+        with self.lock:
+            self.ready.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.sync()
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
@@ -0,0 +1,447 @@
+"""Storage backends for sensor readings: SQLite, plus DuckDB for wide scans.
+
+All writes go to SQLite (smart_home.db), and so do all reads by default.
+Setting ANALYTICS_BACKEND=duckdb (with the duckdb package installed) adds
+an embedded columnar engine for analytical reads. Readings are exported
+from SQLite to one Parquet file per day that has readings, sorted by
+device and time, once the day can no longer receive late readings
+(LATENESS_WINDOW after it ends). DuckDB answers the exported part of a
+query from those files and SQLite answers the rest through its
+(device_id, timestamp) index; per-bucket results of the two are merged.
+
+Readings can still land in an exported day, from a spool replayed after
+downtime or a bulk load. Writers call written(), which marks those days
+dirty; they are answered from SQLite until the next export rewrites them.
+
+Bucket queries are routed by size. One whose exported part spans at
+least ANALYTICS_MIN_DEVICE_HOURS (devices x hours) goes to DuckDB when it
+is enabled; smaller ones, such as a single sensor's chart, stay on SQLite.
+Callers do not choose; see sensor_data.get_bucket_stats.
+
+    ANALYTICS_BACKEND=duckdb python main.py
+    python storage.py export                 # export closed days now
+    python storage.py hourly --days 90 > hourly.csv
+"""
+import argparse
+import bisect
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import Integer, cast, func
+
+import metrics
+from models import get_engine, get_session, SensorReading
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'sqlite')
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', 'analytics')
+ANALYTICS_MIN_DEVICE_HOURS = float(os.getenv('ANALYTICS_MIN_DEVICE_HOURS', 1000))
+# Seconds between exports of newly closed days
+ANALYTICS_EXPORT_INTERVAL = float(os.getenv('ANALYTICS_EXPORT_INTERVAL', 3600))
+
+# Timestamps are naive local times, bucketed on microseconds since this
+EPOCH = datetime(1970, 1, 1)
+# File in ANALYTICS_DIR holding the last day covered by the export run
+WATERMARK = "exported-through"
+
+readings = SensorReading.__table__
+
+query_seconds = metrics.histogram("storage_bucket_query_seconds", "Time to answer a bucketed readings query")
+routed_queries = metrics.counter("storage_analytics_queries", "Bucketed queries answered by the analytics engine")
+exported_days = metrics.counter("storage_exported_days", "Days of readings exported for analytics")
+
+
+def merge_buckets(rows, more):
+    """Merge two sorted lists of bucket rows, combining buckets found in both"""
+    if not more:
+        return rows
+    extra = {(row[0], row[1]): row for row in more}
+    merged = []
+    for row in rows:
+        other = extra.pop((row[0], row[1]), None)
+        if other is not None:
+            count = row[2] + other[2]
+            row = (row[0], row[1], count, (row[2] * row[3] + other[2] * other[3]) / count,
+                   row[4] + other[4], min(row[5], other[5]), max(row[6], other[6]))
+        merged.append(row)
+    merged.extend(extra.values())
+    merged.sort()  # two sorted runs, so this is a linear merge
+    return merged
+
+
+class SQLiteStore:
+    """Reads straight from smart_home.db"""
+
+    name = "sqlite"
+
+    def buckets(self, session, device_ids, since, bucket_seconds, origin=EPOCH, until=None):
+        """(device_id, bucket, count, mean, sum of squares, min, max) per bucket, sorted
+
+        Bucket n covers [origin + n * bucket_seconds, origin + (n + 1) * bucket_seconds).
+        Only readings in [since, until) are included.
+        """
+        value = SensorReading.value
+        # Integer microseconds: julianday() arithmetic is off by up to tens of
+        # microseconds and put readings on a bucket boundary in the previous bucket
+        micros = (cast(func.strftime("%s", SensorReading.timestamp), Integer) * 1_000_000
+                  + cast(func.substr(SensorReading.timestamp, 21, 6), Integer))
+        # Integer division; readings before `origin` are not asked for
+        bucket = (micros - (origin - EPOCH) // timedelta(microseconds=1)) // round(bucket_seconds * 1_000_000)
+        query = session.query(
+            SensorReading.device_id,
+            bucket,
+            func.count(value),
+            func.avg(value),
+            func.sum(value * value),
+            func.min(value),
+            func.max(value),
+        ).filter(
+            SensorReading.device_id.in_(device_ids),
+            SensorReading.timestamp >= since,
+            value.isnot(None),
+        )
+        if until is not None:
+            query = query.filter(SensorReading.timestamp < until)
+        return [tuple(row) for row in query.group_by(SensorReading.device_id, bucket)
+                .order_by(SensorReading.device_id, bucket).all()]
+
+
+def day_start(day):
+    return datetime.combine(day, datetime.min.time())
+
+
+def read_watermark(directory):
+    """Last day of the export run in a directory, or None before the first export"""
+    try:
+        with open(os.path.join(directory, WATERMARK)) as f:
+            return date.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def dirty_path(directory, day):
+    return os.path.join(directory, f"dirty-{day.isoformat()}")
+
+
+class DuckDBStore:
+    """DuckDB over daily Parquet exports, with SQLite for the days not exported yet"""
+
+    name = "duckdb"
+
+    def __init__(self, directory=ANALYTICS_DIR, fallback=None):
+        import duckdb
+
+        self.directory = directory
+        self.fallback = fallback or SQLiteStore()
+        self.connection = duckdb.connect()
+        self.error = duckdb.Error
+        self.lock = threading.Lock()
+        self.days = []        # exported days with readings, oldest first
+        self.dirty = set()    # exported days written to since; answered by SQLite until re-exported
+        self.through = None   # every day up to this one is exported or had no readings
+        self.mtime = None     # of the directory at the last scan
+        self.scan()
+
+    def scan(self):
+        """Re-read the exports, dirty markers and watermark from the directory"""
+        os.makedirs(self.directory, exist_ok=True)
+        mtime = os.stat(self.directory).st_mtime_ns
+        names = os.listdir(self.directory)
+        days = sorted(
+            date.fromisoformat(name[9:19]) for name in names
+            if name.startswith("readings-") and name.endswith(".parquet")
+        )
+        dirty = {date.fromisoformat(name[6:]) for name in names if name.startswith("dirty-")}
+        through = read_watermark(self.directory)
+        with self.lock:
+            self.days, self.dirty, self.through, self.mtime = days, dirty, through, mtime
+
+    def refresh(self):
+        """Rescan when the directory changed, e.g. a bulk load in another process marked days dirty"""
+        try:
+            changed = os.stat(self.directory).st_mtime_ns != self.mtime
+        except OSError:
+            changed = True
+        if changed:
+            self.scan()
+
+    def path(self, day):
+        return os.path.join(self.directory, f"readings-{day.isoformat()}.parquet")
+
+    def exported_until(self):
+        """Readings before this are answered from Parquet; None when nothing is exported"""
+        with self.lock:
+            if self.through is None:
+                return None
+            return day_start(self.through + timedelta(days=1))
+
+    def export(self, now=None):
+        """Re-export dirty days, then export the days with readings that closed since the last run"""
+        from mqtt_client import LATENESS_WINDOW
+
+        self.scan()
+        now = now or datetime.now()
+        last = (now - timedelta(seconds=LATENESS_WINDOW)).date() - timedelta(days=1)
+        with self.lock:
+            through, dirty = self.through, sorted(self.dirty)
+        exported = 0
+        with get_engine().connect() as conn:
+            for day in dirty:
+                # Cleared first: a write during the export marks the day again
+                try:
+                    os.remove(dirty_path(self.directory, day))
+                except FileNotFoundError:
+                    pass
+                self._export_day(conn, day)
+                with self.lock:
+                    self.dirty.discard(day)
+                exported += 1
+
+            first = None if through is None else through + timedelta(days=1)
+            if first is not None and first > last:
+                return exported
+            query = "SELECT DISTINCT substr(timestamp, 1, 10) FROM sensor_readings WHERE timestamp < ?"
+            params = (day_start(last + timedelta(days=1)).isoformat(" "),)
+            if first is not None:
+                query += " AND timestamp >= ?"
+                params += (day_start(first).isoformat(" "),)
+            days = sorted(date.fromisoformat(day) for (day,) in conn.exec_driver_sql(query, params))
+            conn.commit()
+            for day in days:
+                self._export_day(conn, day)
+                exported += 1
+            self._set_watermark(last)
+        return exported
+
+    def _set_watermark(self, day):
+        path = os.path.join(self.directory, WATERMARK)
+        with open(path + ".tmp", "w") as f:
+            f.write(day.isoformat())
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            self.through = day
+
+    def _export_day(self, conn, day):
+        import numpy as np
+
+        start = day_start(day)
+        rows = conn.exec_driver_sql(
+            "SELECT device_id, timestamp, value FROM sensor_readings WHERE timestamp >= ? AND timestamp < ?",
+            (start.isoformat(" "), (start + timedelta(days=1)).isoformat(" ")),
+        ).fetchall()
+        conn.commit()
+        path = self.path(day)
+        if not rows:
+            # Every reading of a re-exported day was deleted
+            with self.lock:
+                if day in self.days:
+                    self.days.remove(day)
+                    os.remove(path)
+            return
+        # Scanned by DuckDB as a table; NaN values become NULL
+        data = {  # noqa: F841
+            "device_id": np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            "timestamp": np.array([r[1] for r in rows], dtype=str),
+            "value": np.array([np.nan if r[2] is None else r[2] for r in rows], dtype=np.float64),
+        }
+        # COPY takes no parameter for its target, so the path is quoted as a SQL literal
+        target = (path + ".tmp").replace("'", "''")
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(
+                "COPY (SELECT device_id, CAST(timestamp AS TIMESTAMP) AS timestamp, value FROM data "
+                f"ORDER BY device_id, timestamp) TO '{target}' (FORMAT parquet)"
+            )
+            cursor.close()
+            os.replace(path + ".tmp", path)
+            if day not in self.days:
+                bisect.insort(self.days, day)
+        exported_days.inc()
+        logger.info("Exported %d readings of %s for analytics", len(rows), day)
+
+    def buckets(self, session, device_ids, since, bucket_seconds, origin=EPOCH, until=None):
+        """Same as SQLiteStore.buckets, from Parquet up to exported_until()"""
+        self.refresh()
+        boundary = self.exported_until()
+        if boundary is None or since >= boundary:
+            return self.fallback.buckets(session, device_ids, since, bucket_seconds, origin, until)
+        end = boundary if until is None else min(until, boundary)
+
+        import numpy as np
+
+        def overlaps(day):
+            return day_start(day) < end and day_start(day + timedelta(days=1)) > since
+
+        with self.lock:
+            files = [self.path(d) for d in self.days if d not in self.dirty and overlaps(d)]
+            stale = sorted(d for d in self.dirty if overlaps(d))
+            cursor = self.connection.cursor()
+        # Scanned by DuckDB as a table; a semi-join is faster than binding a long IN list
+        wanted = {"device_id": np.fromiter(device_ids, dtype=np.int64)}  # noqa: F841
+        rows = []
+        try:
+            if files:
+                rows = cursor.execute(
+                    "SELECT device_id, CAST(floor((epoch_us(timestamp) - ?) / ?) AS BIGINT) AS bucket, "
+                    "count(value), avg(value), sum(value * value), min(value), max(value) "
+                    f"FROM read_parquet([{', '.join(repr(f) for f in files)}]) "
+                    "WHERE device_id IN (SELECT device_id FROM wanted) "
+                    "AND timestamp >= ? AND timestamp < ? AND value IS NOT NULL "
+                    "GROUP BY ALL ORDER BY device_id, bucket",
+                    [(origin - EPOCH) // timedelta(microseconds=1), round(bucket_seconds * 1_000_000), since, end],
+                ).fetchall()
+        except self.error as err:
+            # Exports removed underneath us, e.g. by hand or by another process
+            logger.warning("Analytics query failed, answering from SQLite: %s", err)
+            self.scan()
+            return self.fallback.buckets(session, device_ids, since, bucket_seconds, origin, until)
+        finally:
+            cursor.close()
+        # Days written to since their export are read from SQLite until re-exported
+        for day in stale:
+            rows = merge_buckets(rows, self.fallback.buckets(
+                session, device_ids, max(since, day_start(day)), bucket_seconds, origin,
+                min(end, day_start(day + timedelta(days=1)))))
+        if until is not None and until <= boundary:
+            return rows
+        return merge_buckets(rows, self.fallback.buckets(session, device_ids, boundary, bucket_seconds, origin, until))
+
+
+sqlite_store = SQLiteStore()
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+def analytics():
+    """The analytics store, or None when it is not enabled or not installed"""
+    global _analytics
+    if ANALYTICS_BACKEND != 'duckdb':
+        return None
+    if _analytics is None:
+        with _analytics_lock:
+            if _analytics is None:
+                try:
+                    _analytics = DuckDBStore(fallback=sqlite_store)
+                except ImportError:
+                    logger.warning("ANALYTICS_BACKEND=duckdb but duckdb is not installed; using SQLite")
+                    _analytics = False
+    return _analytics or None
+
+
+def route(device_count, since, until=None):
+    """Store that should answer a scan of device_count devices over [since, until)"""
+    store = analytics()
+    if store is None:
+        return sqlite_store
+    boundary = store.exported_until()
+    if boundary is None or since >= boundary:
+        return sqlite_store
+    # Only the exported part is scanned by DuckDB; the rest goes to SQLite either way
+    hours = (min(until or boundary, boundary) - since).total_seconds() / 3600
+    return store if device_count * hours >= ANALYTICS_MIN_DEVICE_HOURS else sqlite_store
+
+
+def buckets(session, device_ids, since, bucket_seconds, origin=EPOCH, until=None, store=None):
+    """Routed SQLiteStore.buckets; `store` is a store already chosen by route()"""
+    started = time.perf_counter()
+    if store is None:
+        store = route(len(device_ids), since, until)
+    rows = store.buckets(session, device_ids, since, bucket_seconds, origin, until)
+    if store is not sqlite_store:
+        routed_queries.inc()
+    query_seconds.observe(time.perf_counter() - started)
+    return rows
+
+
+def written(first, last):
+    """Call after readings stamped between first and last were stored
+
+    Exported days in that range are marked dirty with a file in
+    ANALYTICS_DIR, so this works from any process (e.g. bulk_loader) and
+    without duckdb installed. Queries read dirty days from SQLite until
+    the next export rewrites them.
+    """
+    if ANALYTICS_BACKEND != 'duckdb':
+        return
+    through = read_watermark(ANALYTICS_DIR)
+    if through is None or first.date() > through:
+        return
+    day = first.date()
+    while day <= min(last.date(), through):
+        open(dirty_path(ANALYTICS_DIR, day), "a").close()
+        day += timedelta(days=1)
+
+
+def start():
+    """Export closed days in the background, now and every ANALYTICS_EXPORT_INTERVAL"""
+    store = analytics()
+    if store is None:
+        return None
+
+    def run():
+        while True:
+            try:
+                store.export()
+            except Exception as err:
+                logger.error("Analytics export failed: %s", err)
+            time.sleep(ANALYTICS_EXPORT_INTERVAL)
+
+    thread = threading.Thread(target=run, name="analytics-export", daemon=True)
+    thread.start()
+    return thread
+
+
+def export_hourly(out, days):
+    """Write hourly count/mean/min/max of every sensor over the last `days` as CSV"""
+    from models import Device
+
+    session = get_session()
+    try:
+        device_ids = [i for (i,) in session.query(Device.id).filter(Device.type.in_(("temperature", "humidity")))]
+        since = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+        store = route(len(device_ids), since)
+        rows = buckets(session, device_ids, since, 3600, store=store)
+    finally:
+        session.close()
+    writer = csv.writer(out)
+    writer.writerow(["device_id", "hour", "count", "mean", "min", "max"])
+    for device_id, bucket, count, mean, _, low, high in rows:
+        writer.writerow([device_id, (EPOCH + timedelta(hours=bucket)).isoformat(" "), count,
+                         f"{mean:.3f}", low, high])
+    return len(rows), store.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics storage for sensor readings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="Export closed days to Parquet for DuckDB")
+    hourly = sub.add_parser("hourly", help="Hourly statistics of every sensor as CSV on stdout")
+    hourly.add_argument("--days", type=float, default=90)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        store = analytics()
+        if store is None:
+            parser.error("set ANALYTICS_BACKEND=duckdb and install duckdb to export")
+        started = time.perf_counter()
+        count = store.export()
+        print(f"Exported {count} days in {time.perf_counter() - started:.1f} s, "
+              f"readings before {store.exported_until()} are served from {store.directory}")
+    else:
+        started = time.perf_counter()
+        count, backend = export_hourly(sys.stdout, args.days)
+        print(f"{count} rows from {backend} in {time.perf_counter() - started:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
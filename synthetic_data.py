@@ -0,0 +1,113 @@
+"""Vectorized synthetic sensor history.
+
+Produces realistic-looking readings for many devices at once: a diurnal
+cycle, gaussian noise, slow random-walk drift, occasional spikes and
+dropped samples, all shaped per device type. Everything is computed on
+(devices x samples) NumPy arrays, so months of data for thousands of
+devices is a handful of array operations per chunk.
+"""
+from datetime import datetime
+
+import numpy as np
+
+# Shape of the generated signal for each device type
+TYPE_PROFILES = {
+    "temperature": {
+        "base": 22.0,
+        "base_spread": 1.5,   # stddev of per-device base offset
+        "amplitude": 2.0,     # diurnal swing
+        "phase_hours": 6.0,   # hour at which the cycle crosses the base going up
+        "noise": 0.5,
+        "drift": 0.02,        # random-walk step stddev per sample
+        "spike_rate": 0.001,
+        "spike_scale": 6.0,
+        "dropout_rate": 0.01,
+        "low": -40.0,
+        "high": 60.0,
+    },
+    "humidity": {
+        "base": 45.0,
+        "base_spread": 5.0,
+        "amplitude": -5.0,    # humidity falls as the day warms up
+        "phase_hours": 6.0,
+        "noise": 1.5,
+        "drift": 0.05,
+        "spike_rate": 0.001,
+        "spike_scale": 15.0,
+        "dropout_rate": 0.01,
+        "low": 0.0,
+        "high": 100.0,
+    },
+}
+DEFAULT_PROFILE = TYPE_PROFILES["temperature"]
+
+# Devices generated per chunk; bounds peak memory of iter_history
+CHUNK_DEVICES = 256
+
+
+def time_grid(hours, interval_minutes=5, end=None):
+    """Evenly spaced datetime64[us] timestamps covering the last `hours`"""
+    end = np.datetime64(end or datetime.now(), "us")
+    step = np.timedelta64(int(interval_minutes * 60 * 1_000_000), "us")
+    count = int(hours * 60 // interval_minutes) + 1
+    return end - step * np.arange(count - 1, -1, -1)
+
+
+def _generate_chunk(rng, device_ids, device_types, timestamps):
+    """Generate one (devices x samples) block and flatten the surviving samples"""
+    n_devices, n_samples = len(device_ids), len(timestamps)
+    profiles = [TYPE_PROFILES.get(t, DEFAULT_PROFILE) for t in device_types]
+
+    def column(key):
+        return np.array([p[key] for p in profiles], dtype=np.float64)[:, None]
+
+    hour_of_day = (timestamps - timestamps.astype("datetime64[D]")) / np.timedelta64(1, "h")
+
+    base = column("base") + rng.normal(0.0, 1.0, (n_devices, 1)) * column("base_spread")
+    diurnal = column("amplitude") * np.sin(2 * np.pi * (hour_of_day[None, :] - column("phase_hours")) / 24)
+    noise = rng.normal(0.0, 1.0, (n_devices, n_samples)) * column("noise")
+    drift = np.cumsum(rng.normal(0.0, 1.0, (n_devices, n_samples)), axis=1) * column("drift")
+
+    values = base + diurnal + noise + drift
+
+    spikes = rng.random((n_devices, n_samples)) < column("spike_rate")
+    values += spikes * rng.choice([-1.0, 1.0], (n_devices, n_samples)) * column("spike_scale")
+
+    np.clip(values, column("low"), column("high"), out=values)
+    np.round(values, 1, out=values)
+
+    keep = rng.random((n_devices, n_samples)) >= column("dropout_rate")
+    ids = np.repeat(np.asarray(device_ids, dtype=np.int64), n_samples).reshape(n_devices, n_samples)
+    ts = np.broadcast_to(timestamps, (n_devices, n_samples))
+    return ids[keep], ts[keep], values[keep]
+
+
+def iter_history(device_ids, device_types=None, hours=48, interval_minutes=5,
+                 end=None, seed=None, chunk_devices=CHUNK_DEVICES):
+    """Yield (device_ids, timestamps, values) array chunks of synthetic history
+
+    device_types is a sequence parallel to device_ids, or a single type for
+    all of them. Pass a seed for reproducible output.
+    """
+    device_ids = list(device_ids)
+    if device_types is None or isinstance(device_types, str):
+        device_types = [device_types or "temperature"] * len(device_ids)
+    rng = np.random.default_rng(seed)
+    timestamps = time_grid(hours, interval_minutes, end)
+
+    for start in range(0, len(device_ids), chunk_devices):
+        yield _generate_chunk(
+            rng,
+            device_ids[start:start + chunk_devices],
+            device_types[start:start + chunk_devices],
+            timestamps,
+        )
+
+
+def generate_history(device_ids, device_types=None, hours=48, interval_minutes=5, end=None, seed=None):
+    """Return synthetic history for all devices as three flat arrays"""
+    chunks = list(iter_history(device_ids, device_types, hours, interval_minutes, end, seed))
+    if not chunks:
+        return np.array([], np.int64), np.array([], "datetime64[us]"), np.array([], np.float64)
+    ids, timestamps, values = zip(*chunks)
+    return np.concatenate(ids), np.concatenate(timestamps), np.concatenate(values)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from migrations import migrate
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A migrated smart_home.db in a temporary directory, used as the app's database"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(models, "DATABASE_URL", f"sqlite:///{tmp_path / 'smart_home.db'}")
+    monkeypatch.setattr(models, "_engine", None)
+    migrate(background=False)
+    yield tmp_path / "smart_home.db"
+    models.get_engine().dispose()
+    models._engine = None
+
+
+@pytest.fixture
+def sensor(db):
+    """A temperature sensor on home/test/temperature"""
+    session = models.get_session()
+    user = models.User(username="test", password_hash="x")
+    session.add(user)
+    session.flush()
+    device = models.Device(user_id=user.id, name="Sensor", type="temperature",
+                           mqtt_topic="home/test/temperature", location="Lab")
+    session.add(device)
+    session.commit()
+    device_id = device.id
+    session.close()
+    return device_id
@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from bulk_loader import BulkLoader, format_timestamp
+from models import get_engine
+
+
+def rows(device_id, count):
+    return [(device_id, 20.0 + i, format_timestamp(f"2024-01-01T{i // 60:02d}:{i % 60:02d}:00"))
+            for i in range(count)]
+
+
+def test_load_while_another_connection_is_open(sensor, db):
+    other = sqlite3.connect(db)
+    other.execute("SELECT count(*) FROM devices").fetchone()
+    try:
+        loaded, _ = BulkLoader().load(rows(sensor, 100))
+    finally:
+        other.close()
+
+    assert loaded == 100
+    with get_engine().connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("SELECT count(*) FROM sensor_readings").scalar() == 100
+
+
+def test_reloading_skips_stored_rows(sensor):
+    BulkLoader().load(rows(sensor, 50))
+    BulkLoader().load(rows(sensor, 50))
+
+    with get_engine().connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM sensor_readings").scalar() == 50
+
+
+def test_load_rebuilds_location_rollups(sensor):
+    BulkLoader().load(rows(sensor, 90))
+
+    with get_engine().connect() as conn:
+        rollups = conn.exec_driver_sql(
+            "SELECT hour, count, total, min_value, max_value FROM location_rollups ORDER BY hour"
+        ).fetchall()
+    assert [tuple(r) for r in rollups] == [
+        ("2024-01-01 00:00:00.000000", 60, sum(20.0 + i for i in range(60)), 20.0, 79.0),
+        ("2024-01-01 01:00:00.000000", 30, sum(20.0 + i for i in range(60, 90)), 80.0, 109.0),
+    ]
+
+
+def test_aware_timestamps_are_stored_as_local_time(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    try:
+        assert format_timestamp("2024-01-01T12:00:00+02:00") == "2024-01-01 10:00:00.000000"
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,53 @@
+import time
+
+from sqlalchemy import select
+
+from liveness import LivenessTracker
+from models import Device, get_engine, get_session
+
+
+class FlakySession:
+    """A session whose execute fails while `failing`, running `during` first"""
+
+    def __init__(self, failing, during=None):
+        self.session = get_session()
+        self.failing = failing
+        self.during = during
+
+    def execute(self, *args, **kwargs):
+        if self.during:
+            self.during()
+        if self.failing:
+            raise OSError("database is locked")
+        return self.session.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def is_online(device_id):
+    with get_engine().connect() as conn:
+        return conn.execute(select(Device.is_online).where(Device.id == device_id)).scalar()
+
+
+def test_failed_flush_is_retried(db, sensor):
+    failing = True
+    tracker = LivenessTracker(session_factory=lambda: FlakySession(failing))
+    tracker.seen(sensor, "temperature")
+
+    assert tracker.flush() == []
+    assert tracker.changes == {sensor: True}
+
+    failing = False
+    assert tracker.flush() == [(sensor, True)]
+    assert is_online(sensor)
+
+
+def test_newer_transition_wins_over_failed_flush(db, sensor):
+    tracker = LivenessTracker(session_factory=lambda: FlakySession(
+        True, during=lambda: tracker.advance(time.monotonic() + 86400)))
+    tracker.seen(sensor, "temperature")
+
+    # The device expires while the online transition is being written
+    assert tracker.flush() == []
+    assert tracker.changes == {sensor: False}
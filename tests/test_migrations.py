@@ -0,0 +1,57 @@
+from migrations import MIGRATIONS, current_version, migrate
+from models import get_engine
+
+
+def downgrade_to_version_4(conn):
+    """Back to the schema before unique readings and rollups, keeping the data"""
+    conn.exec_driver_sql("DROP INDEX ix_sensor_readings_device_ts")
+    conn.exec_driver_sql("CREATE INDEX ix_sensor_readings_device_ts ON sensor_readings (device_id, timestamp)")
+    conn.exec_driver_sql("DELETE FROM location_rollups")
+    conn.exec_driver_sql("PRAGMA user_version = 4")
+
+
+def test_migrations_5_and_6_dedupe_readings_and_build_rollups(db, sensor):
+    with get_engine().connect() as conn:
+        downgrade_to_version_4(conn)
+        for value, timestamp in [(20.0, "2024-01-01 10:00:00.000000"), (20.0, "2024-01-01 10:00:00.000000"),
+                                 (22.0, "2024-01-01 10:30:00.000000"), (30.0, "2024-01-01 11:00:00.000000")]:
+            conn.exec_driver_sql(
+                "INSERT INTO sensor_readings (device_id, value, timestamp) VALUES (?, ?, ?)",
+                (sensor, value, timestamp),
+            )
+        conn.commit()
+
+    migrate(background=False)
+
+    with get_engine().connect() as conn:
+        assert current_version(conn) == MIGRATIONS[-1].version
+        assert conn.exec_driver_sql("SELECT count(*) FROM sensor_readings").scalar() == 3
+        unique = {row[1]: row[2] for row in conn.exec_driver_sql("PRAGMA index_list(sensor_readings)")}
+        assert unique["ix_sensor_readings_device_ts"]
+        rollups = conn.exec_driver_sql(
+            "SELECT location, hour, count, total, min_value, max_value FROM location_rollups ORDER BY hour"
+        ).fetchall()
+    assert [tuple(r) for r in rollups] == [
+        ("Lab", "2024-01-01 10:00:00.000000", 2, 42.0, 20.0, 22.0),
+        ("Lab", "2024-01-01 11:00:00.000000", 1, 30.0, 30.0, 30.0),
+    ]
+
+
+def test_rerunning_migrations_5_and_6_changes_nothing(db, sensor):
+    with get_engine().connect() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO sensor_readings (device_id, value, timestamp) VALUES (?, 21.0, '2024-01-01 10:00:00.000000')",
+            (sensor,),
+        )
+        conn.commit()
+
+    # An upgrade interrupted after its work but before the version bump is run again
+    for _ in range(2):
+        with get_engine().connect() as conn:
+            conn.exec_driver_sql("PRAGMA user_version = 4")
+            conn.commit()
+        migrate(background=False)
+
+    with get_engine().connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM sensor_readings").scalar() == 1
+        assert conn.exec_driver_sql("SELECT count, total FROM location_rollups").fetchall() == [(1, 21.0)]
@@ -0,0 +1,33 @@
+import json
+from datetime import datetime
+
+from mqtt_client import MQTTClient
+from mqtt_recorder import Message
+
+TOPIC = "home/test/temperature"
+
+
+def message(topic, payload):
+    return Message(topic, json.dumps(payload).encode(), 0)
+
+
+def test_arrival_marks_device_online_without_the_committer(db, sensor):
+    client = MQTTClient()
+    client.start_ingest()
+    try:
+        client.on_message(None, None, message(TOPIC, {"value": 21, "timestamp": datetime.now().isoformat()}))
+        # Nothing else calls seen(), so this comes from the network thread
+        assert client.liveness.online.get(sensor)
+    finally:
+        client.spool.stop()
+
+
+def test_own_control_publishes_are_not_spooled(db, sensor):
+    client = MQTTClient()
+    client.spool.open(0)
+    try:
+        client.on_message(None, None, message(f"{TOPIC}/control", {"command": "set", "state": "ON"}))
+        assert client.spool.next_seq == 1
+        assert not client.liveness.online.get(sensor)
+    finally:
+        client.spool.stop(timeout=0)
@@ -0,0 +1,97 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+import mqtt_client
+from models import get_engine, SensorReading
+from mqtt_client import MQTTClient
+import mqtt_recorder
+from mqtt_recorder import LogWriter, read_log, replay
+
+TOPIC = "home/test/temperature"
+
+
+def record_capture(path, start, count=20):
+    """A capture of `count` readings, one a minute, stamped by the device when sent"""
+    writer = LogWriter(path, start=start)
+    for i in range(count):
+        sent = start + i * 60
+        payload = {"value": 20 + i / 10, "timestamp": datetime.fromtimestamp(sent).isoformat()}
+        writer.write(TOPIC, json.dumps(payload).encode(), received=sent + 0.5)
+    writer.close()
+
+
+def replay_into(client, path, shift=True):
+    """Replay a capture as fast as possible and store it through the ingest path"""
+    start, messages = read_log(path)
+    delivered = []
+    replay(messages, delivered.append, speed=None, start=start if shift else None)
+    now = time.time()
+    client.store_batch([(seq, now, m.topic, m.payload) for seq, m in enumerate(delivered, 1)])
+
+
+def stored(device_id):
+    with get_engine().connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(SensorReading.__table__)
+            .where(SensorReading.device_id == device_id)
+        ).scalar()
+
+
+def test_replay_of_capture_older_than_lateness_window(sensor, tmp_path):
+    path = tmp_path / "old.mqr"
+    record_capture(path, time.time() - 3 * mqtt_client.LATENESS_WINDOW)
+    client = MQTTClient()
+
+    replay_into(client, path)
+
+    assert stored(sensor) == 20
+
+
+def test_replaying_twice_stores_new_readings(sensor, tmp_path):
+    path = tmp_path / "recent.mqr"
+    record_capture(path, time.time() - 30 * 60)
+    client = MQTTClient()
+
+    replay_into(client, path)
+    time.sleep(0.01)
+    replay_into(client, path)
+
+    assert stored(sensor) == 40
+
+
+def test_keep_timestamps_drops_old_capture_as_late(sensor, tmp_path):
+    path = tmp_path / "old.mqr"
+    record_capture(path, time.time() - 3 * mqtt_client.LATENESS_WINDOW)
+    client = MQTTClient()
+
+    replay_into(client, path, shift=False)
+
+    assert stored(sensor) == 0
+
+
+def test_gap_after_long_silence_is_measured_from_real_time(tmp_path):
+    path = tmp_path / "gap.mqr"
+    writer = LogWriter(path, start=0)
+    writer.write(TOPIC, b"1", received=0)
+    writer.write(TOPIC, b"2", received=3 * 3600)       # shortened to MAX_GAP_US
+    writer.write(TOPIC, b"3", received=3 * 3600 + 10)  # 10 s later, not 10 s plus the cut
+    writer.close()
+
+    _, messages = read_log(path)
+    offsets = [m.offset for m in messages]
+    cap = mqtt_recorder.MAX_GAP_US / 1_000_000
+    assert offsets == [0, cap, cap + 10]
+
+
+def test_too_many_topics(tmp_path, monkeypatch):
+    monkeypatch.setattr(mqtt_recorder, "NEW_TOPIC", 3)
+    writer = LogWriter(tmp_path / "topics.mqr", start=0)
+    for i in range(3):
+        writer.write(f"home/{i}", b"1", received=i)
+    with pytest.raises(ValueError, match="at most 3 topics"):
+        writer.write("home/3", b"1", received=3)
+    writer.close()
@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+
+from models import SensorReading, get_session
+from reading_cache import ReadingCache
+
+
+def test_unread_window_is_trimmed_on_append(db, sensor):
+    now = datetime.now().replace(microsecond=0)
+    session = get_session()
+    session.add(SensorReading(device_id=sensor, value=20.0, timestamp=now))
+    session.commit()
+
+    cache = ReadingCache()
+    assert cache.get(session, sensor, 1) is not None
+    # A day of readings, one a minute, without the window being read
+    for minute in range(1, 24 * 60 + 1):
+        cache.add_reading(sensor, now + timedelta(minutes=minute), 20.0 + minute / 100)
+    session.close()
+
+    window = cache.windows[(sensor, 1)]
+    timestamps = window.timestamps[window.start:window.end]
+    assert len(timestamps) == 61  # the newest reading and the hour before it
+    assert (timestamps[-1] - timestamps[0]).astype("timedelta64[m]").astype(int) == 60
+    assert len(window.values) <= 256
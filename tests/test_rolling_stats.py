@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import rolling_stats
+from models import SensorReading, get_session
+from rolling_stats import StatsRegistry
+
+
+def store(session, device_id, timestamps):
+    for i, timestamp in enumerate(timestamps):
+        session.add(SensorReading(device_id=device_id, value=20.0 + i, timestamp=timestamp))
+    session.commit()
+
+
+def test_readings_seeded_by_warm_are_not_counted_twice(db, sensor):
+    now = datetime.now()
+    earlier = [now - timedelta(minutes=m) for m in (30, 20, 10)]
+    session = get_session()
+    store(session, sensor, earlier)
+
+    registry = StatsRegistry()
+    registry.warm(session, [sensor])
+    session.close()
+    assert registry.get(sensor, "1h")["count"] == 3
+
+    # Committed before warm's query, delivered to the registry after it
+    registry.add_reading(sensor, earlier[-1], 22.0)
+    assert registry.get(sensor, "1h")["count"] == 3
+
+    registry.add_reading(sensor, datetime.now(), 25.0)
+    assert registry.get(sensor, "1h")["count"] == 4
+
+
+def test_readings_added_while_warming_are_kept(db, sensor, monkeypatch):
+    session = get_session()
+    store(session, sensor, [datetime.now() - timedelta(minutes=5)])
+    registry = StatsRegistry()
+    query = rolling_stats.get_bucket_stats
+    added = []
+
+    def query_then_ingest(*args):
+        if not added:
+            # The lock is not held while querying
+            added.append(datetime.now())
+            registry.add_reading(sensor, added[0], 30.0)
+        return query(*args)
+
+    monkeypatch.setattr(rolling_stats, "get_bucket_stats", query_then_ingest)
+    registry.warm(session, [sensor])
+    session.close()
+
+    stats = registry.get(sensor, "1h")
+    assert stats["count"] == 2
+    assert stats["max"] == 30.0
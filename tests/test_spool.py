@@ -0,0 +1,85 @@
+import os
+import threading
+
+import pytest
+
+import spool
+from spool import Spool, read_segment
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(spool, "MAX_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(spool, "QUARANTINE_AFTER", 2)
+
+
+class Store:
+    """apply/skip callbacks recording what was stored, with a checkpoint like store_batch"""
+
+    def __init__(self, poison=b"poison"):
+        self.stored = []
+        self.checkpoint = 0
+        self.poison = poison
+        self.skip_fails = False
+        self.skipped = []
+        self.lock = threading.Lock()
+
+    def apply(self, records):
+        if any(r[3] == self.poison for r in records):
+            raise ValueError("cannot store")
+        with self.lock:
+            self.stored.extend(r[3] for r in records)
+            self.checkpoint = records[-1][0]
+
+    def skip(self, seq):
+        if self.skip_fails:
+            raise OSError("database is locked")
+        self.skipped.append(seq)
+        self.checkpoint = seq
+
+
+def open_spool(directory, store, committed=0):
+    s = Spool(store.apply, directory=str(directory), fsync_interval=0.01, skip=store.skip)
+    s.open(committed)
+    s.start()
+    return s
+
+
+def test_replays_records_after_checkpoint(tmp_path):
+    store = Store()
+    first = Spool(store.apply, directory=str(tmp_path), fsync_interval=0.01)
+    first.open(0)
+    for i in range(5):
+        first.append("home/a", b"%d" % i)
+    first.stop(timeout=0)  # never started: nothing committed
+
+    again = open_spool(tmp_path, store, committed=2)
+    assert again.wait_committed(timeout=5)
+    again.stop()
+
+    assert store.stored == [b"2", b"3", b"4"]
+
+
+def test_failing_record_is_quarantined_and_skipped(tmp_path):
+    store = Store()
+    s = open_spool(tmp_path, store)
+    for payload in (b"a", b"poison", b"b"):
+        s.append("home/a", payload)
+    assert s.wait_committed(timeout=5)
+    s.stop()
+
+    assert store.stored == [b"a", b"b"]
+    assert store.skipped == [2]
+    assert [r[3] for r in read_segment(os.path.join(tmp_path, "quarantine.log"))] == [b"poison"]
+
+
+def test_nothing_is_quarantined_while_skip_fails(tmp_path):
+    store = Store()
+    store.skip_fails = True
+    s = open_spool(tmp_path, store)
+    s.append("home/a", b"poison")
+    assert not s.wait_committed(timeout=0.3)
+    s.stop(timeout=0)
+
+    assert store.checkpoint == 0
+    assert not os.path.exists(os.path.join(tmp_path, "quarantine.log"))
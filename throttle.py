@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class UpdateThrottle:
+    """Run `flush` at most once every `interval` seconds
+
+    request() may be called from any thread and any number of times; calls
+    that arrive while a flush is already scheduled are coalesced into it.
+    """
+
+    def __init__(self, interval, flush):
+        self.interval = interval
+        self.flush = flush
+        self.lock = threading.Lock()
+        self.timer = None
+        self.last_run = 0.0
+        self.stopped = False
+
+    def request(self):
+        with self.lock:
+            if self.stopped or self.timer is not None:
+                return
+            delay = max(0.0, self.last_run + self.interval - time.monotonic())
+            self.timer = threading.Timer(delay, self._run)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _run(self):
+        with self.lock:
+            self.timer = None
+            if self.stopped:
+                return
+            self.last_run = time.monotonic()
+        self.flush()
+
+    def stop(self):
+        """Cancel any scheduled flush and ignore further requests"""
+        with self.lock:
+            self.stopped = True
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+class Debouncer:
+    """Run `action(*args)` once calls have stopped for `delay` seconds"""
+
+    def __init__(self, delay, action):
+        self.delay = delay
+        self.action = action
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def call(self, *args):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.action, args)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None